@@ -21,8 +21,8 @@
 from re import sub
 
 # Third party imports
-from cloudify.exceptions import OperationRetry
-from cloudify_aws.common import decorators, utils
+from cloudify.exceptions import NonRecoverableError, OperationRetry
+from cloudify_aws.common import constants, decorators, utils
 from cloudify_aws.autoscaling import AutoscalingBase
 
 # Boto
@@ -42,6 +42,17 @@ INSTANCES = 'Instances'
 SUBNET_LIST = 'VPCZoneIdentifier'
 SUBNET_TYPE = 'cloudify.nodes.aws.ec2.Subnet'
 SUBNET_TYPE_DEPRECATED = 'cloudify.aws.nodes.Subnet'
+AUTOSCALING_INSTANCES = 'AutoScalingInstances'
+# API limits of instance IDs per call
+DETACH_MAX_INSTANCES = 20
+DESCRIBE_MAX_INSTANCES = 50
+TERMINATED = 'Terminated'
+WARM_POOL = 'WarmPoolConfiguration'
+WARM_POOL_DELETING = 'PendingDelete'
+REFRESH_ID = 'InstanceRefreshId'
+REFRESH_SUCCESSFUL = ['Successful']
+REFRESH_PENDING = ['Pending', 'InProgress', 'Cancelling',
+                   'RollbackInProgress']
 
 
 class AutoscalingGroup(AutoscalingBase):
@@ -98,19 +109,102 @@ class AutoscalingGroup(AutoscalingBase):
         self.logger.debug('Response: %s' % res)
         return res
 
-    def remove_instances(self, params=None):
+    def detach_instances(self, instance_ids,
+                         max_workers=constants.DEFAULT_MAX_WORKERS):
         """
-            Deletes an existing AWS Autoscaling Group.
+            Detaches instances from an AWS Autoscaling Group, in parallel
+            calls of at most DETACH_MAX_INSTANCES instances.
+        :return: list of errors of the failed calls
+        """
+        def _detach(chunk):
+            return self.client.detach_instances(**{
+                RESOURCE_NAME: self.resource_id,
+                'ShouldDecrementDesiredCapacity': False,
+                INSTANCE_IDS: chunk})
+
+        self.logger.debug('Detaching %d instances from %s ID# "%s"'
+                          % (len(instance_ids), self.type_name,
+                             self.resource_id))
+        return [error for _, _, error in utils.run_in_parallel(
+            _detach,
+            list(utils.chunks(instance_ids, DETACH_MAX_INSTANCES)),
+            max_workers) if error]
+
+    def put_warm_pool(self, params):
         """
-        self.logger.debug('Removing %s with parameters: %s'
+            Creates or updates the warm pool of an AWS Autoscaling Group.
+        """
+        params = dict(params, **{RESOURCE_NAME: self.resource_id})
+        self.logger.debug('Putting warm pool of %s with parameters: %s'
                           % (self.type_name, params))
-        try:
-            res = self.client.detach_instances(**params)
-        except ClientError:
-            pass
-        else:
-            self.logger.debug('Response: %s' % res)
-            return res
+        res = self.client.put_warm_pool(**params)
+        self.logger.debug('Response: %s' % res)
+        return res
+
+    def describe_warm_pool(self):
+        """
+            Gets the warm pool of an AWS Autoscaling Group.
+        """
+        return self.client.describe_warm_pool(
+            **{RESOURCE_NAME: self.resource_id})
+
+    def delete_warm_pool(self, force_delete=True):
+        """
+            Deletes the warm pool of an AWS Autoscaling Group.
+        """
+        self.logger.debug('Deleting warm pool of %s ID# "%s"'
+                          % (self.type_name, self.resource_id))
+        return self.client.delete_warm_pool(
+            **{RESOURCE_NAME: self.resource_id,
+               'ForceDelete': force_delete})
+
+    def start_instance_refresh(self, params):
+        """
+            Starts an instance refresh of an AWS Autoscaling Group.
+        """
+        params = dict(params, **{RESOURCE_NAME: self.resource_id})
+        self.logger.debug('Starting instance refresh of %s with '
+                          'parameters: %s' % (self.type_name, params))
+        return self.client.start_instance_refresh(**params)[REFRESH_ID]
+
+    def describe_instance_refresh(self, refresh_id):
+        """
+            Gets an instance refresh of an AWS Autoscaling Group.
+        """
+        refreshes = self.client.describe_instance_refreshes(
+            **{RESOURCE_NAME: self.resource_id,
+               'InstanceRefreshIds': [refresh_id]}).get('InstanceRefreshes')
+        return refreshes[0] if refreshes else None
+
+    def cancel_instance_refresh(self):
+        """
+            Cancels the running instance refresh of an AWS Autoscaling Group.
+        """
+        return self.client.cancel_instance_refresh(
+            **{RESOURCE_NAME: self.resource_id})[REFRESH_ID]
+
+    def get_remaining_instances(self, instance_ids,
+                                max_workers=constants.DEFAULT_MAX_WORKERS):
+        """
+            Gets which of the instances are still in the Autoscaling Group,
+            in parallel calls of at most DESCRIBE_MAX_INSTANCES instances.
+        """
+        def _describe(chunk):
+            return self.client.describe_auto_scaling_instances(
+                InstanceIds=chunk).get(AUTOSCALING_INSTANCES, [])
+
+        remaining = []
+        for _, instances, error in utils.run_in_parallel(
+                _describe,
+                list(utils.chunks(instance_ids, DESCRIBE_MAX_INSTANCES)),
+                max_workers):
+            if error:
+                raise error
+            remaining.extend(
+                instance[INSTANCE_ID] for instance in instances
+                if instance.get(RESOURCE_NAME) == self.resource_id and
+                instance.get('LifecycleState') != TERMINATED)
+        return remaining
 
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
@@ -171,18 +265,42 @@ def create(ctx, iface, resource_config, params, **_):
     if not iface.resource_id:
         setattr(iface, 'resource_id', params.get(RESOURCE_NAME))
     iface.create(params)
-    iface.update_resource_id(iface.properties.get(RESOURCE_NAME))
+    autoscaling_group = iface.properties
+    iface.update_resource_id(autoscaling_group.get(RESOURCE_NAME))
     utils.update_resource_id(
-        ctx.instance, iface.properties.get(RESOURCE_NAME))
+        ctx.instance, autoscaling_group.get(RESOURCE_NAME))
     utils.update_resource_arn(
-        ctx.instance, iface.properties.get(GROUP_ARN))
+        ctx.instance, autoscaling_group.get(GROUP_ARN))
+    warm_pool = utils.clean_params(
+        dict(ctx.node.properties.get('warm_pool') or dict()))
+    if warm_pool:
+        iface.put_warm_pool(warm_pool)
 
 
 @decorators.aws_resource(AutoscalingGroup, RESOURCE_TYPE)
-def stop(iface,
+def stop(ctx,
+         iface,
          resource_config,
          **_):
     """Stops all instances associated with Autoscaling group."""
+    runtime_properties = ctx.instance.runtime_properties
+    max_workers = \
+        ctx.node.properties.get('max_workers') or constants.DEFAULT_MAX_WORKERS
+
+    # Once draining, only the remaining instances are described
+    if 'draining_instances' in runtime_properties:
+        remaining = iface.get_remaining_instances(
+            runtime_properties['draining_instances'], max_workers)
+        if remaining:
+            ctx.logger.info('%s ID# "%s" has %d of %d instances left.'
+                            % (iface.type_name, iface.resource_id,
+                               len(remaining),
+                               len(runtime_properties['draining_instances'])))
+            raise OperationRetry(
+                '%s ID# "%s" is deleting associated instances.'
+                % (iface.type_name, iface.resource_id))
+        del runtime_properties['draining_instances']
+        return
 
     autoscaling_group = iface.properties
 
@@ -191,6 +309,16 @@ def stop(iface,
     maxsize = autoscaling_group.get('MaxSize')
     desired_cap = autoscaling_group.get('DesiredCapacity')
 
+    # Warm pool instances would keep the group from being deleted
+    warm_pool = autoscaling_group.get(WARM_POOL)
+    if warm_pool and warm_pool.get('Status') != WARM_POOL_DELETING:
+        iface.delete_warm_pool()
+
+    instance_ids = [instance[INSTANCE_ID] for instance in instances
+                    if instance.get(INSTANCE_ID)]
+    if instances:
+        runtime_properties['draining_instances'] = instance_ids
+
     # If rules would allow scaling
     if minsize != 0 and desired_cap != 0 and maxsize != 0:
         stop_parameters = {
@@ -213,7 +341,7 @@ def stop(iface,
 
 @decorators.aws_resource(AutoscalingGroup, RESOURCE_TYPE,
                          ignore_properties=True)
-def delete(iface, resource_config, **_):
+def delete(ctx, iface, resource_config, **_):
     """Deletes an AWS Autoscaling Group"""
     # Create a copy of the resource config for clean manipulation.
     params = dict() if not resource_config else resource_config.copy()
@@ -221,12 +349,117 @@ def delete(iface, resource_config, **_):
     if RESOURCE_NAME not in params:
         params.update({RESOURCE_NAME: iface.resource_id})
 
-    autoscaling_group = iface.properties
-    instances = autoscaling_group.get(INSTANCES)
-    iface.remove_instances(
-        {RESOURCE_NAME: params.get(RESOURCE_NAME),
-         'ShouldDecrementDesiredCapacity': False,
-         INSTANCE_IDS:
-             [instance.get(INSTANCE_ID) for instance in instances]})
+    autoscaling_group = iface.properties or dict()
+    instance_ids = [instance[INSTANCE_ID] for instance
+                    in autoscaling_group.get(INSTANCES) or []]
+    if instance_ids:
+        errors = iface.detach_instances(
+            instance_ids,
+            ctx.node.properties.get('max_workers') or
+            constants.DEFAULT_MAX_WORKERS)
+        if errors:
+            raise OperationRetry(
+                'Failed to detach instances from %s ID# "%s": %s'
+                % (iface.type_name, iface.resource_id, errors[0]))
+
+    # The group cannot be deleted while its warm pool is being deleted
+    try:
+        warm_pool = iface.describe_warm_pool().get(WARM_POOL)
+    except ClientError:
+        warm_pool = None
+    if warm_pool:
+        if warm_pool.get('Status') != WARM_POOL_DELETING:
+            iface.delete_warm_pool()
+        raise OperationRetry(
+            'Waiting for the warm pool of %s ID# "%s" to be deleted.'
+            % (iface.type_name, iface.resource_id),
+            retry_after=utils.get_retry_interval(
+                ctx.operation.retry_number))
 
     iface.delete(params)
+
+
+@decorators.aws_resource(AutoscalingGroup, RESOURCE_TYPE,
+                         ignore_properties=True)
+def put_warm_pool(ctx, iface, warm_pool=None, **_):
+    """Creates or updates the warm pool of an AWS Autoscaling Group"""
+    iface.put_warm_pool(utils.clean_params(
+        dict(warm_pool or ctx.node.properties.get('warm_pool') or dict())))
+    ctx.instance.runtime_properties['warm_pool'] = \
+        utils.JsonCleanuper(iface.describe_warm_pool()).to_dict()
+
+
+@decorators.aws_resource(AutoscalingGroup, RESOURCE_TYPE,
+                         ignore_properties=True)
+def delete_warm_pool(ctx, iface, force_delete=True, **_):
+    """Deletes the warm pool of an AWS Autoscaling Group"""
+    iface.delete_warm_pool(force_delete)
+    ctx.instance.runtime_properties.pop('warm_pool', None)
+
+
+def _track_instance_refresh(ctx, iface, status_good):
+    """Logs new instance refresh progress and retries until it is done"""
+    runtime_properties = ctx.instance.runtime_properties
+    refresh_id = runtime_properties['instance_refresh_id']
+    refresh = iface.describe_instance_refresh(refresh_id) or dict()
+    status = refresh.get('Status')
+    progress = [status, refresh.get('PercentageComplete'),
+                refresh.get('InstancesToUpdate')]
+    if progress != runtime_properties.get('instance_refresh_progress'):
+        runtime_properties['instance_refresh_progress'] = progress
+        ctx.logger.info(
+            'Instance refresh %s of %s ID# "%s" is %s: %s%% complete, '
+            '%s instances to update. %s'
+            % (refresh_id, iface.type_name, iface.resource_id, status,
+               progress[1], progress[2], refresh.get('StatusReason', '')))
+    if status in REFRESH_PENDING:
+        raise OperationRetry(
+            'Waiting for instance refresh %s of %s ID# "%s".'
+            % (refresh_id, iface.type_name, iface.resource_id),
+            retry_after=utils.get_retry_interval(
+                ctx.operation.retry_number, initial=15, maximum=60))
+    for key in ['instance_refresh_id', 'instance_refresh_progress',
+                'instance_refresh_cancelled']:
+        runtime_properties.pop(key, None)
+    if status not in status_good:
+        raise NonRecoverableError(
+            'Instance refresh %s of %s ID# "%s" ended as %s: %s'
+            % (refresh_id, iface.type_name, iface.resource_id, status,
+               refresh.get('StatusReason')))
+
+
+@decorators.aws_resource(AutoscalingGroup, RESOURCE_TYPE,
+                         ignore_properties=True)
+def instance_refresh(ctx,
+                     iface,
+                     min_healthy_percentage=90,
+                     launch_configuration_name=None,
+                     preferences=None,
+                     **_):
+    """
+        Replaces the instances of an AWS Autoscaling Group in place,
+        optionally switching it to another launch configuration first.
+    """
+    if not ctx.instance.runtime_properties.get('instance_refresh_id'):
+        if launch_configuration_name:
+            iface.update({RESOURCE_NAME: iface.resource_id,
+                          LC_NAME: launch_configuration_name})
+        preferences = dict(preferences or dict(),
+                           MinHealthyPercentage=min_healthy_percentage)
+        ctx.instance.runtime_properties['instance_refresh_id'] = \
+            iface.start_instance_refresh(
+                dict(Strategy='Rolling', Preferences=preferences))
+    _track_instance_refresh(ctx, iface, REFRESH_SUCCESSFUL)
+
+
+@decorators.aws_resource(AutoscalingGroup, RESOURCE_TYPE,
+                         ignore_properties=True)
+def cancel_instance_refresh(ctx, iface, **_):
+    """Cancels the running instance refresh of an AWS Autoscaling Group"""
+    runtime_properties = ctx.instance.runtime_properties
+    if not runtime_properties.get('instance_refresh_cancelled'):
+        runtime_properties['instance_refresh_id'] = \
+            iface.cancel_instance_refresh()
+        runtime_properties['instance_refresh_cancelled'] = True
+    # A refresh may still complete before the cancellation takes effect
+    _track_instance_refresh(ctx, iface, ['Cancelled'] + REFRESH_SUCCESSFUL)
@@ -20,7 +20,7 @@ from mock import patch, MagicMock
 
 from cloudify.state import current_ctx
 from cloudify_aws.common._compat import text_type
-from cloudify.exceptions import OperationRetry
+from cloudify.exceptions import OperationRetry, NonRecoverableError
 
 # Local imports
 from cloudify_aws.common.tests.test_base import TestBase, CLIENT_CONFIG
@@ -168,6 +168,8 @@ class TestAutoscalingGroup(TestBase):
 
         self.fake_client.detach_instances = self.mock_return(DELETE_RESPONSE)
 
+        self.fake_client.describe_warm_pool = self.mock_return({})
+
         self.fake_client.describe_auto_scaling_groups = self.mock_return(
             {
                 'AutoScalingGroups': [{
@@ -252,6 +254,7 @@ class TestAutoscalingGroup(TestBase):
             AutoScalingGroupNames=['test-autoscaling1'])
 
         # we have some scale staff
+        del _ctx.instance.runtime_properties['draining_instances']
         self.fake_client.describe_auto_scaling_groups = MagicMock(
             return_value={'AutoScalingGroups': [{'Status': 'Created',
                                                  'MinSize': 1,
@@ -275,6 +278,205 @@ class TestAutoscalingGroup(TestBase):
         self.fake_client.describe_auto_scaling_groups.assert_called_with(
             AutoScalingGroupNames=['test-autoscaling1'])
 
+    def test_stop_draining(self):
+        _ctx = self._prepare_context(dict(RUNTIME_PROPERTIES_AFTER_CREATE))
+        self.fake_client.update_auto_scaling_group = self.mock_return(
+            DELETE_RESPONSE)
+        self.fake_client.describe_auto_scaling_groups = MagicMock(
+            return_value={'AutoScalingGroups': [{
+                'MinSize': 1, 'MaxSize': 100, 'DesiredCapacity': 60,
+                'Instances': [{'InstanceId': 'i-%d' % i}
+                              for i in range(60)]}]})
+        with self.assertRaises(OperationRetry):
+            autoscaling_group.stop(ctx=_ctx, resource_config=None,
+                                   iface=None)
+        self.assertEqual(
+            len(_ctx.instance.runtime_properties['draining_instances']), 60)
+
+        # Retries only follow the draining instances
+        def describe_instances(InstanceIds):
+            return {'AutoScalingInstances': [
+                {'InstanceId': instance_id,
+                 'AutoScalingGroupName': 'test-autoscaling1',
+                 'LifecycleState': 'Terminating'}
+                for instance_id in InstanceIds if instance_id == 'i-55']}
+        self.fake_client.describe_auto_scaling_instances = MagicMock(
+            side_effect=describe_instances)
+        with self.assertRaises(OperationRetry):
+            autoscaling_group.stop(ctx=_ctx, resource_config=None,
+                                   iface=None)
+        self.assertEqual(
+            self.fake_client.describe_auto_scaling_instances.call_count, 2)
+        self.assertEqual(
+            self.fake_client.describe_auto_scaling_groups.call_count, 1)
+
+        self.fake_client.describe_auto_scaling_instances = MagicMock(
+            return_value={'AutoScalingInstances': []})
+        autoscaling_group.stop(ctx=_ctx, resource_config=None, iface=None)
+        self.assertNotIn('draining_instances',
+                         _ctx.instance.runtime_properties)
+
+    def test_delete_chunks_detach(self):
+        _ctx = self._prepare_context(dict(RUNTIME_PROPERTIES_AFTER_CREATE))
+        self.fake_client.delete_auto_scaling_group = self.mock_return(
+            DELETE_RESPONSE)
+        self.fake_client.detach_instances = self.mock_return(DELETE_RESPONSE)
+        self.fake_client.describe_warm_pool = self.mock_return({})
+        self.fake_client.describe_auto_scaling_groups = self.mock_return({
+            'AutoScalingGroups': [{
+                'Instances': [{'InstanceId': 'i-%d' % i}
+                              for i in range(45)]}]})
+
+        autoscaling_group.delete(ctx=_ctx, resource_config=None, iface=None)
+
+        self.assertEqual(self.fake_client.detach_instances.call_count, 3)
+        detached = [call[1]['InstanceIds'] for call in
+                    self.fake_client.detach_instances.call_args_list]
+        self.assertEqual(sorted(len(ids) for ids in detached), [5, 20, 20])
+        self.assertTrue(self.fake_client.delete_auto_scaling_group.called)
+
+    def test_delete_detach_failed(self):
+        _ctx = self._prepare_context(dict(RUNTIME_PROPERTIES_AFTER_CREATE))
+        self.fake_client.delete_auto_scaling_group = self.mock_return(
+            DELETE_RESPONSE)
+        self.fake_client.detach_instances = self._gen_client_error(
+            "detach_instances")
+        self.fake_client.describe_auto_scaling_groups = self.mock_return({
+            'AutoScalingGroups': [{'Instances': [{'InstanceId': 'i-1'}]}]})
+
+        with self.assertRaises(OperationRetry):
+            autoscaling_group.delete(ctx=_ctx, resource_config=None,
+                                     iface=None)
+        self.assertFalse(self.fake_client.delete_auto_scaling_group.called)
+
+    def test_stop_deletes_warm_pool(self):
+        _ctx = self._prepare_context(dict(RUNTIME_PROPERTIES_AFTER_CREATE))
+        self.fake_client.delete_warm_pool = self.mock_return({})
+        self.fake_client.describe_auto_scaling_groups = MagicMock(
+            return_value={'AutoScalingGroups': [{
+                'MinSize': 0, 'MaxSize': 0, 'DesiredCapacity': 0,
+                'Instances': [],
+                'WarmPoolConfiguration': {'MinSize': 2}}]})
+        autoscaling_group.stop(ctx=_ctx, resource_config=None, iface=None)
+        self.fake_client.delete_warm_pool.assert_called_with(
+            AutoScalingGroupName='test-autoscaling1', ForceDelete=True)
+
+    def test_delete_waits_for_warm_pool(self):
+        _ctx = self._prepare_context(dict(RUNTIME_PROPERTIES_AFTER_CREATE))
+        self.fake_client.delete_auto_scaling_group = self.mock_return(
+            DELETE_RESPONSE)
+        self.fake_client.delete_warm_pool = self.mock_return({})
+        self.fake_client.describe_auto_scaling_groups = self.mock_return({
+            'AutoScalingGroups': [{'Instances': []}]})
+        self.fake_client.describe_warm_pool = self.mock_return({
+            'WarmPoolConfiguration': {'MinSize': 2}})
+
+        with self.assertRaises(OperationRetry):
+            autoscaling_group.delete(ctx=_ctx, resource_config=None,
+                                     iface=None)
+        self.fake_client.delete_warm_pool.assert_called_once_with(
+            AutoScalingGroupName='test-autoscaling1', ForceDelete=True)
+
+        # Still deleting, the deletion is not requested again
+        self.fake_client.describe_warm_pool = self.mock_return({
+            'WarmPoolConfiguration': {'MinSize': 2,
+                                      'Status': 'PendingDelete'}})
+        with self.assertRaises(OperationRetry):
+            autoscaling_group.delete(ctx=_ctx, resource_config=None,
+                                     iface=None)
+        self.assertEqual(self.fake_client.delete_warm_pool.call_count, 1)
+        self.assertFalse(self.fake_client.delete_auto_scaling_group.called)
+
+        self.fake_client.describe_warm_pool = self.mock_return({})
+        autoscaling_group.delete(ctx=_ctx, resource_config=None, iface=None)
+        self.fake_client.delete_auto_scaling_group.assert_called_with(
+            AutoScalingGroupName='test-autoscaling1')
+
+    def test_put_warm_pool(self):
+        _ctx = self._prepare_context(dict(RUNTIME_PROPERTIES_AFTER_CREATE))
+        self.fake_client.put_warm_pool = self.mock_return({})
+        self.fake_client.describe_warm_pool = self.mock_return(
+            {'WarmPoolConfiguration': {'MinSize': 2, 'PoolState': 'Stopped'},
+             'Instances': []})
+        autoscaling_group.put_warm_pool(
+            ctx=_ctx, iface=None,
+            warm_pool={'MinSize': 2, 'PoolState': 'Stopped',
+                       'MaxGroupPreparedCapacity': None})
+        self.fake_client.put_warm_pool.assert_called_with(
+            AutoScalingGroupName='test-autoscaling1', MinSize=2,
+            PoolState='Stopped')
+        self.assertEqual(
+            _ctx.instance.runtime_properties['warm_pool'][
+                'WarmPoolConfiguration']['MinSize'], 2)
+
+        self.fake_client.delete_warm_pool = self.mock_return({})
+        autoscaling_group.delete_warm_pool(ctx=_ctx, iface=None)
+        self.assertNotIn('warm_pool', _ctx.instance.runtime_properties)
+
+    def _refresh(self, status, percentage=None):
+        return MagicMock(return_value={'InstanceRefreshes': [{
+            'InstanceRefreshId': 'refresh', 'Status': status,
+            'PercentageComplete': percentage, 'InstancesToUpdate': 1}]})
+
+    def test_instance_refresh(self):
+        _ctx = self._prepare_context(dict(RUNTIME_PROPERTIES_AFTER_CREATE))
+        self.fake_client.update_auto_scaling_group = self.mock_return({})
+        self.fake_client.start_instance_refresh = self.mock_return(
+            {'InstanceRefreshId': 'refresh'})
+        self.fake_client.describe_instance_refreshes = self._refresh(
+            'InProgress', 50)
+        with self.assertRaises(OperationRetry):
+            autoscaling_group.instance_refresh(
+                ctx=_ctx, iface=None, min_healthy_percentage=75,
+                launch_configuration_name='new_lc')
+        self.fake_client.update_auto_scaling_group.assert_called_with(
+            AutoScalingGroupName='test-autoscaling1',
+            LaunchConfigurationName='new_lc')
+        self.fake_client.start_instance_refresh.assert_called_with(
+            AutoScalingGroupName='test-autoscaling1', Strategy='Rolling',
+            Preferences={'MinHealthyPercentage': 75})
+        self.assertEqual(
+            _ctx.instance.runtime_properties['instance_refresh_progress'],
+            ['InProgress', 50, 1])
+
+        # Retries only track the started refresh
+        self.fake_client.describe_instance_refreshes = self._refresh(
+            'Successful', 100)
+        autoscaling_group.instance_refresh(ctx=_ctx, iface=None)
+        self.assertEqual(
+            self.fake_client.start_instance_refresh.call_count, 1)
+        self.fake_client.describe_instance_refreshes.assert_called_with(
+            AutoScalingGroupName='test-autoscaling1',
+            InstanceRefreshIds=['refresh'])
+        self.assertNotIn('instance_refresh_id',
+                         _ctx.instance.runtime_properties)
+
+    def test_instance_refresh_failed(self):
+        _ctx = self._prepare_context(dict(
+            RUNTIME_PROPERTIES_AFTER_CREATE, instance_refresh_id='refresh'))
+        self.fake_client.describe_instance_refreshes = self._refresh(
+            'Failed')
+        with self.assertRaises(NonRecoverableError):
+            autoscaling_group.instance_refresh(ctx=_ctx, iface=None)
+        self.assertNotIn('instance_refresh_id',
+                         _ctx.instance.runtime_properties)
+
+    def test_cancel_instance_refresh(self):
+        _ctx = self._prepare_context(dict(RUNTIME_PROPERTIES_AFTER_CREATE))
+        self.fake_client.cancel_instance_refresh = self.mock_return(
+            {'InstanceRefreshId': 'refresh'})
+        self.fake_client.describe_instance_refreshes = self._refresh(
+            'Cancelling')
+        with self.assertRaises(OperationRetry):
+            autoscaling_group.cancel_instance_refresh(ctx=_ctx, iface=None)
+        self.fake_client.describe_instance_refreshes = self._refresh(
+            'Cancelled')
+        autoscaling_group.cancel_instance_refresh(ctx=_ctx, iface=None)
+        self.assertEqual(
+            self.fake_client.cancel_instance_refresh.call_count, 1)
+        self.assertNotIn('instance_refresh_cancelled',
+                         _ctx.instance.runtime_properties)
+
     def test_AutoscalingGroup_properties(self):
         test_instance = autoscaling_group.AutoscalingGroup(
             "ctx_node", resource_id='group_id', client=self.fake_client,
@@ -326,17 +528,6 @@ class TestAutoscalingGroup(TestBase):
 
         self.assertEqual(test_instance.status, 'Created')
 
-    def test_AutoscalingGroup_remove_instances(self):
-        test_instance = autoscaling_group.AutoscalingGroup(
-            "ctx_node", resource_id='group_id', client=self.fake_client,
-            logger=None
-        )
-        self.fake_client.detach_instances = self._gen_client_error(
-            "detach_instances"
-        )
-
-        self.assertEqual(test_instance.remove_instances({}), None)
-
 
 if __name__ == '__main__':
     unittest.main()
@@ -18,15 +18,21 @@
 """
 # Standard imports
 import json
-from datetime import datetime
+import time
+import hashlib
 
 # Third party imports
 from botocore.exceptions import ClientError
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 
 # Local imports
 from cloudify_aws.common._compat import text_type
 from cloudify_aws.common import decorators, utils
-from cloudify_aws.common.constants import EXTERNAL_RESOURCE_ID
+from cloudify_aws.common.connection import Boto3Connection
+from cloudify_aws.common.constants import (
+    EXTERNAL_RESOURCE_ARN,
+    EXTERNAL_RESOURCE_ID
+)
 from cloudify_aws.cloudformation import AWSCloudFormationBase
 
 RESOURCE_TYPE = 'CloudFormation Stack'
@@ -34,7 +40,25 @@ RESOURCE_NAME = 'StackName'
 RESOURCE_NAMES = 'StackNames'
 STACKS = 'Stacks'
 TEMPLATEBODY = 'TemplateBody'
+TEMPLATEURL = 'TemplateURL'
 STATUS = 'StackStatus'
+STACK_ID = 'StackId'
+STACK_EVENTS = 'StackEvents'
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+TEMPLATE_CACHE = 'cloudformation-templates'
+DEFAULT_REFRESH_KEYS = [STACK_ID, STATUS, 'Outputs', 'outputs_items']
+TEMPLATE_CACHE_TTL = 86400
+TEMPLATE_STAGING_DEFAULTS = {
+    'bucket': None,
+    'prefix': 'cloudify/cloudformation/',
+}
+CHANGE_SET_PENDING = ['CREATE_PENDING', 'CREATE_IN_PROGRESS']
+CHANGE_SET_EMPTY_REASONS = ["didn't contain changes",
+                            'No updates are to be performed']
+# create_stack arguments that update_stack and create_change_set reject
+CREATE_ONLY_PARAMS = ['DisableRollback', 'TimeoutInMinutes', 'OnFailure',
+                      'EnableTerminationProtection', 'StackPolicyBody',
+                      'StackPolicyURL', 'RetainExceptOnCreate']
 
 
 class CloudFormationStack(AWSCloudFormationBase):
@@ -82,6 +106,166 @@ class CloudFormationStack(AWSCloudFormationBase):
         self.logger.debug('Response: %s' % res)
         return res
 
+    def create_change_set(self, params):
+        """
+            Creates a change set for an AWS CloudFormation Stack.
+        """
+        return self.make_client_call('create_change_set', params)
+
+    def change_set_changes(self, change_set_id):
+        """
+            Yields the description of a change set page by page, as
+            (description, changes) pairs.
+        """
+        params = {'ChangeSetName': change_set_id}
+        while True:
+            res = self.client.describe_change_set(**params)
+            yield res, res.get('Changes', [])
+            if not res.get('NextToken'):
+                break
+            params['NextToken'] = res['NextToken']
+
+    def events(self, stack_name):
+        """
+            Yields the events of an AWS CloudFormation Stack, newest first.
+        """
+        params = {RESOURCE_NAME: stack_name}
+        while True:
+            res = self.client.describe_stack_events(**params)
+            for event in res.get(STACK_EVENTS, []):
+                yield event
+            if not res.get('NextToken'):
+                break
+            params['NextToken'] = res['NextToken']
+
+
+def _hash(value):
+    if not isinstance(value, text_type):
+        value = json.dumps(value, sort_keys=True, default=text_type)
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def get_stack_hashes(params):
+    """
+    Hashes the template and the rest of the stack arguments separately.
+    :return: tuple of template hash and parameters hash
+    """
+    template = params.get(TEMPLATEBODY) or params.get(TEMPLATEURL)
+    rest = dict((key, value) for key, value in params.items()
+                if key not in [RESOURCE_NAME, TEMPLATEBODY, TEMPLATEURL])
+    return _hash(template or ''), _hash(rest)
+
+
+def stage_template(ctx, params):
+    """
+    Uploads the template to the staging bucket, keyed by its content hash,
+    and replaces TemplateBody with TemplateURL. Hashes already known to be
+    staged on this host skip the S3 calls entirely.
+    """
+    config = TEMPLATE_STAGING_DEFAULTS.copy()
+    config.update(ctx.node.properties.get('template_staging') or dict())
+    template_body = params.get(TEMPLATEBODY)
+    if not config['bucket'] or not template_body:
+        return
+    if not isinstance(template_body, text_type):
+        template_body = json.dumps(template_body, sort_keys=True)
+    bucket = config['bucket']
+    key = '{0}{1}.template'.format(config['prefix'], _hash(template_body))
+    location = '{0}/{1}'.format(bucket, key)
+
+    with utils.local_store(TEMPLATE_CACHE) as store:
+        staged = time.time() - store.get(location, 0) < TEMPLATE_CACHE_TTL
+    if not staged:
+        client = Boto3Connection(ctx.node).client('s3')
+        try:
+            client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error'].get('Code') not in ['404', 'NoSuchKey']:
+                raise
+            ctx.logger.info('Staging template to s3://{0}.'.format(location))
+            client.put_object(Bucket=bucket, Key=key,
+                              Body=template_body.encode('utf-8'))
+        with utils.local_store(TEMPLATE_CACHE) as store:
+            store[location] = time.time()
+
+    region_name = \
+        (ctx.node.properties.get('client_config') or dict()).get('region_name')
+    del params[TEMPLATEBODY]
+    params[TEMPLATEURL] = 'https://{0}.{1}/{2}'.format(
+        bucket,
+        's3.{0}.amazonaws.com'.format(region_name) if region_name
+        else 's3.amazonaws.com',
+        key)
+
+
+def _is_stack_failed(status):
+    return status.endswith('_FAILED') or 'ROLLBACK' in status
+
+
+def start_stack_tracking(ctx, iface, stack_id):
+    """
+    Remembers the newest existing event of a stack, so tracking an update
+    or delete only reads the events that follow it.
+    """
+    ctx.instance.runtime_properties['stack_id'] = stack_id
+    ctx.instance.runtime_properties['stack_status'] = None
+    ctx.instance.runtime_properties['stack_last_event_id'] = None
+    for event in iface.events(stack_id):
+        ctx.instance.runtime_properties['stack_last_event_id'] = \
+            event['EventId']
+        break
+
+
+def track_stack_progress(ctx, iface, status_good, describe=True):
+    """
+    Tails the stack events that are new since the last call, logs them and
+    follows the stack status they carry. The stack itself is described only
+    once it reached one of status_good.
+    :param ctx: Cloudify context
+    :param iface: CloudFormation Stack interface
+    :param status_good: list of stack statuses that complete the operation
+    :param describe: whether to describe the stack on completion
+    :return: dict of stack properties
+    """
+    runtime_properties = ctx.instance.runtime_properties
+    stack_id = runtime_properties.get('stack_id') or iface.resource_id
+    last_event_id = runtime_properties.get('stack_last_event_id')
+
+    events = []
+    for event in iface.events(stack_id):
+        if event['EventId'] == last_event_id:
+            break
+        events.append(event)
+
+    failures = []
+    status = runtime_properties.get('stack_status')
+    for event in reversed(events):
+        reason = event.get('ResourceStatusReason')
+        ctx.logger.info('{0} {1} ({2}): {3}{4}'.format(
+            event.get('Timestamp'), event.get('LogicalResourceId'),
+            event.get('ResourceType'), event.get('ResourceStatus'),
+            ' - {0}'.format(reason) if reason else ''))
+        if event.get('ResourceStatus', '').endswith('_FAILED') and reason:
+            failures.append('{0}: {1}'.format(
+                event.get('LogicalResourceId'), reason))
+        if event.get('ResourceType') == STACK_RESOURCE_TYPE and \
+                event.get('PhysicalResourceId') == event.get(STACK_ID):
+            status = event.get('ResourceStatus')
+    if events:
+        runtime_properties['stack_last_event_id'] = events[0]['EventId']
+    runtime_properties['stack_status'] = status
+
+    if status in status_good:
+        return iface.properties if describe else None
+    elif status and _is_stack_failed(status):
+        raise NonRecoverableError(
+            '{0} ID# "{1}" reported status "{2}". {3}'.format(
+                RESOURCE_TYPE, iface.resource_id, status,
+                ' '.join(failures)).strip())
+    raise OperationRetry(
+        '{0} ID# "{1}" is still in a pending state ({2}).'.format(
+            RESOURCE_TYPE, iface.resource_id, status))
+
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
 def prepare(ctx, resource_config, **_):
@@ -91,11 +275,18 @@ def prepare(ctx, resource_config, **_):
 
 
 @decorators.aws_resource(CloudFormationStack, RESOURCE_TYPE)
-@decorators.wait_for_status(
-    status_good=['CREATE_COMPLETE'],
-    status_pending=['CREATE_IN_PROGRESS'])
 def create(ctx, iface, resource_config, **_):
     """Creates an AWS CloudFormation Stack"""
+    if ctx.operation.retry_number == 0:
+        _create(ctx, iface, resource_config)
+    iface.update_resource_id(
+        ctx.instance.runtime_properties[EXTERNAL_RESOURCE_ID])
+    props = track_stack_progress(ctx, iface, ['CREATE_COMPLETE'])
+    ctx.instance.runtime_properties['create_response'] = \
+        utils.JsonCleanuper(props).to_dict()
+
+
+def _create(ctx, iface, resource_config):
     # Create a copy of the resource config for clean manipulation.
     params = dict() if not resource_config else resource_config.copy()
     resource_id = \
@@ -108,60 +299,153 @@ def create(ctx, iface, resource_config, **_):
     params[RESOURCE_NAME] = resource_id
     utils.update_resource_id(ctx.instance, resource_id)
 
+    template_hash, parameters_hash = get_stack_hashes(params)
+    stage_template(ctx, params)
     template_body = params.get(TEMPLATEBODY, {})
     if template_body and not isinstance(template_body, text_type):
         params[TEMPLATEBODY] = json.dumps(template_body)
     if not iface.resource_id:
         setattr(iface, 'resource_id', params.get(RESOURCE_NAME))
     # Actually create the resource
-    iface.create(params)
+    create_response = iface.create(params)
+    ctx.instance.runtime_properties['template_hash'] = template_hash
+    ctx.instance.runtime_properties['parameters_hash'] = parameters_hash
+    ctx.instance.runtime_properties['stack_id'] = \
+        create_response.get(STACK_ID)
+    ctx.instance.runtime_properties['stack_status'] = None
+    ctx.instance.runtime_properties['stack_last_event_id'] = None
 
 
 @decorators.aws_resource(CloudFormationStack, RESOURCE_TYPE)
 def start(ctx, iface, **_):
     """Update Runtime Properties an AWS CloudFormation Stack"""
-
-    def test(_value):
-        if isinstance(_value, datetime):
-            return text_type(_value)
-        elif isinstance(_value, list):
-            for _value_item in _value:
-                i = _value.index(_value_item)
-                _value[i] = test(_value_item)
-            return _value
-        elif isinstance(_value, dict):
-            for _value_key, _value_item in _value.items():
-                _value[_value_key] = test(_value_item)
-            return _value
-        else:
-            return _value
-
     if not iface.resource_id:
         iface.update_resource_id(
             ctx.instance.runtime_properties[EXTERNAL_RESOURCE_ID])
 
     props = iface.properties
-    for key, value in props.items():
-        tested_value = test(value)
-        ctx.instance.runtime_properties[key] = tested_value
-
     # Special handling for outputs: they're provided by the stack
     # as a list of key-value pairs, which makes it impossible to
     # use them via intrinsic functions. So, create a dictionary out
     # of them.
-    if 'Outputs' in props:
-        outputs_items = {}
-        for output in props['Outputs']:
-            outputs_items[output['OutputKey']] = output['OutputValue']
-        ctx.instance.runtime_properties['outputs_items'] = outputs_items
+    outputs_items = dict((output['OutputKey'], output['OutputValue'])
+                         for output in props.get('Outputs') or [])
+    props['outputs_items'] = outputs_items
+    keys = ctx.node.properties.get('refresh_keys') or DEFAULT_REFRESH_KEYS
+    if '*' not in keys:
+        props = dict((key, props[key]) for key in keys if key in props)
+    props = utils.JsonCleanuper(props).to_dict()
+    # Hash what is stored, so the skip works whatever the refresh keys are
+    refresh_hash = _hash(props)
+    runtime_properties = ctx.instance.runtime_properties
+    if runtime_properties.get('refresh_hash') == refresh_hash:
+        ctx.logger.debug('{0} ID# "{1}" description is unchanged.'.format(
+            RESOURCE_TYPE, iface.resource_id))
+        return
+    props['refresh_hash'] = refresh_hash
+    runtime_properties.update(props)
+
+
+def _create_change_set(ctx, iface, params):
+    change_set_params = dict((key, value) for key, value in params.items()
+                             if key not in CREATE_ONLY_PARAMS)
+    change_set_params[RESOURCE_NAME] = iface.resource_id
+    change_set_params['ChangeSetName'] = \
+        'cloudify-{0}'.format(int(time.time()))
+    change_set_params['ChangeSetType'] = 'UPDATE'
+    stage_template(ctx, change_set_params)
+    template_body = change_set_params.get(TEMPLATEBODY)
+    if template_body and not isinstance(template_body, text_type):
+        change_set_params[TEMPLATEBODY] = json.dumps(template_body)
+    response = iface.create_change_set(change_set_params)
+    ctx.instance.runtime_properties['change_set_id'] = response['Id']
+    ctx.logger.info('Created change set {0}.'.format(response['Id']))
+
+
+def _review_change_set(ctx, iface, change_set_id, allow_replacement):
+    """
+    Reads the change set page by page and decides whether to execute it.
+    :return: True to execute, False when there is nothing to change
+    """
+    replacements = []
+    count = 0
+    for description, changes in iface.change_set_changes(change_set_id):
+        status = description.get('Status')
+        reason = description.get('StatusReason') or ''
+        if status in CHANGE_SET_PENDING:
+            raise OperationRetry(
+                'Change set {0} is still in a pending state ({1}).'.format(
+                    change_set_id, status))
+        elif status == 'FAILED':
+            if any(empty in reason for empty in CHANGE_SET_EMPTY_REASONS):
+                return False
+            raise NonRecoverableError(
+                'Change set {0} failed: {1}'.format(change_set_id, reason))
+        for change in changes:
+            resource = change.get('ResourceChange', dict())
+            count += 1
+            ctx.logger.info('{0} {1} ({2}), replacement: {3}'.format(
+                resource.get('Action'), resource.get('LogicalResourceId'),
+                resource.get('ResourceType'), resource.get('Replacement')))
+            if resource.get('Replacement') in ['True', 'Conditional']:
+                replacements.append(resource.get('LogicalResourceId'))
+    if replacements and not allow_replacement:
+        iface.client.delete_change_set(ChangeSetName=change_set_id)
+        raise NonRecoverableError(
+            'Change set {0} would replace {1}. Set allow_replacement to '
+            'update anyway.'.format(change_set_id, replacements))
+    return count > 0
+
+
+@decorators.aws_resource(CloudFormationStack, RESOURCE_TYPE)
+def update(ctx, iface, resource_config, allow_replacement=False, **_):
+    """Updates an AWS CloudFormation Stack in place through a change set"""
+    runtime_properties = ctx.instance.runtime_properties
+    params = dict() if not resource_config else resource_config.copy()
+    iface.update_resource_id(runtime_properties[EXTERNAL_RESOURCE_ID])
+    template_hash, parameters_hash = get_stack_hashes(params)
+    change_set_id = runtime_properties.get('change_set_id')
+
+    if not change_set_id:
+        if runtime_properties.get('template_hash') == template_hash and \
+                runtime_properties.get('parameters_hash') == parameters_hash:
+            ctx.logger.info('{0} ID# "{1}" template and parameters are '
+                            'unchanged.'.format(RESOURCE_TYPE,
+                                                iface.resource_id))
+            return
+        _create_change_set(ctx, iface, params)
+        change_set_id = runtime_properties['change_set_id']
+
+    try:
+        if not runtime_properties.get('change_set_executed'):
+            if not _review_change_set(
+                    ctx, iface, change_set_id, allow_replacement):
+                ctx.logger.info('Change set {0} has no changes.'.format(
+                    change_set_id))
+                iface.client.delete_change_set(ChangeSetName=change_set_id)
+            else:
+                start_stack_tracking(
+                    ctx, iface, runtime_properties.get('stack_id') or
+                    iface.resource_id)
+                iface.client.execute_change_set(ChangeSetName=change_set_id)
+                runtime_properties['change_set_executed'] = True
+
+        if runtime_properties.get('change_set_executed'):
+            track_stack_progress(
+                ctx, iface, ['UPDATE_COMPLETE'], describe=False)
+    except NonRecoverableError:
+        for key in ['change_set_id', 'change_set_executed']:
+            runtime_properties.pop(key, None)
+        raise
+    runtime_properties['template_hash'] = template_hash
+    runtime_properties['parameters_hash'] = parameters_hash
+    for key in ['change_set_id', 'change_set_executed']:
+        runtime_properties.pop(key, None)
 
 
 @decorators.aws_resource(CloudFormationStack, RESOURCE_TYPE,
                          ignore_properties=True)
-@decorators.wait_for_delete(
-    status_deleted=['DELETE_COMPLETE'],
-    status_pending=['DELETE_IN_PROGRESS'])
-def delete(iface, resource_config, **_):
+def delete(ctx, iface, resource_config, **_):
     """Deletes an AWS CloudFormation Stack"""
     # Create a copy of the resource config for clean manipulation.
     params = \
@@ -169,4 +453,21 @@ def delete(iface, resource_config, **_):
     name = params.get(RESOURCE_NAME)
     if not name:
         name = iface.resource_id
-    iface.delete({RESOURCE_NAME: name})
+    # Run the operation if this is the first pass
+    if not ctx.instance.runtime_properties.get('__deleted', False):
+        stack_id = ctx.instance.runtime_properties.get('stack_id')
+        if not stack_id:
+            props = iface.properties
+            stack_id = props.get(STACK_ID) if props else None
+        if stack_id:
+            start_stack_tracking(ctx, iface, stack_id)
+            iface.delete({RESOURCE_NAME: name})
+        # flag will be removed after first call without any exceptions
+        ctx.instance.runtime_properties['__deleted'] = True
+    if ctx.instance.runtime_properties.get('stack_id'):
+        track_stack_progress(ctx, iface, ['DELETE_COMPLETE'], describe=False)
+    for key in [EXTERNAL_RESOURCE_ARN, EXTERNAL_RESOURCE_ID,
+                'resource_config', 'stack_id', 'stack_status',
+                'stack_last_event_id']:
+        if key in ctx.instance.runtime_properties:
+            del ctx.instance.runtime_properties[key]
@@ -18,8 +18,10 @@ import copy
 
 # Third party imports
 from mock import patch, MagicMock
+from botocore.exceptions import ClientError
 
 from cloudify.state import current_ctx
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 
 # Local imports
 from cloudify_aws.cloudformation.resources import stack
@@ -55,6 +57,18 @@ RUNTIMEPROP_AFTER_CREATE = {
 }
 
 
+def _stack_event(event_id, status, logical_id='test-cloudformation1',
+                 resource_type='AWS::CloudFormation::Stack',
+                 physical_id='stack', reason=None):
+    return {'EventId': event_id,
+            'StackId': 'stack',
+            'LogicalResourceId': logical_id,
+            'PhysicalResourceId': physical_id,
+            'ResourceType': resource_type,
+            'ResourceStatus': status,
+            'ResourceStatusReason': reason}
+
+
 class TestCloudFormationStack(TestBase):
 
     def setUp(self):
@@ -94,6 +108,10 @@ class TestCloudFormationStack(TestBase):
         self.fake_client.create_stack = MagicMock(return_value={
             'StackId': 'stack'
         })
+        self.fake_client.describe_stack_events = MagicMock(return_value={
+            'StackEvents': [_stack_event('2', 'CREATE_COMPLETE'),
+                            _stack_event('1', 'CREATE_IN_PROGRESS')]
+        })
 
         stack.create(ctx=_ctx, resource_config=None, iface=None)
 
@@ -118,6 +136,13 @@ class TestCloudFormationStack(TestBase):
             'StackName': 'Stack',
             'StackStatus': 'CREATE_COMPLETE'
         }
+        updated_runtime_prop['stack_id'] = 'stack'
+        updated_runtime_prop['template_hash'], \
+            updated_runtime_prop['parameters_hash'] = \
+            stack.get_stack_hashes(NODE_PROPERTIES['resource_config'][
+                'kwargs'])
+        updated_runtime_prop['stack_status'] = 'CREATE_COMPLETE'
+        updated_runtime_prop['stack_last_event_id'] = '2'
         self.assertEqual(_ctx.instance.runtime_properties,
                          updated_runtime_prop)
 
@@ -131,8 +156,15 @@ class TestCloudFormationStack(TestBase):
         current_ctx.set(_ctx)
         self.fake_client.describe_stacks = MagicMock(return_value={
             'Stacks': [{'StackName': 'Stack',
-                        'StackStatus': 'DELETE_COMPLETE'}]
+                        'StackId': 'stack',
+                        'StackStatus': 'CREATE_COMPLETE'}]
         })
+        self.fake_client.describe_stack_events = MagicMock(side_effect=[
+            {'StackEvents': [_stack_event('1', 'CREATE_COMPLETE')]},
+            {'StackEvents': [_stack_event('3', 'DELETE_COMPLETE'),
+                             _stack_event('2', 'DELETE_IN_PROGRESS'),
+                             _stack_event('1', 'CREATE_COMPLETE')]}
+        ])
 
         self.fake_client.delete_stack = MagicMock(return_value=DELETE_RESPONSE)
 
@@ -146,6 +178,216 @@ class TestCloudFormationStack(TestBase):
         self.assertEqual(_ctx.instance.runtime_properties,
                          {'__deleted': True})
 
+    def test_track_stack_progress(self):
+        _ctx = self.get_mock_ctx(
+            'test_track', test_properties=NODE_PROPERTIES,
+            test_runtime_properties={'stack_id': 'stack',
+                                     'stack_last_event_id': '1'},
+            type_hierarchy=STACK_TH)
+        iface = stack.CloudFormationStack("ctx_node", resource_id='Stack',
+                                          client=self.fake_client,
+                                          logger=None)
+        self.fake_client.describe_stack_events = MagicMock(side_effect=[
+            {'StackEvents': [
+                _stack_event('3', 'CREATE_IN_PROGRESS', 'Bucket',
+                             'AWS::S3::Bucket', 'bucket')],
+             'NextToken': 'next'},
+            {'StackEvents': [
+                _stack_event('2', 'CREATE_IN_PROGRESS'),
+                _stack_event('1', 'REVIEW_IN_PROGRESS')]}])
+        with self.assertRaises(OperationRetry):
+            stack.track_stack_progress(_ctx, iface, ['CREATE_COMPLETE'])
+        self.assertEqual(
+            _ctx.instance.runtime_properties['stack_last_event_id'], '3')
+        self.assertEqual(_ctx.instance.runtime_properties['stack_status'],
+                         'CREATE_IN_PROGRESS')
+        self.fake_client.describe_stack_events.assert_called_with(
+            StackName='stack', NextToken='next')
+        self.assertFalse(self.fake_client.describe_stacks.called)
+
+        self.fake_client.describe_stack_events = MagicMock(return_value={
+            'StackEvents': [
+                _stack_event('5', 'ROLLBACK_IN_PROGRESS'),
+                _stack_event('4', 'CREATE_FAILED', 'Bucket',
+                             'AWS::S3::Bucket', 'bucket', 'Access Denied'),
+                _stack_event('3', 'CREATE_IN_PROGRESS', 'Bucket',
+                             'AWS::S3::Bucket', 'bucket')]})
+        with self.assertRaises(NonRecoverableError) as e:
+            stack.track_stack_progress(_ctx, iface, ['CREATE_COMPLETE'])
+        self.assertIn('Bucket: Access Denied', str(e.exception))
+        self.assertFalse(self.fake_client.describe_stacks.called)
+
+    def _get_update_ctx(self, runtime_properties=None):
+        test_runtime_properties = {'aws_resource_id': 'test-cloudformation1',
+                                   'stack_id': 'stack'}
+        test_runtime_properties.update(runtime_properties or {})
+        _ctx = self.get_mock_ctx(
+            'test_update', test_properties=NODE_PROPERTIES,
+            test_runtime_properties=test_runtime_properties,
+            type_hierarchy=STACK_TH,
+            ctx_operation_name='cloudify.interfaces.lifecycle.update')
+        current_ctx.set(_ctx)
+        return _ctx
+
+    def test_update_unchanged(self):
+        template_hash, parameters_hash = stack.get_stack_hashes(
+            NODE_PROPERTIES['resource_config']['kwargs'])
+        _ctx = self._get_update_ctx({'template_hash': template_hash,
+                                     'parameters_hash': parameters_hash})
+        stack.update(ctx=_ctx, resource_config=None, iface=None)
+        self.assertFalse(self.fake_client.create_change_set.called)
+        self.assertFalse(self.fake_client.describe_change_set.called)
+
+    def test_update(self):
+        _ctx = self._get_update_ctx()
+        self.fake_client.create_change_set = MagicMock(
+            return_value={'Id': 'change-set'})
+        self.fake_client.describe_change_set = MagicMock(side_effect=[
+            {'Status': 'CREATE_IN_PROGRESS'},
+            {'Status': 'CREATE_COMPLETE', 'NextToken': 'next', 'Changes': [
+                {'ResourceChange': {'Action': 'Modify',
+                                    'LogicalResourceId': 'Bucket',
+                                    'Replacement': 'False'}}]},
+            {'Status': 'CREATE_COMPLETE', 'Changes': [
+                {'ResourceChange': {'Action': 'Add',
+                                    'LogicalResourceId': 'Queue'}}]}])
+        self.fake_client.describe_stack_events = MagicMock(side_effect=[
+            {'StackEvents': [_stack_event('1', 'CREATE_COMPLETE')]},
+            {'StackEvents': [_stack_event('2', 'UPDATE_COMPLETE'),
+                             _stack_event('1', 'CREATE_COMPLETE')]}])
+
+        with self.assertRaises(OperationRetry):
+            stack.update(ctx=_ctx, resource_config=None, iface=None)
+        _, kwargs = self.fake_client.create_change_set.call_args
+        self.assertEqual(kwargs['StackName'], 'test-cloudformation1')
+        self.assertEqual(kwargs['ChangeSetType'], 'UPDATE')
+
+        stack.update(ctx=_ctx, resource_config=None, iface=None)
+        self.assertEqual(self.fake_client.create_change_set.call_count, 1)
+        self.fake_client.execute_change_set.assert_called_once_with(
+            ChangeSetName='change-set')
+        self.assertFalse(self.fake_client.describe_stacks.called)
+        self.assertNotIn('change_set_id', _ctx.instance.runtime_properties)
+        self.assertIn('template_hash', _ctx.instance.runtime_properties)
+
+    def test_update_empty_change_set(self):
+        _ctx = self._get_update_ctx()
+        self.fake_client.create_change_set = MagicMock(
+            return_value={'Id': 'change-set'})
+        self.fake_client.describe_change_set = MagicMock(return_value={
+            'Status': 'FAILED',
+            'StatusReason': "The submitted information didn't contain "
+                            "changes. Submit different information to "
+                            "create a change set."})
+        stack.update(ctx=_ctx, resource_config=None, iface=None)
+        self.fake_client.delete_change_set.assert_called_once_with(
+            ChangeSetName='change-set')
+        self.assertFalse(self.fake_client.execute_change_set.called)
+        self.assertIn('template_hash', _ctx.instance.runtime_properties)
+
+    def test_update_replacement(self):
+        _ctx = self._get_update_ctx()
+        self.fake_client.create_change_set = MagicMock(
+            return_value={'Id': 'change-set'})
+        self.fake_client.describe_change_set = MagicMock(return_value={
+            'Status': 'CREATE_COMPLETE', 'Changes': [
+                {'ResourceChange': {'Action': 'Modify',
+                                    'LogicalResourceId': 'Database',
+                                    'Replacement': 'True'}}]})
+        with self.assertRaises(NonRecoverableError):
+            stack.update(ctx=_ctx, resource_config=None, iface=None)
+        self.assertFalse(self.fake_client.execute_change_set.called)
+        self.assertNotIn('change_set_id', _ctx.instance.runtime_properties)
+
+    def test_create_staged_template(self):
+        properties = copy.deepcopy(NODE_PROPERTIES)
+        properties['template_staging'] = {'bucket': 'templates'}
+        _ctx = self.get_mock_ctx(
+            'test_create', test_properties=properties,
+            test_runtime_properties=RUNTIME_PROPERTIES,
+            type_hierarchy=STACK_TH,
+            ctx_operation_name='cloudify.interfaces.lifecycle.configure')
+        current_ctx.set(_ctx)
+        self.fake_client.head_object = MagicMock(side_effect=ClientError(
+            {'Error': {'Code': '404', 'Message': 'Not Found'}},
+            'HeadObject'))
+        self.fake_client.create_stack = MagicMock(
+            return_value={'StackId': 'stack'})
+        params = {'StackName': 'stack',
+                  'TemplateBody': properties['resource_config']['kwargs'][
+                      'TemplateBody']}
+
+        stack.stage_template(_ctx, params)
+        self.assertNotIn('TemplateBody', params)
+        self.assertTrue(params['TemplateURL'].startswith(
+            'https://templates.s3.aq-testzone-1.amazonaws.com/'
+            'cloudify/cloudformation/'))
+        self.assertEqual(self.fake_client.put_object.call_count, 1)
+
+        params = {'StackName': 'stack',
+                  'TemplateBody': properties['resource_config']['kwargs'][
+                      'TemplateBody']}
+        stack.stage_template(_ctx, params)
+        self.assertIn('TemplateURL', params)
+        self.assertEqual(self.fake_client.head_object.call_count, 1)
+        self.assertEqual(self.fake_client.put_object.call_count, 1)
+
+    def test_start(self):
+        _ctx = self.get_mock_ctx(
+            'test_start', test_properties=NODE_PROPERTIES,
+            test_runtime_properties=copy.deepcopy(RUNTIMEPROP_AFTER_CREATE),
+            type_hierarchy=STACK_TH,
+            ctx_operation_name='cloudify.interfaces.lifecycle.start')
+        current_ctx.set(_ctx)
+        self.fake_client.describe_stacks = MagicMock(return_value={
+            'Stacks': [{'StackName': 'Stack',
+                        'StackId': 'stack',
+                        'StackStatus': 'CREATE_COMPLETE',
+                        'Parameters': [{'ParameterKey': 'Size',
+                                        'ParameterValue': '1'}],
+                        'Outputs': [{'OutputKey': 'Url',
+                                     'OutputValue': 'http://stack'}]}]
+        })
+        stack.start(ctx=_ctx, iface=None)
+        runtime_properties = _ctx.instance.runtime_properties
+        self.assertEqual(runtime_properties['outputs_items'],
+                         {'Url': 'http://stack'})
+        self.assertEqual(runtime_properties['StackStatus'], 'CREATE_COMPLETE')
+        self.assertEqual(runtime_properties['StackId'], 'stack')
+        self.assertEqual(runtime_properties['Outputs'],
+                         [{'OutputKey': 'Url',
+                           'OutputValue': 'http://stack'}])
+        self.assertNotIn('Parameters', runtime_properties)
+
+        runtime_properties['outputs_items'] = 'unchanged'
+        stack.start(ctx=_ctx, iface=None)
+        self.assertEqual(runtime_properties['outputs_items'], 'unchanged')
+
+    def test_start_refresh_keys(self):
+        node_properties = dict(NODE_PROPERTIES, refresh_keys=['StackId'])
+        _ctx = self.get_mock_ctx(
+            'test_start', test_properties=node_properties,
+            test_runtime_properties=copy.deepcopy(RUNTIMEPROP_AFTER_CREATE),
+            type_hierarchy=STACK_TH,
+            ctx_operation_name='cloudify.interfaces.lifecycle.start')
+        current_ctx.set(_ctx)
+        self.fake_client.describe_stacks = MagicMock(return_value={
+            'Stacks': [{'StackId': 'stack',
+                        'StackStatus': 'CREATE_COMPLETE'}]})
+        stack.start(ctx=_ctx, iface=None)
+        runtime_properties = _ctx.instance.runtime_properties
+        self.assertNotIn('StackStatus', runtime_properties)
+
+        # Unchanged without StackStatus in the refresh keys
+        runtime_properties['StackId'] = 'unchanged'
+        stack.start(ctx=_ctx, iface=None)
+        self.assertEqual(runtime_properties['StackId'], 'unchanged')
+
+        self.fake_client.describe_stacks.return_value = {
+            'Stacks': [{'StackId': 'other'}]}
+        stack.start(ctx=_ctx, iface=None)
+        self.assertEqual(runtime_properties['StackId'], 'other')
+
     def test_CloudFormationStackClass_properties(self):
         self.fake_client.describe_stacks = MagicMock(return_value={
             'Stacks': [{'StackName': 'Stack'}]
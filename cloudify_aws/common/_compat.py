@@ -21,7 +21,7 @@ PY2 = sys.version_info[0] == 2
 
 if PY2:
     from urllib2 import urlopen
-    from urlparse import urljoin
+    from urlparse import urljoin, urlparse
     try:
         from cStringIO import StringIO
     except ImportError:
@@ -31,11 +31,11 @@ if PY2:
 else:
     from io import StringIO
     from imp import reload as reload_module
-    from urllib.parse import urljoin
+    from urllib.parse import urljoin, urlparse
     from urllib.request import urlopen
     text_type = str
 
 __all__ = [
-    'PY2', 'text_type', 'urljoin',
+    'PY2', 'text_type', 'urljoin', 'urlparse',
     'urlopen', 'StringIO', 'reload_module'
 ]
\ No newline at end of file
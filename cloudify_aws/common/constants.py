@@ -16,6 +16,8 @@
     ~~~~~~~~~~~~~~~~
     AWS constants
 '''
+import os
+import tempfile
 
 AWS_CONFIG_PROPERTY = 'client_config'
 EXTERNAL_RESOURCE_ID = 'aws_resource_id'
@@ -36,3 +38,23 @@ SWIFT_ERROR_TOKEN_CODE = 'SignatureDoesNotMatch'
 
 
 MAX_AWS_NAME = 255
+
+# Upper bound of concurrent API calls issued by a single operation
+DEFAULT_MAX_WORKERS = 10
+
+# Error codes of transient API failures that are safe to retry
+RETRYABLE_ERROR_CODES = [
+    'Throttling',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'ProvisionedThroughputExceededException',
+    'TooManyRequestsException',
+    'InternalError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'Unavailable',
+    'RequestTimeout',
+]
+
+# Host-local state shared between operations (caches, claim indexes)
+LOCAL_STORE_DIR = os.path.join(tempfile.gettempdir(), 'cloudify-aws-plugin')
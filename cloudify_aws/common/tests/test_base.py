@@ -14,6 +14,8 @@
 
 import unittest
 import copy
+import shutil
+import tempfile
 from functools import wraps
 
 from mock import MagicMock, patch
@@ -73,17 +75,27 @@ def mock_decorator(*args, **kwargs):
 class TestBase(unittest.TestCase):
 
     sleep_mock = None
+    local_store_mock = None
 
     def setUp(self):
         super(TestBase, self).setUp()
         mock_sleep = MagicMock()
         self.sleep_mock = patch('time.sleep', mock_sleep)
         self.sleep_mock.start()
+        self.local_store_dir = tempfile.mkdtemp()
+        self.local_store_mock = patch(
+            'cloudify_aws.common.constants.LOCAL_STORE_DIR',
+            self.local_store_dir)
+        self.local_store_mock.start()
 
     def tearDown(self):
         if self.sleep_mock:
             self.sleep_mock.stop()
             self.sleep_mock = None
+        if self.local_store_mock:
+            self.local_store_mock.stop()
+            self.local_store_mock = None
+            shutil.rmtree(self.local_store_dir, ignore_errors=True)
         current_ctx.clear()
         super(TestBase, self).tearDown()
 
@@ -12,8 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
 import unittest
-from mock import MagicMock
+from mock import MagicMock, patch
+from botocore.exceptions import ClientError
 
 from cloudify.state import current_ctx
 from cloudify.mocks import MockCloudifyContext
@@ -331,6 +334,114 @@ class TestUtils(TestBase):
             all([isinstance(t['Value'], text_type) for t in out]))
         self.assertTrue(len(out) is 3)
 
+    def test_chunks(self):
+        self.assertEqual(list(utils.chunks(range(5), 2)),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(utils.chunks(iter([]), 2)), [])
+
+    def test_chunks_by_size(self):
+        self.assertEqual(
+            list(utils.chunks_by_size(['a', 'bb', 'c', 'dddd', 'e'], 2, 3,
+                                      len)),
+            [['a', 'bb'], ['c'], ['dddd'], ['e']])
+        self.assertEqual(utils.get_message_size(
+            u'\xe9', {'k': {'DataType': 'String', 'StringValue': 'v'}}),
+            2 + 1 + 42)
+
+    def test_run_in_parallel(self):
+        def _double(item):
+            if item == 3:
+                raise ValueError('bad item')
+            return item * 2
+
+        res = utils.run_in_parallel(_double, range(5), max_workers=3)
+        self.assertEqual([r[0] for r in res], [0, 1, 2, 3, 4])
+        self.assertEqual([r[1] for r in res], [0, 2, 4, None, 8])
+        self.assertIsInstance(res[3][2], ValueError)
+        self.assertEqual(utils.run_in_parallel(_double, [1]),
+                         [(1, 2, None)])
+
+    def test_is_retryable_error(self):
+        def _error(code):
+            return ClientError({'Error': {'Code': code}}, 'Operation')
+
+        self.assertTrue(utils.is_retryable_error(_error('Throttling')))
+        self.assertTrue(
+            utils.is_retryable_error(_error('RequestLimitExceeded')))
+        self.assertFalse(
+            utils.is_retryable_error(_error('InvalidParameterValue')))
+        self.assertFalse(utils.is_retryable_error(ValueError('bad item')))
+
+    def test_local_store(self):
+        with utils.local_store('test/store') as store:
+            self.assertEqual(store, {})
+            store['key'] = ['value']
+        with utils.local_store('test/store') as store:
+            self.assertEqual(store, {'key': ['value']})
+        with self.assertRaises(ValueError):
+            with utils.local_store('test/store') as store:
+                store['key'] = 'changed'
+                raise ValueError()
+        with utils.local_store('test/store') as store:
+            self.assertEqual(store, {'key': ['value']})
+
+    def test_rate_limiter(self):
+        limiter = utils.RateLimiter('test', rate=2, burst=2)
+        with patch('cloudify_aws.common.utils.time') as mock_time:
+            mock_time.time.return_value = 100.0
+            limiter.acquire()
+            limiter.acquire()
+            self.assertFalse(mock_time.sleep.called)
+
+            def sleep(seconds):
+                mock_time.time.return_value += seconds
+            mock_time.sleep.side_effect = sleep
+            limiter.acquire()
+            mock_time.sleep.assert_called_once_with(0.5)
+
+    def test_iter_in_parallel(self):
+        items = iter(range(25))
+        results = list(utils.iter_in_parallel(
+            lambda item: 10 / (item % 5), items, max_workers=3))
+        self.assertEqual([item for item, _, _ in results], list(range(25)))
+        self.assertEqual(results[2][1], 5)
+        self.assertIsInstance(results[5][2], ZeroDivisionError)
+
+    def test_iter_json_lines(self):
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as json_file:
+            json_file.write('{"a": 1}\n\n[2]\n')
+        try:
+            self.assertEqual(list(utils.iter_json_lines(path)),
+                             [{'a': 1}, [2]])
+        finally:
+            os.remove(path)
+
+    def test_get_percentiles(self):
+        self.assertEqual(utils.get_percentiles([]), {})
+        self.assertEqual(
+            utils.get_percentiles(list(range(100, 0, -1))),
+            {'p50': 50, 'p90': 90, 'p99': 99})
+        self.assertEqual(utils.get_percentiles([3, 1], (50, 100)),
+                         {'p50': 1, 'p100': 3})
+
+    def test_get_throughput_summary(self):
+        with patch('cloudify_aws.common.utils.time.time', return_value=12):
+            self.assertEqual(utils.get_throughput_summary(20, 10),
+                             {'duration': 2, 'throughput': 10})
+            self.assertEqual(
+                utils.get_throughput_summary(0, 12, [0.1, 0.2], (50,)),
+                {'duration': 0, 'throughput': None,
+                 'latency': {'p50': 100.0}})
+
+    def test_get_retry_interval(self):
+        self.assertEqual(utils.get_retry_interval(0), 5)
+        self.assertEqual(utils.get_retry_interval(2), 20)
+        self.assertEqual(utils.get_retry_interval(3), 40)
+        self.assertEqual(utils.get_retry_interval(500), 60)
+        self.assertEqual(
+            utils.get_retry_interval(1, initial=15, maximum=20), 20)
+
 
 if __name__ == '__main__':
     unittest.main()
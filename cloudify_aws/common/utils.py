@@ -18,11 +18,19 @@
 '''
 
 # Standard imports
+import os
 import sys
 import re
+import json
+import time
 import uuid
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 # Third party imports
+import fasteners
 import requests
 from requests import exceptions
 
@@ -395,6 +403,153 @@ def get_uuid():
     return text_type(uuid.uuid4())
 
 
+def chunks(iterable, size):
+    '''
+        Splits an iterable into lists of at most ``size`` items.
+    :param iterable: Items to split. Generators are consumed lazily.
+    :param int size: Maximum number of items per chunk.
+    :returns: Generator of lists
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def chunks_by_size(iterable, size, max_bytes, get_size):
+    '''
+        Like chunks, but also bounds the total size of every chunk, e.g. to
+        stay within the payload limit of a batch API call.
+    :param int max_bytes: Maximum total size per chunk. An item larger
+        than this is yielded in a chunk of its own.
+    :param get_size: Callable returning the size of an item, in bytes.
+    :returns: Generator of lists
+    '''
+    chunk = []
+    chunk_size = 0
+    for item in iterable:
+        item_size = get_size(item)
+        if chunk and (len(chunk) == size or
+                      chunk_size + item_size > max_bytes):
+            yield chunk
+            chunk = []
+            chunk_size = 0
+        chunk.append(item)
+        chunk_size += item_size
+    if chunk:
+        yield chunk
+
+
+def get_message_size(body, attributes=None):
+    '''
+        Gets the size of a message body and its message attributes, as
+        counted against the SNS and SQS payload limits.
+    '''
+    size = len(body.encode('utf-8'))
+    for name, attribute in (attributes or dict()).items():
+        size += len(name.encode('utf-8')) + len(json.dumps(attribute))
+    return size
+
+
+def run_in_parallel(function, items,
+                    max_workers=constants.DEFAULT_MAX_WORKERS):
+    '''
+        Calls a function for every item on a bounded pool of threads.
+        Exceptions are collected instead of being raised so that a single
+        failing item does not abort the remaining ones.
+    :param function: Callable accepting a single item.
+    :param items: Items to process.
+    :param int max_workers: Upper bound of concurrent calls.
+    :returns: List of (item, result, error) tuples, in the order of items.
+    '''
+    def _call(item):
+        try:
+            return item, function(item), None
+        except Exception as error:
+            return item, None, error
+
+    items = list(items)
+    if len(items) < 2 or max_workers < 2:
+        return [_call(item) for item in items]
+    pool = ThreadPool(min(max_workers, len(items)))
+    try:
+        return pool.map(_call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def is_retryable_error(error):
+    '''
+        Checks whether an error returned by run_in_parallel is a transient
+        API failure (throttling, service side errors) worth a retry.
+    :param error: Exception raised for an item.
+    '''
+    response = getattr(error, 'response', None) or dict()
+    return response.get('Error', dict()).get('Code') in \
+        constants.RETRYABLE_ERROR_CODES
+
+
+def iter_in_parallel(function, items,
+                     max_workers=constants.DEFAULT_MAX_WORKERS):
+    '''
+        Like run_in_parallel, but consumes items lazily, a bounded window at
+        a time, so that large or streamed inputs are never held in memory.
+    :returns: Generator of (item, result, error) tuples, in the order of
+        items.
+    '''
+    for window in chunks(items, max(max_workers, 1) * 4):
+        for result in run_in_parallel(function, window, max_workers):
+            yield result
+
+
+def iter_json_lines(path):
+    '''
+        Yields the JSON documents of a JSON Lines file, one line at a time.
+        Blank lines are skipped.
+    '''
+    with open(path, 'r') as json_file:
+        for line in json_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def get_percentiles(values, percentiles=(50, 90, 99)):
+    '''
+        Gets nearest-rank percentiles, e.g. of latencies.
+    :returns: dict like {'p50': ..., 'p99': ...}, empty without values.
+    '''
+    values = sorted(values)
+    if not values:
+        return dict()
+    return dict(
+        ('p{0}'.format(percentile),
+         values[max(0, -(-percentile * len(values) // 100) - 1)])
+        for percentile in percentiles)
+
+
+def get_throughput_summary(count, started, latencies=None,
+                           percentiles=(50, 90, 99)):
+    '''
+        Summarizes a bulk operation which processed count items since the
+        started timestamp.
+    :param latencies: Call latencies in seconds. When given, their
+        percentiles are added in milliseconds.
+    :returns: dict with the duration, throughput and latency.
+    '''
+    duration = time.time() - started
+    summary = dict(
+        duration=round(duration, 3),
+        throughput=round(count / duration, 2) if duration else None)
+    if latencies is not None:
+        summary['latency'] = dict(
+            (key, round(value * 1000, 1)) for key, value in
+            get_percentiles(latencies, percentiles).items())
+    return summary
+
+
 class JsonCleanuper(object):
 
     def __init__(self, ob):
@@ -438,6 +593,94 @@ class JsonCleanuper(object):
         return self.value
 
 
+_local_store_locks = dict()
+_local_store_locks_guard = threading.Lock()
+
+
+def get_local_store_path(name):
+    '''
+        Gets the path of a host-local store file, creating its
+        directory when needed.
+    :param str name: Store name.
+    :returns: Absolute file path
+    '''
+    store_dir = constants.LOCAL_STORE_DIR
+    try:
+        os.makedirs(store_dir)
+    except OSError:
+        if not os.path.isdir(store_dir):
+            raise
+    return os.path.join(
+        store_dir, re.sub(r'[^a-zA-Z0-9_.-]+', '_', name) + '.json')
+
+
+@contextmanager
+def local_store(name):
+    '''
+        Opens a JSON document shared by all operations running on this
+        host. Access is serialized between threads and processes, and the
+        document is written back when the block exits without an error.
+    :param str name: Store name.
+    :yields: The store content as a dictionary.
+    '''
+    path = get_local_store_path(name)
+    with _local_store_locks_guard:
+        thread_lock = _local_store_locks.setdefault(path, threading.Lock())
+    with thread_lock, fasteners.InterProcessLock(path + '.lock'):
+        try:
+            with open(path, 'r') as store_file:
+                store = json.load(store_file)
+        except (IOError, OSError, ValueError):
+            store = dict()
+        yield store
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w') as store_file:
+            json.dump(store, store_file)
+        os.rename(temp_path, path)
+
+
+class RateLimiter(object):
+    '''
+        Token bucket shared by all operations running on this host, used
+        to keep concurrent operations below a per-account API rate.
+    :param str name: Name of the bucket, e.g. the AWS service.
+    :param float rate: Tokens added per second.
+    :param float burst: Maximum number of tokens, defaults to rate.
+    '''
+    def __init__(self, name, rate, burst=None):
+        self.name = 'rate-limit-{0}'.format(name)
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+
+    def acquire(self, tokens=1):
+        '''Blocks until the requested tokens are available'''
+        while True:
+            with local_store(self.name) as bucket:
+                now = time.time()
+                available = min(
+                    self.burst,
+                    bucket.get('tokens', self.burst) +
+                    max(now - bucket.get('timestamp', now), 0) * self.rate)
+                bucket['timestamp'] = now
+                if available >= tokens:
+                    bucket['tokens'] = available - tokens
+                    return
+                bucket['tokens'] = available
+            time.sleep((tokens - available) / self.rate)
+
+
+def get_retry_interval(retry_number, initial=5, maximum=60):
+    '''
+        Gets the interval before the next status poll. The interval doubles
+        with every retry up to maximum, so that long running resources are
+        polled less often while short ones still finish quickly.
+    :param int retry_number: Retry number of the current operation.
+    :param int initial: Interval of the first retry, in seconds.
+    :param int maximum: Maximum interval, in seconds.
+    '''
+    return min(maximum, initial * 2 ** min(retry_number, 10))
+
+
 def generate_swift_access_config(auth_url, username, password):
 
     payload = dict()
@@ -16,15 +16,43 @@
     ~~~~~~~~~~~~~~
     AWS DynamoDB Table interface
 """
+# Standard imports
+import io
+import os
+import csv
+import gzip
+import json
+import time
+import random
+from decimal import Decimal
+from itertools import islice
+
 # Third party imports
+from boto3.dynamodb.types import TypeSerializer
 from botocore.exceptions import ClientError
 
 # Cloudify
-from cloudify_aws.common import decorators, utils
+from cloudify.exceptions import NonRecoverableError, OperationRetry
+from cloudify_aws.common import constants, decorators, utils
+from cloudify_aws.common.connection import Boto3Connection
 from cloudify_aws.dynamodb import DynamoDBBase
 
 RESOURCE_TYPE = 'DynamoDB Table'
 RESOURCE_NAME = 'TableName'
+# API limit of items per batch_write_item call
+BATCH_WRITE_MAX_ITEMS = 25
+UNPROCESSED_MAX_ATTEMPTS = 8
+UNPROCESSED_BACKOFF = 0.05
+UNPROCESSED_BACKOFF_MAX = 5
+# Seconds between checkpoints saved to the manager
+CHECKPOINT_INTERVAL = 30
+SEED_FORMATS = ['jsonl', 'csv']
+CAPACITY_UNITS = ['ReadCapacityUnits', 'WriteCapacityUnits']
+SCALING_METRICS = {
+    'read': ('ReadCapacityUnits', 'DynamoDBReadCapacityUtilization'),
+    'write': ('WriteCapacityUnits', 'DynamoDBWriteCapacityUtilization'),
+}
+SSE_ENABLED = ['ENABLED', 'ENABLING', 'UPDATING']
 
 
 class DynamoDBTable(DynamoDBBase):
@@ -70,6 +98,305 @@ class DynamoDBTable(DynamoDBBase):
                           % (self.type_name, params))
         self.client.delete_table(**params)
 
+    def update(self, params):
+        """
+            Updates an existing AWS DynamoDB Table.
+        """
+        params = dict(params, TableName=self.resource_id)
+        self.logger.debug('Updating %s with parameters: %s'
+                          % (self.type_name, params))
+        return self.client.update_table(**params)
+
+    def batch_write(self, items):
+        """
+            Puts items with batch_write_item, retrying UnprocessedItems with
+            exponential backoff.
+        :param items: up to BATCH_WRITE_MAX_ITEMS items, in DynamoDB JSON
+        :return: the number of items written
+        """
+        requests = [dict(PutRequest=dict(Item=item)) for item in items]
+        for attempt in range(UNPROCESSED_MAX_ATTEMPTS):
+            res = self.client.batch_write_item(
+                RequestItems={self.resource_id: requests})
+            requests = res.get('UnprocessedItems', dict()).get(
+                self.resource_id)
+            if not requests:
+                return len(items)
+            time.sleep(random.uniform(0.5, 1) * min(
+                UNPROCESSED_BACKOFF_MAX, UNPROCESSED_BACKOFF * 2 ** attempt))
+        raise NonRecoverableError(
+            '%d items of %s ID# "%s" were still unprocessed after %d '
+            'attempts.' % (len(requests), self.type_name, self.resource_id,
+                           UNPROCESSED_MAX_ATTEMPTS))
+
+
+def _get_billing_mode(table):
+    return table.get('BillingModeSummary', dict()).get(
+        'BillingMode', 'PROVISIONED')
+
+
+def _get_throughput(config):
+    throughput = config.get('ProvisionedThroughput') or dict()
+    return dict((key, int(throughput[key]))
+                for key in CAPACITY_UNITS if key in throughput)
+
+
+def _is_throughput_changed(desired, current, scaled):
+    """Compares throughput, ignoring the units managed by auto scaling"""
+    desired = _get_throughput(desired)
+    current = _get_throughput(current)
+    return any(desired[key] != current.get(key) for key in desired
+               if key not in scaled)
+
+
+def _get_scaled_units(auto_scaling):
+    return [SCALING_METRICS[key][0] for key in SCALING_METRICS
+            if (auto_scaling or dict()).get(key)]
+
+
+def get_table_updates(desired, current, auto_scaling=None):
+    """
+        Diffs the desired table configuration against the describe_table
+        output, returning the update_table parameters of every required
+        change in the order they have to be applied. DynamoDB only allows
+        one index to be created or deleted per update, so each of these is
+        a separate step.
+    :param desired: Table configuration, as passed to create_table.
+    :param current: Table description, as returned by describe_table.
+    :param auto_scaling: Auto scaling configuration, throughput managed by
+        it is not reverted.
+    :returns: List of update_table parameters, without TableName.
+    """
+    auto_scaling = auto_scaling or dict()
+    updates = []
+    current_indexes = dict(
+        (index['IndexName'], index)
+        for index in current.get('GlobalSecondaryIndexes') or [])
+    # Indexes are only managed when the configuration lists them
+    desired_indexes = dict(
+        (index['IndexName'], index)
+        for index in desired.get('GlobalSecondaryIndexes') or [])
+    if 'GlobalSecondaryIndexes' not in desired:
+        desired_indexes = current_indexes
+
+    for name in current_indexes:
+        if name not in desired_indexes:
+            updates.append(dict(GlobalSecondaryIndexUpdates=[
+                dict(Delete=dict(IndexName=name))]))
+
+    billing_mode = desired.get('BillingMode') or _get_billing_mode(current)
+    capacity = dict()
+    index_updates = []
+    if billing_mode != _get_billing_mode(current):
+        capacity['BillingMode'] = billing_mode
+    switched = 'BillingMode' in capacity
+    if billing_mode == 'PROVISIONED':
+        # Switching to PROVISIONED requires the throughput of the table and
+        # of every index
+        if switched:
+            capacity['ProvisionedThroughput'] = _get_throughput(desired)
+        elif _is_throughput_changed(
+                desired, current, _get_scaled_units(auto_scaling)):
+            # Units left out of the configuration keep their current value
+            capacity['ProvisionedThroughput'] = dict(
+                _get_throughput(current), **_get_throughput(desired))
+        index_scaling = auto_scaling.get('indexes') or dict()
+        for name, index in desired_indexes.items():
+            if name not in current_indexes:
+                continue
+            if switched:
+                throughput = _get_throughput(index)
+            elif _is_throughput_changed(
+                    index, current_indexes[name],
+                    _get_scaled_units(index_scaling.get(name))):
+                throughput = dict(_get_throughput(current_indexes[name]),
+                                  **_get_throughput(index))
+            else:
+                continue
+            index_updates.append(dict(Update=dict(
+                IndexName=name, ProvisionedThroughput=throughput)))
+    if index_updates:
+        capacity['GlobalSecondaryIndexUpdates'] = index_updates
+    if capacity:
+        updates.append(capacity)
+
+    stream = desired.get('StreamSpecification') or dict()
+    current_stream = current.get('StreamSpecification') or dict()
+    if stream and (
+            bool(stream.get('StreamEnabled')) !=
+            bool(current_stream.get('StreamEnabled')) or
+            stream.get('StreamEnabled') and
+            stream.get('StreamViewType') !=
+            current_stream.get('StreamViewType')):
+        if current_stream.get('StreamEnabled'):
+            # The view type of an enabled stream cannot be changed in place
+            updates.append(dict(StreamSpecification=dict(
+                StreamEnabled=False)))
+        if stream.get('StreamEnabled'):
+            updates.append(dict(StreamSpecification=stream))
+
+    sse = desired.get('SSESpecification') or dict()
+    current_sse = current.get('SSEDescription') or dict()
+    if sse and bool(sse.get('Enabled')) != \
+            (current_sse.get('Status') in SSE_ENABLED):
+        updates.append(dict(SSESpecification=sse))
+
+    key_names = [key['AttributeName'] for key in
+                 current.get('KeySchema') or desired.get('KeySchema') or []]
+    for name, index in desired_indexes.items():
+        if name in current_indexes:
+            continue
+        create = dict((key, value) for key, value in index.items()
+                      if key != 'ProvisionedThroughput')
+        if billing_mode == 'PROVISIONED':
+            create['ProvisionedThroughput'] = _get_throughput(index)
+        names = key_names + [key['AttributeName']
+                             for key in index['KeySchema']]
+        updates.append(dict(
+            AttributeDefinitions=[
+                attribute for attribute in
+                desired.get('AttributeDefinitions') or []
+                if attribute['AttributeName'] in names],
+            GlobalSecondaryIndexUpdates=[dict(Create=create)]))
+    return updates
+
+
+def _get_missing_throughput(updates):
+    """
+        Lists the table and indexes which the updates leave without both
+        capacity units, which update_table would reject.
+    """
+    missing = []
+    for params in updates:
+        if 'ProvisionedThroughput' in params and \
+                len(params['ProvisionedThroughput']) < len(CAPACITY_UNITS):
+            missing.append('table')
+        for index_update in params.get('GlobalSecondaryIndexUpdates') or []:
+            index = index_update.get('Create') or \
+                index_update.get('Update') or dict()
+            if 'ProvisionedThroughput' in index and \
+                    len(index['ProvisionedThroughput']) < len(CAPACITY_UNITS):
+                missing.append('index %s' % index['IndexName'])
+    return missing
+
+
+def _is_table_idle(table):
+    """Checks that the table and all of its indexes are ACTIVE"""
+    return table.get('TableStatus') == 'ACTIVE' and all(
+        index.get('IndexStatus') == 'ACTIVE' and
+        not index.get('Backfilling')
+        for index in table.get('GlobalSecondaryIndexes') or [])
+
+
+def get_scalable_targets(table_name, auto_scaling):
+    """
+        Gets the Application Auto Scaling targets of the auto scaling
+        configuration of a table and its global secondary indexes.
+    :returns: List of (ResourceId, ScalableDimension, config) tuples.
+    """
+    auto_scaling = auto_scaling or dict()
+    resources = [('table/{0}'.format(table_name), 'table', auto_scaling)]
+    for name, config in (auto_scaling.get('indexes') or dict()).items():
+        resources.append(('table/{0}/index/{1}'.format(table_name, name),
+                          'index', config or dict()))
+    targets = []
+    for resource_id, kind, config in resources:
+        for key in sorted(SCALING_METRICS):
+            if config.get(key):
+                targets.append((
+                    resource_id,
+                    'dynamodb:{0}:{1}'.format(kind, SCALING_METRICS[key][0]),
+                    config[key]))
+    return targets
+
+
+def configure_auto_scaling(ctx, table_name, auto_scaling):
+    """
+        Registers the Application Auto Scaling targets and target tracking
+        policies of a table, deregistering the ones no longer configured.
+    """
+    targets = get_scalable_targets(table_name, auto_scaling)
+    registered = ctx.instance.runtime_properties.get('scalable_targets', [])
+    if not targets and not registered:
+        return
+    client = Boto3Connection(ctx.node).client('application-autoscaling')
+    for resource_id, dimension, config in targets:
+        client.register_scalable_target(
+            ServiceNamespace='dynamodb',
+            ResourceId=resource_id,
+            ScalableDimension=dimension,
+            MinCapacity=int(config['min_capacity']),
+            MaxCapacity=int(config['max_capacity']))
+        metric = dict(SCALING_METRICS.values())[dimension.rsplit(':', 1)[1]]
+        client.put_scaling_policy(
+            PolicyName='{0}-{1}'.format(resource_id.replace('/', '-'),
+                                        metric),
+            ServiceNamespace='dynamodb',
+            ResourceId=resource_id,
+            ScalableDimension=dimension,
+            PolicyType='TargetTrackingScaling',
+            TargetTrackingScalingPolicyConfiguration=dict(
+                TargetValue=float(config.get('target_utilization') or 70),
+                PredefinedMetricSpecification=dict(
+                    PredefinedMetricType=metric),
+                ScaleInCooldown=int(config.get('scale_in_cooldown') or 60),
+                ScaleOutCooldown=int(
+                    config.get('scale_out_cooldown') or 60)))
+        ctx.logger.info('Registered auto scaling of %s between %s and %s.'
+                        % (dimension, config['min_capacity'],
+                           config['max_capacity']))
+    desired = [[resource_id, dimension]
+               for resource_id, dimension, _config in targets]
+    deregister_scalable_targets(
+        client, [target for target in registered if target not in desired])
+    ctx.instance.runtime_properties['scalable_targets'] = desired
+
+
+def deregister_scalable_targets(client, targets):
+    """Deregisters Application Auto Scaling targets, with their policies"""
+    for resource_id, dimension in targets:
+        try:
+            client.deregister_scalable_target(
+                ServiceNamespace='dynamodb',
+                ResourceId=resource_id,
+                ScalableDimension=dimension)
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ObjectNotFoundException':
+                raise
+
+
+def _get_seed_format(source, data_format, compressed):
+    name = source.lower()
+    if compressed is None:
+        compressed = name.endswith('.gz')
+        name = name[:-3] if compressed else name
+    data_format = data_format or ('csv' if name.endswith('.csv') else 'jsonl')
+    if data_format not in SEED_FORMATS:
+        raise NonRecoverableError(
+            'Unsupported seed format {0}, expected one of {1}.'.format(
+                data_format, SEED_FORMATS))
+    return data_format, compressed
+
+
+def iter_seed_items(path, data_format='jsonl', compressed=False):
+    """
+        Streams the items of a JSON Lines or CSV file, optionally gzipped,
+        serialized to DynamoDB JSON. CSV values are strings and empty ones
+        are left out.
+    """
+    serializer = TypeSerializer()
+    raw_file = gzip.open(path, 'rb') if compressed else open(path, 'rb')
+    with io.TextIOWrapper(raw_file, encoding='utf-8', newline='') as _file:
+        if data_format == 'csv':
+            rows = (dict((key, value) for key, value in row.items() if value)
+                    for row in csv.DictReader(_file))
+        else:
+            rows = (json.loads(line, parse_float=Decimal)
+                    for line in _file if line.strip())
+        for row in rows:
+            yield dict((key, serializer.serialize(value))
+                       for key, value in row.items())
+
 
 @decorators.aws_resource(DynamoDBTable, RESOURCE_TYPE)
 @decorators.wait_for_status(status_pending=['CREATING', 'UPDATING'],
@@ -87,12 +414,89 @@ def create(ctx, iface, resource_config, params, **_):
         ctx.instance, create_respose['TableDescription']['TableArn'])
 
 
+@decorators.aws_resource(DynamoDBTable, RESOURCE_TYPE)
+def configure(ctx, iface, resource_config, **_):
+    """
+        Configures the auto scaling of an AWS DynamoDB Table once the table
+        and its indexes are ACTIVE.
+    """
+    table = iface.properties
+    if not table:
+        raise NonRecoverableError('%s ID# "%s" does not exist.'
+                                  % (iface.type_name, iface.resource_id))
+    if not _is_table_idle(table):
+        raise OperationRetry(
+            '%s ID# "%s" indexes are still being created.'
+            % (iface.type_name, iface.resource_id))
+    configure_auto_scaling(ctx, iface.resource_id,
+                           ctx.node.properties.get('auto_scaling')
+                           if _get_billing_mode(table) == 'PROVISIONED'
+                           else None)
+
+
+@decorators.aws_resource(DynamoDBTable, RESOURCE_TYPE)
+def update(ctx, iface, resource_config, auto_scaling=None, **_):
+    """
+        Updates an AWS DynamoDB Table to match its configuration, applying
+        one update_table change per retry and waiting for the table and its
+        indexes to be ACTIVE in between. Auto scaling is configured once
+        every change is applied.
+    """
+    runtime_properties = ctx.instance.runtime_properties
+    if auto_scaling is None:
+        auto_scaling = ctx.node.properties.get('auto_scaling')
+    table = iface.properties
+    if not table:
+        raise NonRecoverableError('%s ID# "%s" does not exist.'
+                                  % (iface.type_name, iface.resource_id))
+    polls = runtime_properties.get('update_polls', 0)
+    if not _is_table_idle(table):
+        runtime_properties['update_polls'] = polls + 1
+        raise OperationRetry(
+            '%s ID# "%s" is still being updated.'
+            % (iface.type_name, iface.resource_id),
+            retry_after=utils.get_retry_interval(polls))
+
+    updates = get_table_updates(resource_config, table, auto_scaling)
+    missing = _get_missing_throughput(updates)
+    if missing:
+        raise NonRecoverableError(
+            '%s ID# "%s" cannot be updated, ProvisionedThroughput with %s '
+            'is missing for the %s.'
+            % (iface.type_name, iface.resource_id,
+               ' and '.join(CAPACITY_UNITS), ', '.join(missing)))
+    if updates:
+        ctx.logger.info('Applying %s ID# "%s" update %s, %d remaining.'
+                        % (iface.type_name, iface.resource_id, updates[0],
+                           len(updates) - 1))
+        iface.update(updates[0])
+        runtime_properties['update_polls'] = 0
+        raise OperationRetry(
+            'Waiting for %s ID# "%s" to be updated.'
+            % (iface.type_name, iface.resource_id),
+            retry_after=utils.get_retry_interval(0))
+
+    runtime_properties.pop('update_polls', None)
+    configure_auto_scaling(ctx, iface.resource_id,
+                           auto_scaling
+                           if _get_billing_mode(table) == 'PROVISIONED'
+                           else None)
+    ctx.logger.info('%s ID# "%s" is up to date.'
+                    % (iface.type_name, iface.resource_id))
+
+
 @decorators.aws_resource(DynamoDBTable, RESOURCE_TYPE,
                          ignore_properties=True)
 @decorators.wait_for_delete(status_pending=['DELETING'])
-def delete(iface, resource_config, **_):
+def delete(ctx, iface, resource_config, **_):
     """Deletes an AWS DynamoDB Table"""
 
+    targets = ctx.instance.runtime_properties.get('scalable_targets')
+    if targets:
+        deregister_scalable_targets(
+            Boto3Connection(ctx.node).client('application-autoscaling'),
+            targets)
+
     # Create a copy of the resource config for clean manipulation.
     params = \
         dict() if not resource_config else resource_config.copy()
@@ -102,3 +506,69 @@ def delete(iface, resource_config, **_):
         params.update({RESOURCE_NAME: iface.resource_id})
 
     iface.delete(params)
+
+
+@decorators.aws_resource(DynamoDBTable, RESOURCE_TYPE,
+                         ignore_properties=True)
+def seed(ctx,
+         iface,
+         source,
+         data_format=None,
+         compressed=None,
+         max_workers=constants.DEFAULT_MAX_WORKERS,
+         **_):
+    """
+        Writes the items of a JSON Lines or CSV file to an AWS DynamoDB
+        Table, streaming the file in batches on a bounded pool of threads.
+        Progress is checkpointed in the seed_checkpoint runtime property,
+        and a retry resumes after the last checkpointed item.
+    """
+    data_format, compressed = \
+        _get_seed_format(source, data_format, compressed)
+    runtime_properties = ctx.instance.runtime_properties
+    checkpoint = runtime_properties.get('seed_checkpoint') or dict()
+    if checkpoint.get('source') != source:
+        checkpoint = dict(source=source, items=0)
+    path = source
+    downloaded = not os.path.exists(path)
+    if downloaded:
+        path = ctx.download_resource(source)
+    started = last_saved = time.time()
+    written = 0
+    try:
+        items = islice(iter_seed_items(path, data_format, compressed),
+                       checkpoint['items'], None)
+        if checkpoint['items']:
+            ctx.logger.info('Resuming seeding of %s ID# "%s" after %d items.'
+                            % (iface.type_name, iface.resource_id,
+                               checkpoint['items']))
+        batches = utils.chunks(items, BATCH_WRITE_MAX_ITEMS)
+        for batch, count, error in utils.iter_in_parallel(
+                iface.batch_write, batches, max_workers):
+            if error:
+                message = 'Failed to seed %s ID# "%s" after %d items: %s' \
+                    % (iface.type_name, iface.resource_id,
+                       checkpoint['items'], error)
+                if utils.is_retryable_error(error):
+                    raise OperationRetry(
+                        message, retry_after=utils.get_retry_interval(
+                            ctx.operation.retry_number))
+                raise NonRecoverableError(message)
+            # Results are ordered, so every earlier item has been written
+            written += count
+            checkpoint['items'] += count
+            runtime_properties['seed_checkpoint'] = checkpoint
+            if time.time() - last_saved > CHECKPOINT_INTERVAL:
+                ctx.instance.update()
+                last_saved = time.time()
+    finally:
+        if downloaded:
+            os.remove(path)
+    runtime_properties.pop('seed_checkpoint', None)
+    summary = dict(source=source, items=checkpoint['items'],
+                   **utils.get_throughput_summary(written, started))
+    runtime_properties['seed_summary'] = summary
+    ctx.logger.info('Seeded %d items into %s ID# "%s" in %.1f seconds, '
+                    '%s items per second.'
+                    % (written, iface.type_name, iface.resource_id,
+                       summary['duration'], summary['throughput']))
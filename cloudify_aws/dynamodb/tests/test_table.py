@@ -13,13 +13,19 @@
 # limitations under the License.
 
 # Standard imports
+import os
+import gzip
+import shutil
 import unittest
+import tempfile
 import copy
 
 # Third party imports
 from mock import patch, MagicMock
+from botocore.exceptions import ClientError
 
 from cloudify.state import current_ctx
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 
 # Local imports
 from cloudify_aws.dynamodb.resources import table
@@ -164,6 +170,356 @@ class TestDynamoDBTable(TestBase):
             }
         )
 
+    def _seed_ctx(self, runtime_properties=None):
+        props = copy.deepcopy(RUNTIME_PROPERTIES_AFTER_CREATE)
+        props.update(runtime_properties or {})
+        _ctx = self.get_mock_ctx(
+            'test_seed',
+            test_properties=NODE_PROPERTIES,
+            test_runtime_properties=props,
+            type_hierarchy=TABLE_TH,
+            ctx_operation_name='cloudify.interfaces.aws.seed'
+        )
+        current_ctx.set(_ctx)
+        return _ctx
+
+    def _seed_file(self, name, content):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, name)
+        with (gzip.open if name.endswith('.gz') else open)(path, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        return path
+
+    def _written_items(self):
+        return [request['PutRequest']['Item']
+                for call in self.fake_client.batch_write_item.call_args_list
+                for request in call[1]['RequestItems']['aws_table_name']]
+
+    def test_seed_jsonl_gzip(self):
+        _ctx = self._seed_ctx()
+        path = self._seed_file('items.jsonl.gz', ''.join(
+            '{"id": "%d", "price": 1.5, "tags": ["a"]}\n' % i
+            for i in range(60)))
+        self.fake_client.batch_write_item = MagicMock(
+            return_value={'UnprocessedItems': {}})
+
+        table.seed(ctx=_ctx, iface=None, source=path, max_workers=2)
+
+        calls = self.fake_client.batch_write_item.call_args_list
+        self.assertEqual([len(c[1]['RequestItems']['aws_table_name'])
+                          for c in calls], [25, 25, 10])
+        items = self._written_items()
+        self.assertEqual(items[0], {'id': {'S': '0'},
+                                    'price': {'N': '1.5'},
+                                    'tags': {'L': [{'S': 'a'}]}})
+        self.assertEqual(sorted(int(item['id']['S']) for item in items),
+                         list(range(60)))
+        self.assertNotIn('seed_checkpoint', _ctx.instance.runtime_properties)
+        summary = _ctx.instance.runtime_properties['seed_summary']
+        self.assertEqual(summary['items'], 60)
+        self.assertEqual(summary['source'], path)
+
+    def test_seed_csv_unprocessed(self):
+        _ctx = self._seed_ctx()
+        path = self._seed_file('items.csv', 'id,name\n1,one\n2,\n')
+        unprocessed = {'aws_table_name': [
+            {'PutRequest': {'Item': {'id': {'S': '2'}}}}]}
+        self.fake_client.batch_write_item = MagicMock(side_effect=[
+            {'UnprocessedItems': unprocessed},
+            {'UnprocessedItems': {}}])
+
+        table.seed(ctx=_ctx, iface=None, source=path)
+
+        items = self._written_items()
+        self.assertEqual(items, [{'id': {'S': '1'}, 'name': {'S': 'one'}},
+                                 {'id': {'S': '2'}},
+                                 {'id': {'S': '2'}}])
+        self.assertEqual(
+            _ctx.instance.runtime_properties['seed_summary']['items'], 2)
+
+    def test_seed_resume(self):
+        path = self._seed_file('items.jsonl', ''.join(
+            '{"id": "%d"}\n' % i for i in range(60)))
+        _ctx = self._seed_ctx(
+            {'seed_checkpoint': {'source': path, 'items': 50}})
+        self.fake_client.batch_write_item = MagicMock(
+            return_value={})
+
+        table.seed(ctx=_ctx, iface=None, source=path)
+
+        items = self._written_items()
+        self.assertEqual([item['id']['S'] for item in items],
+                         [str(i) for i in range(50, 60)])
+        self.assertEqual(
+            _ctx.instance.runtime_properties['seed_summary']['items'], 60)
+
+    def test_seed_failure_checkpoints(self):
+        _ctx = self._seed_ctx()
+        path = self._seed_file('items.jsonl', ''.join(
+            '{"id": "%d"}\n' % i for i in range(60)))
+        throttled = ClientError(
+            {'Error': {'Code': 'ProvisionedThroughputExceededException'}},
+            'BatchWriteItem')
+        self.fake_client.batch_write_item = MagicMock(side_effect=[
+            {}, throttled, {}])
+
+        with self.assertRaises(OperationRetry):
+            table.seed(ctx=_ctx, iface=None, source=path, max_workers=1)
+
+        self.assertEqual(
+            _ctx.instance.runtime_properties['seed_checkpoint'],
+            {'source': path, 'items': 25})
+
+    def test_seed_failure_not_retryable(self):
+        _ctx = self._seed_ctx()
+        path = self._seed_file('items.jsonl', ''.join(
+            '{"id": "%d"}\n' % i for i in range(60)))
+        self.fake_client.batch_write_item = MagicMock(side_effect=[
+            {}, self.get_client_error_exception('batch_write_item'), {}])
+
+        with self.assertRaises(NonRecoverableError) as error:
+            table.seed(ctx=_ctx, iface=None, source=path, max_workers=1)
+
+        self.assertIn('after 25 items', str(error.exception))
+
+    def test_get_table_updates(self):
+        current = {
+            'TableStatus': 'ACTIVE',
+            'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            'ProvisionedThroughput': {'ReadCapacityUnits': 5,
+                                      'WriteCapacityUnits': 5},
+            'GlobalSecondaryIndexes': [{
+                'IndexName': 'old',
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5,
+                                          'WriteCapacityUnits': 5}}],
+            'StreamSpecification': {'StreamEnabled': True,
+                                    'StreamViewType': 'KEYS_ONLY'}
+        }
+        new_index = {
+            'IndexName': 'new',
+            'KeySchema': [{'AttributeName': 'name', 'KeyType': 'HASH'}],
+            'Projection': {'ProjectionType': 'ALL'},
+            'ProvisionedThroughput': {'ReadCapacityUnits': '2',
+                                      'WriteCapacityUnits': '2'}
+        }
+        desired = {
+            'AttributeDefinitions': [
+                {'AttributeName': 'id', 'AttributeType': 'S'},
+                {'AttributeName': 'name', 'AttributeType': 'S'},
+                {'AttributeName': 'other', 'AttributeType': 'S'}],
+            'ProvisionedThroughput': {'ReadCapacityUnits': '10',
+                                      'WriteCapacityUnits': '5'},
+            'GlobalSecondaryIndexes': [new_index],
+            'StreamSpecification': {'StreamEnabled': True,
+                                    'StreamViewType': 'NEW_IMAGE'}
+        }
+        updates = table.get_table_updates(desired, current)
+        self.assertEqual(updates, [
+            {'GlobalSecondaryIndexUpdates': [
+                {'Delete': {'IndexName': 'old'}}]},
+            {'ProvisionedThroughput': {'ReadCapacityUnits': 10,
+                                       'WriteCapacityUnits': 5}},
+            {'StreamSpecification': {'StreamEnabled': False}},
+            {'StreamSpecification': {'StreamEnabled': True,
+                                     'StreamViewType': 'NEW_IMAGE'}},
+            {'AttributeDefinitions': [
+                {'AttributeName': 'id', 'AttributeType': 'S'},
+                {'AttributeName': 'name', 'AttributeType': 'S'}],
+             'GlobalSecondaryIndexUpdates': [{'Create': dict(
+                 new_index, ProvisionedThroughput={
+                     'ReadCapacityUnits': 2,
+                     'WriteCapacityUnits': 2})}]}
+        ])
+
+        # Read capacity managed by auto scaling is not reverted
+        updates = table.get_table_updates(
+            desired, current, {'read': {'min_capacity': 1}})
+        self.assertNotIn({'ProvisionedThroughput': {
+            'ReadCapacityUnits': 10, 'WriteCapacityUnits': 5}}, updates)
+
+        # Units missing from the configuration keep their current value
+        desired['ProvisionedThroughput'] = {'WriteCapacityUnits': '8'}
+        updates = table.get_table_updates(desired, current)
+        self.assertIn({'ProvisionedThroughput': {
+            'ReadCapacityUnits': 5, 'WriteCapacityUnits': 8}}, updates)
+
+    def test_get_table_updates_billing_mode(self):
+        current = {
+            'BillingModeSummary': {'BillingMode': 'PAY_PER_REQUEST'},
+            'GlobalSecondaryIndexes': [{'IndexName': 'idx'}]
+        }
+        desired = {
+            'BillingMode': 'PROVISIONED',
+            'ProvisionedThroughput': {'ReadCapacityUnits': 1,
+                                      'WriteCapacityUnits': 1},
+            'GlobalSecondaryIndexes': [{
+                'IndexName': 'idx',
+                'ProvisionedThroughput': {'ReadCapacityUnits': 1,
+                                          'WriteCapacityUnits': 1}}]
+        }
+        self.assertEqual(table.get_table_updates(desired, current), [{
+            'BillingMode': 'PROVISIONED',
+            'ProvisionedThroughput': {'ReadCapacityUnits': 1,
+                                      'WriteCapacityUnits': 1},
+            'GlobalSecondaryIndexUpdates': [{'Update': {
+                'IndexName': 'idx',
+                'ProvisionedThroughput': {'ReadCapacityUnits': 1,
+                                          'WriteCapacityUnits': 1}}}]
+        }])
+        self.assertEqual(table.get_table_updates(
+            {'BillingMode': 'PAY_PER_REQUEST'}, current), [])
+        self.assertEqual(table.get_table_updates(
+            {'GlobalSecondaryIndexes': []}, current), [
+                {'GlobalSecondaryIndexUpdates': [
+                    {'Delete': {'IndexName': 'idx'}}]}])
+
+    def _update_ctx(self, runtime_properties=None, **properties):
+        node_properties = copy.deepcopy(NODE_PROPERTIES)
+        node_properties['resource_config'] = {
+            'ProvisionedThroughput': {'ReadCapacityUnits': 10,
+                                      'WriteCapacityUnits': 5}}
+        node_properties.update(properties)
+        props = copy.deepcopy(RUNTIME_PROPERTIES_AFTER_CREATE)
+        props.update(runtime_properties or {})
+        _ctx = self.get_mock_ctx(
+            'test_update',
+            test_properties=node_properties,
+            test_runtime_properties=props,
+            type_hierarchy=TABLE_TH,
+            ctx_operation_name='cloudify.interfaces.lifecycle.update'
+        )
+        current_ctx.set(_ctx)
+        return _ctx
+
+    def test_update(self):
+        _ctx = self._update_ctx()
+        self.fake_client.describe_table = MagicMock(return_value={'Table': {
+            'TableStatus': 'ACTIVE',
+            'ProvisionedThroughput': {'ReadCapacityUnits': 5,
+                                      'WriteCapacityUnits': 5}}})
+        self.fake_client.update_table = MagicMock(return_value={})
+
+        with self.assertRaises(OperationRetry):
+            table.update(ctx=_ctx, iface=None)
+        self.fake_client.update_table.assert_called_with(
+            TableName='aws_table_name',
+            ProvisionedThroughput={'ReadCapacityUnits': 10,
+                                   'WriteCapacityUnits': 5})
+
+        # Waits while the table is updating, with a growing interval
+        self.fake_client.describe_table = MagicMock(return_value={'Table': {
+            'TableStatus': 'UPDATING'}})
+        for retry_after in [5, 10]:
+            with self.assertRaises(OperationRetry) as error:
+                table.update(ctx=_ctx, iface=None)
+            self.assertEqual(error.exception.retry_after, retry_after)
+        self.assertEqual(self.fake_client.update_table.call_count, 1)
+
+        self.fake_client.describe_table = MagicMock(return_value={'Table': {
+            'TableStatus': 'ACTIVE',
+            'ProvisionedThroughput': {'ReadCapacityUnits': 10,
+                                      'WriteCapacityUnits': 5}}})
+        table.update(ctx=_ctx, iface=None)
+        self.assertEqual(self.fake_client.update_table.call_count, 1)
+        self.assertNotIn('update_polls', _ctx.instance.runtime_properties)
+
+    def test_update_missing_throughput(self):
+        _ctx = self._update_ctx(resource_config={
+            'BillingMode': 'PROVISIONED',
+            'AttributeDefinitions': [
+                {'AttributeName': 'name', 'AttributeType': 'S'}],
+            'GlobalSecondaryIndexes': [{
+                'IndexName': 'new',
+                'KeySchema': [{'AttributeName': 'name', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'}}]})
+        self.fake_client.describe_table = MagicMock(return_value={'Table': {
+            'TableStatus': 'ACTIVE',
+            'BillingModeSummary': {'BillingMode': 'PAY_PER_REQUEST'}}})
+        self.fake_client.update_table = MagicMock(return_value={})
+
+        with self.assertRaises(NonRecoverableError) as error:
+            table.update(ctx=_ctx, iface=None)
+        self.assertIn('table, index new', str(error.exception))
+        self.assertFalse(self.fake_client.update_table.called)
+
+    def test_configure_auto_scaling(self):
+        _ctx = self._update_ctx(auto_scaling={
+            'write': {'min_capacity': 5, 'max_capacity': 50}})
+        self.fake_client.describe_table = MagicMock(return_value={'Table': {
+            'TableStatus': 'ACTIVE',
+            'GlobalSecondaryIndexes': [{'IndexName': 'idx',
+                                        'IndexStatus': 'CREATING'}]}})
+        with self.assertRaises(OperationRetry):
+            table.configure(ctx=_ctx, iface=None)
+        self.assertFalse(self.fake_client.register_scalable_target.called)
+
+        self.fake_client.describe_table = MagicMock(return_value={'Table': {
+            'TableStatus': 'ACTIVE',
+            'GlobalSecondaryIndexes': [{'IndexName': 'idx',
+                                        'IndexStatus': 'ACTIVE'}]}})
+        table.configure(ctx=_ctx, iface=None)
+        self.fake_client.register_scalable_target.assert_called_once_with(
+            ServiceNamespace='dynamodb',
+            ResourceId='table/aws_table_name',
+            ScalableDimension='dynamodb:table:WriteCapacityUnits',
+            MinCapacity=5,
+            MaxCapacity=50)
+        self.assertEqual(
+            _ctx.instance.runtime_properties['scalable_targets'],
+            [['table/aws_table_name', 'dynamodb:table:WriteCapacityUnits']])
+
+    def test_update_auto_scaling(self):
+        _ctx = self._update_ctx(
+            runtime_properties={'scalable_targets': [
+                ['table/aws_table_name/index/old',
+                 'dynamodb:index:ReadCapacityUnits']]},
+            auto_scaling={
+                'read': {'min_capacity': 5, 'max_capacity': 50,
+                         'target_utilization': 60},
+                'indexes': {'idx': {'write': {'min_capacity': 1,
+                                              'max_capacity': 10}}}})
+        self.fake_client.describe_table = MagicMock(return_value={'Table': {
+            'TableStatus': 'ACTIVE',
+            'ProvisionedThroughput': {'ReadCapacityUnits': 20,
+                                      'WriteCapacityUnits': 5}}})
+        self.fake_client.update_table = MagicMock()
+
+        table.update(ctx=_ctx, iface=None)
+
+        self.assertFalse(self.fake_client.update_table.called)
+        self.fake_boto.assert_called_with('application-autoscaling',
+                                          **CLIENT_CONFIG)
+        self.fake_client.register_scalable_target.assert_any_call(
+            ServiceNamespace='dynamodb',
+            ResourceId='table/aws_table_name',
+            ScalableDimension='dynamodb:table:ReadCapacityUnits',
+            MinCapacity=5,
+            MaxCapacity=50)
+        self.fake_client.put_scaling_policy.assert_any_call(
+            PolicyName='table-aws_table_name-index-idx-'
+                       'DynamoDBWriteCapacityUtilization',
+            ServiceNamespace='dynamodb',
+            ResourceId='table/aws_table_name/index/idx',
+            ScalableDimension='dynamodb:index:WriteCapacityUnits',
+            PolicyType='TargetTrackingScaling',
+            TargetTrackingScalingPolicyConfiguration={
+                'TargetValue': 70.0,
+                'PredefinedMetricSpecification': {
+                    'PredefinedMetricType':
+                        'DynamoDBWriteCapacityUtilization'},
+                'ScaleInCooldown': 60,
+                'ScaleOutCooldown': 60})
+        self.fake_client.deregister_scalable_target.assert_called_once_with(
+            ServiceNamespace='dynamodb',
+            ResourceId='table/aws_table_name/index/old',
+            ScalableDimension='dynamodb:index:ReadCapacityUnits')
+        self.assertEqual(
+            _ctx.instance.runtime_properties['scalable_targets'],
+            [['table/aws_table_name', 'dynamodb:table:ReadCapacityUnits'],
+             ['table/aws_table_name/index/idx',
+              'dynamodb:index:WriteCapacityUnits']])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -16,12 +16,15 @@
     ~~~~~~~~~~~~~~
     AWS EC2 EBS Volume
 """
+# Standard imports
+from string import ascii_lowercase
+
 # Boto
 from botocore.exceptions import ClientError
 from botocore.exceptions import CapacityNotAvailableError
 
 # Cloudify
-from cloudify.exceptions import NonRecoverableError
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 from cloudify_aws.common import decorators
 from cloudify_aws.common import constants
 from cloudify_aws.common import utils
@@ -30,11 +33,15 @@ from cloudify_aws.ec2 import EC2Base
 
 RESOURCE_TYPE_VOLUME = 'EC2 EBS Volume'
 RESOURCE_TYPE_VOLUME_ATTACHMENT = 'EC2 EBS Volume Attachment'
+RESOURCE_TYPE_SNAPSHOT = 'EC2 EBS Snapshot'
 
 VOLUME_IDS = 'VolumeIds'
 VOLUME_STATE = 'State'
 VOLUME_ID = 'VolumeId'
 VOLUMES = 'Volumes'
+SNAPSHOT_IDS = 'SnapshotIds'
+SNAPSHOT_ID = 'SnapshotId'
+SNAPSHOTS = 'Snapshots'
 
 
 ATTACHING = 'attaching'
@@ -50,7 +57,28 @@ INUSE = 'in-use'
 DELETING = 'deleting'
 DELETED = 'deleted'
 
+ERROR = 'error'
+
+PENDING = 'pending'
+COMPLETED = 'completed'
+
+FSR_ENABLED = 'enabled'
+FSR_PENDING = ['enabling', 'optimizing']
+
 EC2_INSTANCE_TYPE = 'cloudify.nodes.aws.ec2.Instances'
+EBS_VOLUME_TYPE = 'cloudify.nodes.aws.ec2.EBSVolume'
+
+VOLUME_NOT_FOUND = 'InvalidVolume.NotFound'
+SNAPSHOT_NOT_FOUND = 'InvalidSnapshot.NotFound'
+SNAPSHOT_SOURCE_DEFAULTS = {
+    'filters': [],
+    'owner_ids': ['self'],
+    'fast_snapshot_restore': False,
+}
+FILTER_VALUES_MAX = 200
+# Device names recommended for EBS volumes on Linux instances
+DEVICE_PREFIX = '/dev/sd'
+DEVICE_LETTERS = ascii_lowercase[ascii_lowercase.index('f'):]
 
 
 class EC2VolumeMixin(object):
@@ -151,6 +179,59 @@ class EC2VolumeAttachment(EC2VolumeMixin, EC2Base):
         return self.detach(params)
 
 
+class EC2Snapshot(EC2Base):
+    """
+        EC2 EBS Snapshot
+    """
+    def __init__(self, ctx_node, resource_id=None, client=None, logger=None):
+        EC2Base.__init__(self, ctx_node, resource_id, client, logger)
+        self.type_name = RESOURCE_TYPE_SNAPSHOT
+
+    @property
+    def properties(self):
+        """
+        Gets the properties of an external resource
+        :return: dict of selected snapshot
+        """
+        params = {SNAPSHOT_IDS: [self.resource_id]}
+        try:
+            resources = \
+                self.client.describe_snapshots(**params)
+        except ClientError:
+            pass
+        else:
+            return resources.get(SNAPSHOTS)[0] if resources else None
+
+    @property
+    def status(self):
+        """
+        Gets the status of an external resource
+        :return:
+        """
+        return self.properties[VOLUME_STATE]\
+            if self.properties and self.properties.get(VOLUME_STATE) else None
+
+    def create(self, params):
+        """
+        Creates An AWS EC2 EBS Snapshot
+        :param params:
+        :return: dict of created snapshot
+        """
+        return self.make_client_call('create_snapshot', params)
+
+    def delete(self, params=None):
+        """
+        Deletes An existing AWS EC2 EBS Snapshot
+        :param params:
+        :return: None
+        """
+        self.logger.debug('Deleting {0} with parameters: {1}'
+                          .format(self.type_name, params))
+        res = self.client.delete_snapshot(**params)
+        self.logger.debug('Response: {0}'.format(res))
+        return res
+
+
 def _attach_ebs(params, iface, _ctx):
     """
     :param params:
@@ -384,3 +465,417 @@ def detach(ctx, iface, resource_config, **_):
     :param _:
     """
     _delete_attachment(ctx, iface)
+
+
+def describe_volumes_by_id(iface, volume_ids):
+    """
+    Describes a set of volumes with one filtered call per 200 IDs.
+    Volumes that no longer exist are left out instead of failing the call.
+    :param iface: EC2 EBS Volume interface
+    :param volume_ids: list of volume IDs
+    :return: dict of volume ID to volume
+    """
+    volumes = dict()
+    for chunk in utils.chunks(volume_ids, FILTER_VALUES_MAX):
+        params = {'Filters': [{'Name': 'volume-id', 'Values': chunk}]}
+        while True:
+            res = iface.client.describe_volumes(**params) or dict()
+            for volume in res.get(VOLUMES, []):
+                volumes[volume[VOLUME_ID]] = volume
+            if not res.get('NextToken'):
+                break
+            params['NextToken'] = res['NextToken']
+    return volumes
+
+
+def _get_attachment_state(volume):
+    for attachment in volume.get('Attachments') or []:
+        return attachment.get(VOLUME_STATE)
+    return None
+
+
+def _get_instance_id(ctx):
+    rel = utils.find_rel_by_node_type(ctx.instance, EC2_INSTANCE_TYPE)
+    if rel:
+        return rel.target.instance.runtime_properties.get(
+            constants.EXTERNAL_RESOURCE_ID)
+    return None
+
+
+def _get_used_devices(iface, instance_id):
+    """
+    Gets the device letters already mapped on an EC2 instance,
+    so /dev/sdf and /dev/xvdf both reserve "f".
+    """
+    res = iface.client.describe_instances(InstanceIds=[instance_id])
+    used = set()
+    for reservation in res.get('Reservations', []):
+        for instance in reservation.get('Instances', []):
+            names = [mapping.get('DeviceName') for mapping
+                     in instance.get('BlockDeviceMappings', [])]
+            names.append(instance.get('RootDeviceName'))
+            for name in names:
+                if name:
+                    used.add(name.rstrip('0123456789')[-1])
+    return used
+
+
+def allocate_device_names(iface, instance_id, count, device_names=None):
+    """
+    Allocates free device names on an EC2 instance.
+    :param iface: EC2 EBS Volume interface
+    :param instance_id: EC2 instance ID
+    :param count: number of device names needed
+    :param device_names: user-provided device names to use first
+    :return: list of device names
+    """
+    used = _get_used_devices(iface, instance_id)
+    devices = [name for name in device_names or []
+               if name.rstrip('0123456789')[-1] not in used]
+    devices += [DEVICE_PREFIX + letter for letter in DEVICE_LETTERS
+                if letter not in used and
+                DEVICE_PREFIX + letter not in devices]
+    if len(devices) < count:
+        raise NonRecoverableError(
+            'EC2 instance {0} has only {1} free device names for {2} '
+            'volumes.'.format(instance_id, len(devices), count))
+    return devices[:count]
+
+
+def get_latest_snapshot(iface, filters, owner_ids=None):
+    """
+    Gets the most recent completed snapshot matching the filters,
+    keeping only the newest one while paging through the results.
+    :param iface: EC2 interface
+    :param filters: describe_snapshots filters, e.g. tag filters
+    :param owner_ids: snapshot owners
+    :return: dict of the newest snapshot or None
+    """
+    params = {'Filters': list(filters) + [
+        {'Name': 'status', 'Values': [COMPLETED]}]}
+    if owner_ids:
+        params['OwnerIds'] = owner_ids
+    latest = None
+    while True:
+        res = iface.client.describe_snapshots(**params) or dict()
+        for snapshot in res.get(SNAPSHOTS, []):
+            if not latest or snapshot['StartTime'] > latest['StartTime']:
+                latest = snapshot
+        if not res.get('NextToken'):
+            break
+        params['NextToken'] = res['NextToken']
+    return latest
+
+
+def get_fast_snapshot_restore_states(iface, snapshot_id, zones):
+    """
+    Gets the Fast Snapshot Restore state of a snapshot per Availability Zone.
+    :return: dict of Availability Zone to state
+    """
+    params = {'Filters': [
+        {'Name': 'snapshot-id', 'Values': [snapshot_id]},
+        {'Name': 'availability-zone', 'Values': zones}]}
+    states = dict()
+    while True:
+        res = iface.client.describe_fast_snapshot_restores(**params) or dict()
+        for restore in res.get('FastSnapshotRestores', []):
+            states[restore['AvailabilityZone']] = restore[VOLUME_STATE]
+        if not res.get('NextToken'):
+            break
+        params['NextToken'] = res['NextToken']
+    return states
+
+
+def _prepare_snapshot_source(ctx, iface, params):
+    """
+    Resolves the snapshot the volumes are cloned from and, if requested,
+    waits until Fast Snapshot Restore is enabled in the target zone.
+    """
+    config = SNAPSHOT_SOURCE_DEFAULTS.copy()
+    config.update(ctx.node.properties.get('snapshot_source') or dict())
+    runtime_properties = ctx.instance.runtime_properties
+    snapshot_id = params.get(SNAPSHOT_ID) or \
+        runtime_properties.get('snapshot_id')
+    if not snapshot_id and config['filters']:
+        snapshot = get_latest_snapshot(
+            iface, config['filters'], config['owner_ids'])
+        if not snapshot:
+            raise NonRecoverableError(
+                'No completed {0} matches {1}.'.format(
+                    RESOURCE_TYPE_SNAPSHOT, config['filters']))
+        snapshot_id = snapshot[SNAPSHOT_ID]
+        ctx.logger.info('Using {0} {1} started at {2}.'.format(
+            RESOURCE_TYPE_SNAPSHOT, snapshot_id, snapshot['StartTime']))
+    if not snapshot_id:
+        return
+    runtime_properties['snapshot_id'] = snapshot_id
+    params[SNAPSHOT_ID] = snapshot_id
+    if not config['fast_snapshot_restore']:
+        return
+
+    zone = params['AvailabilityZone']
+    state = get_fast_snapshot_restore_states(
+        iface, snapshot_id, [zone]).get(zone)
+    if state == FSR_ENABLED:
+        return
+    elif state not in FSR_PENDING:
+        ctx.logger.info('Enabling Fast Snapshot Restore of {0} in {1}.'
+                        .format(snapshot_id, zone))
+        iface.client.enable_fast_snapshot_restores(
+            AvailabilityZones=[zone], SourceSnapshotIds=[snapshot_id])
+        runtime_properties['fast_snapshot_restore'] = zone
+    raise OperationRetry(
+        'Waiting for Fast Snapshot Restore of {0} in {1} ({2}).'.format(
+            snapshot_id, zone, state or 'enabling'))
+
+
+@decorators.aws_resource(EC2Volume, RESOURCE_TYPE_VOLUME)
+def create_volumes(ctx, iface, resource_config, **kwargs):
+    """
+    Creates an array of AWS EC2 EBS Volumes concurrently and waits for
+    all of them with one batched describe per retry.
+    :param ctx:
+    :param iface:
+    :param resource_config:
+    :param kwargs:
+    """
+    params = utils.clean_params(
+        dict() if not resource_config else resource_config.copy())
+    count = int(params.pop('Count', 1))
+    max_workers = \
+        ctx.node.properties.get('max_workers') or constants.DEFAULT_MAX_WORKERS
+    volume_ids = ctx.instance.runtime_properties.get('volumes') or []
+
+    missing = count - len(volume_ids)
+    if missing > 0:
+        _prepare_snapshot_source(ctx, iface, params)
+        ctx.logger.info('Creating {0} of {1} {2}s.'.format(
+            missing, count, RESOURCE_TYPE_VOLUME))
+        errors = []
+        for _, res, error in utils.run_in_parallel(
+                iface.create, [params] * missing, max_workers):
+            if error:
+                errors.append(error)
+            else:
+                volume_ids.append(res[VOLUME_ID])
+        ctx.instance.runtime_properties['volumes'] = volume_ids
+        if errors:
+            raise NonRecoverableError(
+                'Failed to create {0} of {1} {2}s: {3}'.format(
+                    len(errors), missing, RESOURCE_TYPE_VOLUME, errors[0]))
+
+    volumes = describe_volumes_by_id(iface, volume_ids)
+    states = dict((volume_id, volumes.get(volume_id, dict()).get(
+        VOLUME_STATE)) for volume_id in volume_ids)
+    failed = [volume_id for volume_id, state in states.items()
+              if state == ERROR]
+    if failed:
+        raise NonRecoverableError(
+            '{0}s {1} failed to create.'.format(RESOURCE_TYPE_VOLUME, failed))
+    # Volumes not described yet are pending (eventual consistency)
+    pending = [volume_id for volume_id, state in states.items()
+               if state != AVAILABLE]
+    if pending:
+        raise OperationRetry(
+            'Waiting for {0} of {1} {2}s to become available.'.format(
+                len(pending), count, RESOURCE_TYPE_VOLUME))
+
+    tags = utils.get_tags_list(
+        ctx.node.properties.get('Tags'),
+        ctx.instance.runtime_properties.get('Tags'),
+        kwargs.get('Tags'))
+    if tags:
+        for chunk in utils.chunks(volume_ids, FILTER_VALUES_MAX):
+            iface.tag({'Tags': tags, 'Resources': chunk})
+
+
+@decorators.aws_resource(EC2Volume, RESOURCE_TYPE_VOLUME)
+def attach_volumes(ctx, iface, resource_config, **_):
+    """
+    Attaches an array of AWS EC2 EBS Volumes to the connected EC2 instance
+    in parallel, allocating free device names.
+    :param ctx:
+    :param iface:
+    :param resource_config:
+    :param _:
+    """
+    instance_id = _get_instance_id(ctx)
+    volume_ids = ctx.instance.runtime_properties.get('volumes') or []
+    if not instance_id or not volume_ids:
+        ctx.logger.info('No EC2 instance to attach {0}s to.'.format(
+            RESOURCE_TYPE_VOLUME))
+        return
+    max_workers = \
+        ctx.node.properties.get('max_workers') or constants.DEFAULT_MAX_WORKERS
+    devices = ctx.instance.runtime_properties.get('devices') or dict()
+
+    unattached = [volume_id for volume_id in volume_ids
+                  if volume_id not in devices]
+    if unattached:
+        names = allocate_device_names(
+            iface, instance_id, len(unattached),
+            ctx.node.properties.get('device_names'))
+        errors = []
+        for params, _, error in utils.run_in_parallel(
+                iface.attach,
+                [{'Device': name, 'InstanceId': instance_id,
+                  VOLUME_ID: volume_id}
+                 for volume_id, name in zip(unattached, names)],
+                max_workers):
+            if error:
+                errors.append(error)
+            else:
+                devices[params[VOLUME_ID]] = params['Device']
+        ctx.instance.runtime_properties['devices'] = devices
+        if errors:
+            raise NonRecoverableError(
+                'Failed to attach {0} of {1} {2}s: {3}'.format(
+                    len(errors), len(unattached), RESOURCE_TYPE_VOLUME,
+                    errors[0]))
+
+    volumes = describe_volumes_by_id(iface, volume_ids)
+    pending = [volume_id for volume_id in volume_ids
+               if _get_attachment_state(volumes.get(volume_id, dict())) !=
+               ATTACHED]
+    if pending:
+        raise OperationRetry(
+            'Waiting for {0} of {1} {2}s to attach.'.format(
+                len(pending), len(volume_ids), RESOURCE_TYPE_VOLUME))
+
+
+@decorators.aws_resource(EC2Volume, RESOURCE_TYPE_VOLUME,
+                         ignore_properties=True)
+def detach_volumes(ctx, iface, resource_config, **_):
+    """
+    Detaches an array of AWS EC2 EBS Volumes in parallel.
+    :param ctx:
+    :param iface:
+    :param resource_config:
+    :param _:
+    """
+    volume_ids = ctx.instance.runtime_properties.get('volumes') or []
+    max_workers = \
+        ctx.node.properties.get('max_workers') or constants.DEFAULT_MAX_WORKERS
+    volumes = describe_volumes_by_id(iface, volume_ids)
+    to_detach = [volume_id for volume_id, volume in volumes.items()
+                 if _get_attachment_state(volume) == ATTACHED]
+    for params, _, error in utils.run_in_parallel(
+            iface.detach,
+            [{VOLUME_ID: volume_id} for volume_id in to_detach],
+            max_workers):
+        if error:
+            ctx.logger.warn('Failed to detach {0} {1}: {2}'.format(
+                RESOURCE_TYPE_VOLUME, params[VOLUME_ID], error))
+
+    if to_detach:
+        volumes = describe_volumes_by_id(iface, volume_ids)
+    pending = [volume_id for volume_id, volume in volumes.items()
+               if volume.get(VOLUME_STATE) == INUSE]
+    if pending:
+        raise OperationRetry(
+            'Waiting for {0} of {1} {2}s to detach.'.format(
+                len(pending), len(volume_ids), RESOURCE_TYPE_VOLUME))
+    ctx.instance.runtime_properties['devices'] = dict()
+
+
+@decorators.aws_resource(EC2Volume, RESOURCE_TYPE_VOLUME,
+                         ignore_properties=True)
+def delete_volumes(ctx, iface, resource_config, **_):
+    """
+    Deletes an array of AWS EC2 EBS Volumes in parallel.
+    :param ctx:
+    :param iface:
+    :param resource_config:
+    :param _:
+    """
+    volume_ids = ctx.instance.runtime_properties.get('volumes') or []
+    max_workers = \
+        ctx.node.properties.get('max_workers') or constants.DEFAULT_MAX_WORKERS
+    volumes = describe_volumes_by_id(iface, volume_ids)
+    pending = [volume_id for volume_id, volume in volumes.items()
+               if volume.get(VOLUME_STATE) in [CREATING, INUSE]]
+    if pending:
+        raise OperationRetry(
+            'Waiting for {0} of {1} {2}s to become available.'.format(
+                len(pending), len(volume_ids), RESOURCE_TYPE_VOLUME))
+
+    failures = []
+    for params, _, error in utils.run_in_parallel(
+            iface.delete,
+            [{VOLUME_ID: volume_id} for volume_id, volume in volumes.items()
+             if volume.get(VOLUME_STATE) == AVAILABLE],
+            max_workers):
+        if isinstance(error, ClientError) and \
+                error.response['Error'].get('Code') == VOLUME_NOT_FOUND:
+            continue
+        elif error:
+            failures.append('{0}: {1}'.format(params[VOLUME_ID], error))
+    if failures:
+        raise OperationRetry(
+            'Failed to delete {0} {1}s: {2}'.format(
+                len(failures), RESOURCE_TYPE_VOLUME, failures))
+
+    # Fast Snapshot Restore is billed per hour, so turn off what we enabled
+    zone = ctx.instance.runtime_properties.get('fast_snapshot_restore')
+    if zone:
+        iface.client.disable_fast_snapshot_restores(
+            AvailabilityZones=[zone],
+            SourceSnapshotIds=[ctx.instance.runtime_properties['snapshot_id']])
+
+
+@decorators.aws_resource(EC2Snapshot, RESOURCE_TYPE_SNAPSHOT)
+@decorators.tag_resources
+def create_snapshot(ctx, iface, resource_config, **_):
+    """
+    Creates an AWS EC2 EBS Snapshot and polls it until it completes.
+    :param ctx:
+    :param iface:
+    :param resource_config:
+    :param _:
+    """
+    if not iface.resource_id:
+        params = utils.clean_params(
+            dict() if not resource_config else resource_config.copy())
+        if not params.get(VOLUME_ID):
+            rel = utils.find_rel_by_node_type(ctx.instance, EBS_VOLUME_TYPE)
+            if not rel:
+                raise NonRecoverableError(
+                    '{0} requires a {1} or a connected {2}.'.format(
+                        RESOURCE_TYPE_SNAPSHOT, VOLUME_ID, EBS_VOLUME_TYPE))
+            params[VOLUME_ID] = rel.target.instance.runtime_properties.get(
+                constants.EXTERNAL_RESOURCE_ID)
+        create_response = iface.create(params)
+        snapshot_id = create_response[SNAPSHOT_ID]
+        utils.update_resource_id(ctx.instance, snapshot_id)
+        iface.update_resource_id(snapshot_id)
+
+    snapshot = iface.properties or dict()
+    state = snapshot.get(VOLUME_STATE)
+    if state == ERROR:
+        raise NonRecoverableError('{0} {1} failed: {2}'.format(
+            RESOURCE_TYPE_SNAPSHOT, iface.resource_id,
+            snapshot.get('StateMessage')))
+    elif state != COMPLETED:
+        raise OperationRetry('{0} {1} is {2} ({3}).'.format(
+            RESOURCE_TYPE_SNAPSHOT, iface.resource_id, state or PENDING,
+            snapshot.get('Progress') or '0%'))
+
+
+@decorators.aws_resource(EC2Snapshot, RESOURCE_TYPE_SNAPSHOT,
+                         ignore_properties=True)
+def delete_snapshot(ctx, iface, resource_config, **_):
+    """
+    Deletes an AWS EC2 EBS Snapshot
+    :param ctx:
+    :param iface:
+    :param resource_config:
+    :param _:
+    """
+    if not iface.resource_id:
+        return
+    try:
+        iface.delete({SNAPSHOT_ID: iface.resource_id})
+    except ClientError as e:
+        if e.response['Error'].get('Code') != SNAPSHOT_NOT_FOUND:
+            raise OperationRetry('Failed to delete {0} {1}: {2}'.format(
+                RESOURCE_TYPE_SNAPSHOT, iface.resource_id, e))
@@ -16,6 +16,9 @@
     ~~~~~~~~~~~~~~
     AWS EC2 ElasticIP interface
 """
+# Standard imports
+import time
+
 # Boto
 from botocore.exceptions import ClientError
 
@@ -25,6 +28,7 @@ from cloudify.exceptions import OperationRetry
 from cloudify_aws.common._compat import text_type
 from cloudify_aws.common import decorators, utils
 from cloudify_aws.ec2 import EC2Base
+from cloudify_aws.ec2.resources.image import get_account_id
 from cloudify_aws.common.constants import (
     EXTERNAL_RESOURCE_ID,
     TAG_SPECIFICATIONS_KWARG
@@ -40,6 +44,13 @@ NETWORKINTERFACE_ID = 'NetworkInterfaceId'
 NETWORKINTERFACE_TYPE = 'cloudify.nodes.aws.ec2.Interface'
 NETWORKINTERFACE_TYPE_DEPRECATED = 'cloudify.aws.nodes.Interface'
 ALLOCATION_ID = 'AllocationId'
+POOL_TAG = 'cloudify-elasticip-pool'
+POOL_DEFAULTS = {
+    'name': 'default',
+    'allocation_batch_size': 1,
+    'max_idle_addresses': 0,
+    'refresh_interval': 300,
+}
 
 
 class EC2ElasticIP(EC2Base):
@@ -122,10 +133,188 @@ class EC2ElasticIP(EC2Base):
         return res
 
 
-def get_already_allocated_ip(address_list):
-    for create_response in address_list:
-        if not create_response.get('AssociationId'):
-            return create_response
+class EC2ElasticIPPool(object):
+    """
+        Host-local claim index of unassociated Elastic IPs.
+
+        Free addresses are cached in a local store, so concurrent creates
+        on the same host never hand out the same address and do not need
+        to scan all of the account's addresses each time. Addresses are
+        allocated in batches when the pool runs dry, and pool-allocated
+        addresses are only released once more than ``max_idle_addresses``
+        of them are idle. The store is keyed by account as well, since
+        nodes with different credentials may share a region and pool name.
+    """
+    def __init__(self, iface, region_name=None, domain='vpc',
+                 name=None, allocation_batch_size=1, max_idle_addresses=0,
+                 refresh_interval=300, account=None):
+        self.iface = iface
+        self.domain = domain
+        self.name = name or POOL_DEFAULTS['name']
+        self.allocation_batch_size = max(int(allocation_batch_size), 1)
+        self.max_idle_addresses = max(int(max_idle_addresses), 0)
+        self.refresh_interval = refresh_interval
+        self.store_name = 'elasticip-pool-{0}-{1}-{2}-{3}'.format(
+            account, region_name, domain, self.name)
+
+    @staticmethod
+    def _key(address):
+        return address.get(ALLOCATION_ID) or address.get(ELASTICIP_ID)
+
+    def _describe(self, filters):
+        filters = [{'Name': 'domain', 'Values': [self.domain]}] + filters
+        return self.iface.list({'Filters': filters})
+
+    def _refresh(self, store):
+        """Rebuilds the index from a single describe of the domain"""
+        addresses = store.setdefault('addresses', dict())
+        seen = set()
+        for address in self._describe([]):
+            key = self._key(address)
+            seen.add(key)
+            if address.get('AssociationId') or key in addresses:
+                continue
+            addresses[key] = {
+                ELASTICIP_ID: address.get(ELASTICIP_ID),
+                ALLOCATION_ID: address.get(ALLOCATION_ID),
+                'pooled': POOL_TAG in [
+                    tag.get('Key') for tag in address.get('Tags', [])],
+            }
+        for key in list(addresses):
+            if key not in seen and not addresses[key].get('claimed_by'):
+                del addresses[key]
+        store['refreshed'] = time.time()
+
+    def _verify(self, addresses, keys):
+        """Drops candidates which were associated or released meanwhile"""
+        if not keys:
+            return []
+        name = 'allocation-id' \
+            if addresses[keys[0]].get(ALLOCATION_ID) else 'public-ip'
+        current = dict(
+            (self._key(address), address) for address in
+            self._describe([{'Name': name, 'Values': keys}]))
+        valid = []
+        for key in keys:
+            if key in current and not current[key].get('AssociationId'):
+                valid.append(key)
+            else:
+                del addresses[key]
+        return valid
+
+    def _grow(self, addresses, params):
+        """Allocates a batch of new addresses into the pool"""
+        self.iface.logger.info(
+            'Allocating {0} addresses into Elastic IP pool {1}.'.format(
+                self.allocation_batch_size, self.name))
+        allocated = []
+        errors = []
+        for _, address, error in utils.run_in_parallel(
+                lambda _: self.iface.create(params.copy()),
+                range(self.allocation_batch_size)):
+            if error:
+                self.iface.logger.warn(
+                    'Failed to allocate an address: {0}'.format(error))
+                errors.append(error)
+                continue
+            allocated.append(address)
+            addresses[self._key(address)] = {
+                ELASTICIP_ID: address.get(ELASTICIP_ID),
+                ALLOCATION_ID: address.get(ALLOCATION_ID),
+                'pooled': True,
+            }
+        resources = [address[ALLOCATION_ID] for address in allocated
+                     if address.get(ALLOCATION_ID)]
+        if resources:
+            self.iface.client.create_tags(
+                Resources=resources,
+                Tags=[{'Key': POOL_TAG, 'Value': self.name}])
+        if not allocated:
+            raise errors[0]
+        return [self._key(address) for address in allocated]
+
+    def claim(self, owner, params=None):
+        """
+            Claims a free address for the owner, allocating a new batch of
+            addresses when none is free. Claims are idempotent.
+        :param str owner: Unique ID of the claiming node instance.
+        :param dict params: allocate_address parameters.
+        :returns: The claimed address (PublicIp and AllocationId).
+        """
+        with utils.local_store(self.store_name) as store:
+            addresses = store.setdefault('addresses', dict())
+            claimed = [key for key in sorted(addresses)
+                       if addresses[key].get('claimed_by') == owner]
+            if not claimed:
+                claimed = self._claim_free(store, owner, params or dict())
+            address = addresses[claimed[0]]
+            return {ELASTICIP_ID: address[ELASTICIP_ID],
+                    ALLOCATION_ID: address[ALLOCATION_ID]}
+
+    def _claim_free(self, store, owner, params):
+        addresses = store['addresses']
+        if time.time() - store.get('refreshed', 0) > self.refresh_interval:
+            self._refresh(store)
+        candidates = self._verify(addresses, sorted(
+            key for key in addresses
+            if not addresses[key].get('claimed_by')))
+        if not candidates:
+            candidates = self._grow(addresses, params)
+        addresses[candidates[0]]['claimed_by'] = owner
+        return candidates
+
+    def release(self, owner):
+        """
+            Returns the owner's address to the pool and releases idle
+            pool-allocated addresses beyond ``max_idle_addresses``.
+        :param str owner: Unique ID of the claiming node instance.
+        :returns: List of keys of the addresses released to AWS.
+        """
+        with utils.local_store(self.store_name) as store:
+            addresses = store.setdefault('addresses', dict())
+            for address in addresses.values():
+                if address.get('claimed_by') == owner:
+                    address['claimed_by'] = None
+            idle = sorted(key for key, address in addresses.items()
+                          if address.get('pooled') and
+                          not address.get('claimed_by'))
+            excess = idle[self.max_idle_addresses:]
+            released = []
+            for key, _, error in utils.run_in_parallel(
+                    lambda _key: self.iface.delete(
+                        {ALLOCATION_ID: addresses[_key][ALLOCATION_ID]}
+                        if addresses[_key].get(ALLOCATION_ID) else
+                        {ELASTICIP_ID: addresses[_key][ELASTICIP_ID]}),
+                    excess):
+                if error:
+                    self.iface.logger.warn(
+                        'Failed to release {0}: {1}'.format(key, error))
+                    continue
+                del addresses[key]
+                released.append(key)
+            return released
+
+
+def get_address_pool(ctx, iface):
+    """Builds the Elastic IP pool configured for a node"""
+    config = POOL_DEFAULTS.copy()
+    config.update(ctx.node.properties.get('address_pool') or dict())
+    client_config = ctx.node.properties.get('client_config') or dict()
+    return EC2ElasticIPPool(
+        iface,
+        region_name=client_config.get('region_name'),
+        domain=(ctx.node.properties.get('resource_config') or dict()).get(
+            'Domain') or 'vpc',
+        name=config['name'],
+        allocation_batch_size=config['allocation_batch_size'],
+        max_idle_addresses=config['max_idle_addresses'],
+        refresh_interval=config['refresh_interval'],
+        account=get_account_id(client_config) or client_config.get(
+            'aws_access_key_id'))
+
+
+def get_pool_owner(ctx):
+    return '{0}/{1}'.format(ctx.deployment.id, ctx.instance.id)
 
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
@@ -145,14 +334,15 @@ def create(ctx, iface, resource_config, **_):
         dict() if not resource_config else resource_config.copy())
 
     # Actually create the resource
-    create_response = None
     if ctx.node.properties.get('use_unassociated_addresses', False):
-        create_response = get_already_allocated_ip(iface.list())
-    if not create_response:
-        create_response = iface.create(params)
-    else:
+        pool_params = params.copy()
+        pool_params.pop(TAG_SPECIFICATIONS_KWARG, None)
+        create_response = get_address_pool(ctx, iface).claim(
+            get_pool_owner(ctx), pool_params)
         ctx.instance.runtime_properties['unassociated_address'] = \
             create_response.get(ELASTICIP_ID)
+    else:
+        create_response = iface.create(params)
     ctx.instance.runtime_properties['create_response'] = \
         utils.JsonCleanuper(create_response).to_dict()
     elasticip_id = create_response.get(ELASTICIP_ID, '')
@@ -199,8 +389,9 @@ def delete(ctx, iface, resource_config, **_):
         address = ctx.instance.runtime_properties.pop(
             'unassociated_address', None)
         if address:
-            ctx.logger.info('Not deleting address {address}'.format(
+            ctx.logger.info('Returning address {address} to the pool'.format(
                 address=address))
+            get_address_pool(ctx, iface).release(get_pool_owner(ctx))
             return
 
     try:
@@ -36,6 +36,8 @@ SUBNET_TYPE_DEPRECATED = 'cloudify.aws.nodes.Subnet'
 SEC_GROUP_TYPE = 'cloudify.nodes.aws.ec2.SecurityGroup'
 SEC_GROUPS = 'Groups'
 ATTACHMENT_ID = 'AttachmentId'
+LAMBDA_ENI_DESCRIPTION = 'AWS Lambda VPC ENI*'
+ENI_NOT_FOUND = 'InvalidNetworkInterfaceID.NotFound'
 
 
 class EC2NetworkInterface(EC2Base):
@@ -67,12 +69,24 @@ class EC2NetworkInterface(EC2Base):
         return props['Status']
 
     def list_network_interfaces(self, filters=None):
+        '''
+            Lists all network interfaces matching the filters,
+            following pagination.
+        '''
         params = dict()
         if filters:
             params['Filters'] = filters
 
-        resources = self.client.describe_network_interfaces(**params)
-        return resources.get(NETWORKINTERFACES) if resources else []
+        interfaces = []
+        while True:
+            resources = self.client.describe_network_interfaces(**params)
+            if not resources:
+                break
+            interfaces.extend(resources.get(NETWORKINTERFACES) or [])
+            if not resources.get('NextToken'):
+                break
+            params['NextToken'] = resources['NextToken']
+        return interfaces
 
     def create(self, params):
         """
@@ -123,6 +137,67 @@ class EC2NetworkInterface(EC2Base):
         return res
 
 
+def get_lambda_eni_filters(vpc_id=None,
+                           subnet_id=None,
+                           group_ids=None,
+                           function_name=None):
+    '''Builds describe filters matching ENIs created by AWS Lambda'''
+    filters = [{'Name': 'description', 'Values': [LAMBDA_ENI_DESCRIPTION]}]
+    if vpc_id:
+        filters.append({'Name': 'vpc-id', 'Values': [vpc_id]})
+    if subnet_id:
+        filters.append({'Name': 'subnet-id', 'Values': [subnet_id]})
+    if group_ids:
+        filters.append({'Name': 'group-id', 'Values': list(group_ids)})
+    if function_name:
+        filters.append({'Name': 'requester-id',
+                        'Values': ['*:{0}*'.format(function_name)]})
+    return filters
+
+
+def reap_network_interfaces(iface, filters):
+    '''
+        Makes one pass at detaching and deleting every network interface
+        matching the filters. Attached interfaces are detached and available
+        ones are deleted, concurrently. Nothing is waited for: interfaces
+        still detaching are reported back, so the caller can raise
+        OperationRetry and delete them on a later pass.
+    :param iface: EC2NetworkInterface instance used for the API calls.
+    :param list filters: describe_network_interfaces filters.
+    :returns: List of IDs of network interfaces which were not deleted.
+    '''
+    interfaces = iface.list_network_interfaces(filters)
+    if not interfaces:
+        return []
+    iface.logger.info('Cleaning up network interfaces: {0}'.format(
+        [interface[NETWORKINTERFACE_ID] for interface in interfaces]))
+
+    attachment_ids = [
+        interface['Attachment'][ATTACHMENT_ID] for interface in interfaces
+        if interface.get('Attachment', {}).get('Status') in
+        ['attaching', 'attached']]
+    for attachment_id, _, error in utils.run_in_parallel(
+            lambda _id: iface.detach({ATTACHMENT_ID: _id}), attachment_ids):
+        if error:
+            iface.logger.warn('Failed to detach {0}: {1}'.format(
+                attachment_id, error))
+
+    available = [interface[NETWORKINTERFACE_ID] for interface in interfaces
+                 if interface.get('Status') == 'available']
+    remaining = [interface[NETWORKINTERFACE_ID] for interface in interfaces
+                 if interface.get('Status') != 'available']
+    for eni_id, _, error in utils.run_in_parallel(
+            lambda _id: iface.delete({NETWORKINTERFACE_ID: _id}), available):
+        if isinstance(error, ClientError) and \
+                error.response['Error'].get('Code') == ENI_NOT_FOUND:
+            continue
+        elif error:
+            iface.logger.warn('Failed to delete {0}: {1}'.format(
+                eni_id, error))
+            remaining.append(eni_id)
+    return sorted(remaining)
+
+
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
 def prepare(ctx, resource_config, **_):
     """Prepares an AWS EC2 NetworkInterface"""
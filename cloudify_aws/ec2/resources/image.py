@@ -16,12 +16,20 @@
     ~~~~~~~~~~~~~~
     AWS EC2 Image interface
 """
+# Standard imports
+import json
+import time
+import hashlib
+import threading
+
 # Cloudify
 from cloudify.exceptions import NonRecoverableError
 from cloudify_aws.common import decorators, utils
+from cloudify_aws.common._compat import text_type
 from cloudify_aws.ec2 import EC2Base
 # Boto
-from botocore.exceptions import ClientError
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
 
 RESOURCE_TYPE = 'EC2 Image'
 IMAGES = 'Images'
@@ -31,6 +39,16 @@ IMAGE_IDS = 'ImageIds'
 OWNERS = 'Owners'
 EXECUTABLE_USERS = 'ExecutableUsers'
 FILTERS = 'Filters'
+CREATION_DATE = 'CreationDate'
+PAGE_SIZE = 1000
+IMAGE_CACHE = 'ec2-images'
+IMAGE_CACHE_TTL = 3600
+STS_CONFIG_KEYS = ['aws_access_key_id', 'aws_secret_access_key',
+                   'aws_session_token', 'region_name']
+
+# Accounts of the credentials used by this process
+_accounts = {}
+_accounts_lock = threading.Lock()
 
 
 class EC2Image(EC2Base):
@@ -44,19 +62,40 @@ class EC2Image(EC2Base):
 
     @property
     def properties(self):
-        """Gets the properties of an external resource"""
-        params = self.describe_image_filters
+        """Gets the newest image matching the filters"""
+        found = False
+        latest = None
         try:
-            resources = \
-                self.client.describe_images(**params)
+            for image in self.iter_images(self.describe_image_filters):
+                found = True
+                if image and (not latest or image.get(CREATION_DATE, '') >
+                              latest.get(CREATION_DATE, '')):
+                    latest = image
         except ClientError:
-            pass
-        else:
-            images = [] if not resources else resources.get(IMAGES)
-            if len(images):
-                return images[0]
-            raise NonRecoverableError(
-                "Found no AMIs matching provided filters.")
+            return None
+        if found:
+            return latest
+        raise NonRecoverableError(
+            "Found no AMIs matching provided filters.")
+
+    @property
+    def supports_paging(self):
+        """Checks that the client model pages DescribeImages"""
+        return 'MaxResults' in self.client.meta.service_model.operation_model(
+            'DescribeImages').input_shape.members
+
+    def iter_images(self, params):
+        """Yields the images matching the filters, one page at a time"""
+        params = dict(params)
+        if not params.get(IMAGE_IDS) and self.supports_paging:
+            params['MaxResults'] = PAGE_SIZE
+        while True:
+            resources = self.client.describe_images(**params) or dict()
+            for image in resources.get(IMAGES) or []:
+                yield image
+            if not resources.get('NextToken'):
+                break
+            params['NextToken'] = resources['NextToken']
 
     @property
     def status(self):
@@ -91,6 +130,111 @@ def prepare_describe_image_filter(params, iface):
     return iface
 
 
+def get_account_id(client_config):
+    """
+    Gets the account of the credentials in client_config from STS, once per
+    process. Instance profile and role credentials have no access key in
+    client_config, so the key alone cannot tell accounts apart.
+    :return: the account ID, or None when it cannot be determined
+    """
+    config = dict((key, value) for key, value in client_config.items()
+                  if key in STS_CONFIG_KEYS and value)
+    config_key = json.dumps(config, sort_keys=True)
+    with _accounts_lock:
+        if config_key not in _accounts:
+            try:
+                _accounts[config_key] = boto3.client(
+                    'sts', **config).get_caller_identity()['Account']
+            except (BotoCoreError, ClientError):
+                return None
+        return _accounts[config_key]
+
+
+def get_image_cache_key(iface, client_config, account):
+    """
+    Hashes the normalized lookup, so equivalent filters given in any order
+    share one cache entry per region and account.
+    """
+    params = iface.describe_image_filters
+    normalized = {
+        'region': text_type(
+            client_config.get('region_name') or
+            iface.client.meta.region_name),
+        'account': account,
+        IMAGE_IDS: sorted(params.get(IMAGE_IDS) or []),
+        OWNERS: sorted(params.get(OWNERS) or []),
+        EXECUTABLE_USERS: sorted(params.get(EXECUTABLE_USERS) or []),
+        FILTERS: sorted([[f['Name'], sorted(f.get('Values') or [])]
+                         for f in params.get(FILTERS) or []]),
+    }
+    return hashlib.sha256(
+        json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _cache_image(key, image, ttl):
+    now = time.time()
+    with utils.local_store(IMAGE_CACHE) as store:
+        for old_key in [k for k, v in store.items() if v['expires'] < now]:
+            del store[old_key]
+        store[key] = {
+            'image': utils.JsonCleanuper(image).to_dict(),
+            'expires': now + ttl,
+            'refresh_at': now + ttl / 2.0,
+        }
+
+
+def _refresh_image(iface, key, ttl):
+    try:
+        image = iface.properties
+        # Keep the cached image when the lookup fails
+        if image:
+            _cache_image(key, image, ttl)
+    except Exception as e:
+        iface.logger.debug('Failed to refresh {0} cache: {1}'.format(
+            RESOURCE_TYPE, e))
+
+
+def resolve_image(iface, client_config, ttl=IMAGE_CACHE_TTL):
+    """
+    Resolves the newest image matching the filters of the interface
+    through a cache shared by all deployments on this host. Entries past
+    half of their TTL are returned as is and refreshed in the background.
+    :param iface: EC2 Image interface with describe_image_filters set
+    :param client_config: the node client_config
+    :param ttl: seconds a resolved image is reused, 0 disables the cache.
+        The cache is also skipped when the account cannot be determined.
+    :return: dict of the image
+    """
+    account = get_account_id(client_config) if ttl else None
+    if not account:
+        return iface.properties
+    key = get_image_cache_key(iface, client_config, account)
+    now = time.time()
+    refresh = False
+    with utils.local_store(IMAGE_CACHE) as store:
+        entry = store.get(key)
+        if entry and not entry.get('image'):
+            entry = None
+        if entry and entry['expires'] > now and entry['refresh_at'] <= now:
+            # Claim the refresh so concurrent lookups keep using the entry
+            entry['refresh_at'] = now + ttl / 2.0
+            refresh = True
+    if entry and entry['expires'] > now:
+        iface.logger.debug('Using cached {0} {1}'.format(
+            RESOURCE_TYPE, entry['image'].get(IMAGE_ID)))
+        if refresh:
+            thread = threading.Thread(target=_refresh_image,
+                                      args=(iface, key, ttl))
+            # Never hold the agent process open on shutdown
+            thread.daemon = True
+            thread.start()
+        return entry['image']
+    image = iface.properties
+    if image:
+        _cache_image(key, image, ttl)
+    return image
+
+
 @decorators.aws_resource(EC2Image, resource_type=RESOURCE_TYPE)
 def prepare(ctx, iface, resource_config, **_):
     """Prepares an AWS EC2 Image"""
@@ -100,5 +244,8 @@ def prepare(ctx, iface, resource_config, **_):
         prepare_describe_image_filter(
             resource_config.copy(),
             iface)
-    ami = iface.properties
+    ami = resolve_image(
+        iface,
+        ctx.node.properties.get('client_config') or dict(),
+        ctx.node.properties.get('cache_ttl', IMAGE_CACHE_TTL))
     utils.update_resource_id(ctx.instance, ami.get(IMAGE_ID))
@@ -16,13 +16,21 @@
     ~~~~~~~~~~~~~~
     AWS EC2 NetworkAcl Entry interface
 """
+# Standard imports
+from functools import partial
+
 # Boto
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ParamValidationError
 
 # Cloudify
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 from cloudify_aws.common import decorators, utils
+from cloudify_aws.common._compat import text_type
 from cloudify_aws.ec2 import EC2Base
-from cloudify_aws.common.constants import EXTERNAL_RESOURCE_ID
+from cloudify_aws.common.constants import (
+    DEFAULT_MAX_WORKERS,
+    EXTERNAL_RESOURCE_ID
+)
 
 RESOURCE_TYPE = 'EC2 Network Acl Entry'
 NETWORKACLS = 'NetworkAcls'
@@ -33,6 +41,12 @@ ENTRIES = 'Entries'
 EGRESS = 'Egress'
 NETWORKACL_TYPE = 'cloudify.nodes.aws.ec2.NetworkACL'
 NETWORKACL_TYPE_DEPRECATED = 'cloudify.aws.nodes.ACL'
+DEFAULT_RULE_NUMBER = 32767
+ENTRY_NOT_FOUND = 'InvalidNetworkAclEntry.NotFound'
+PROTOCOL = 'Protocol'
+# describe_network_acls reports protocols by IANA number
+PROTOCOL_NUMBERS = {'all': '-1', 'icmp': '1', 'tcp': '6', 'udp': '17',
+                    'icmpv6': '58'}
 
 
 class EC2NetworkAclEntry(EC2Base):
@@ -51,12 +65,12 @@ class EC2NetworkAclEntry(EC2Base):
         else:
             return resources.get(NETWORKACLS)[0] if resources else None
 
-    def create(self, params):
+    def create(self, params, **kwargs):
         """
             Create a new AWS EC2 NetworkAcl Entry.
         """
         return self.make_client_call(
-            'create_network_acl_entry', params)
+            'create_network_acl_entry', params, **kwargs)
 
     def replace(self, params):
         """
@@ -148,3 +162,152 @@ def delete(ctx, iface, resource_config, **_):
     params.update({RULE_NUMBER: rule_number})
     params.update({EGRESS: egress})
     iface.delete(params)
+
+
+def _get_network_acl_id(ctx, params):
+    network_acl_id = params.get(NETWORKACL_ID)
+    if not network_acl_id:
+        targ = \
+            utils.find_rel_by_node_type(ctx.instance, NETWORKACL_TYPE) or \
+            utils.find_rel_by_node_type(ctx.instance,
+                                        NETWORKACL_TYPE_DEPRECATED)
+        if not targ:
+            raise NonRecoverableError(
+                '{0} requires a {1} or a connected {2}.'.format(
+                    RESOURCE_TYPE, NETWORKACL_ID, NETWORKACL_TYPE))
+        network_acl_id = \
+            targ.target.instance.runtime_properties.get(EXTERNAL_RESOURCE_ID)
+    return network_acl_id
+
+
+def _entry_key(entry):
+    return int(entry[RULE_NUMBER]), bool(entry.get(EGRESS, False))
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return dict((k, _normalize(v)) for k, v in value.items())
+    return text_type(value).lower()
+
+
+def _normalize_protocol(value):
+    value = _normalize(value)
+    return PROTOCOL_NUMBERS.get(value, value)
+
+
+def _entry_differs(desired, current):
+    for key, value in desired.items():
+        if key in [NETWORKACL_ID, RULE_NUMBER, EGRESS, 'DryRun']:
+            continue
+        elif key == PROTOCOL:
+            if _normalize_protocol(value) != \
+                    _normalize_protocol(current.get(key)):
+                return True
+        elif _normalize(value) != _normalize(current.get(key)):
+            return True
+    return False
+
+
+def get_current_entries(iface, network_acl_id):
+    '''Gets the entries of a Network ACL keyed by (RuleNumber, Egress)'''
+    network_acl = iface.get_properties_by_filter(
+        **{NETWORKACL_IDS: [network_acl_id]}) or dict()
+    return dict((_entry_key(entry), entry)
+                for entry in network_acl.get(ENTRIES, [])
+                if entry[RULE_NUMBER] != DEFAULT_RULE_NUMBER)
+
+
+@decorators.aws_resource(EC2NetworkAclEntry, RESOURCE_TYPE)
+def create_entries(ctx, iface, resource_config, **_):
+    """Applies a full set of AWS EC2 NetworkAcl Entries"""
+    params = \
+        dict() if not resource_config else resource_config.copy()
+    network_acl_id = _get_network_acl_id(ctx, params)
+    max_workers = \
+        ctx.node.properties.get('max_workers') or DEFAULT_MAX_WORKERS
+
+    desired = dict()
+    for entry in params.get(ENTRIES) or []:
+        entry = dict(entry)
+        entry[NETWORKACL_ID] = network_acl_id
+        entry[EGRESS] = bool(entry.get(EGRESS, False))
+        desired[_entry_key(entry)] = entry
+
+    # Diff the desired set against a single describe of the ACL
+    current = get_current_entries(iface, network_acl_id)
+    to_create = [entry for key, entry in sorted(desired.items())
+                 if key not in current]
+    to_replace = [entry for key, entry in sorted(desired.items())
+                  if key in current and _entry_differs(entry, current[key])]
+    ctx.logger.info(
+        'Network ACL {0}: creating {1}, replacing {2}, keeping {3} '
+        'entries.'.format(network_acl_id, len(to_create), len(to_replace),
+                          len(desired) - len(to_create) - len(to_replace)))
+
+    ctx.instance.runtime_properties['network_acl_id'] = network_acl_id
+
+    # Only parameter validation errors are fatal, API errors are reraised
+    # as ClientError so that transient ones can be told apart.
+    create = partial(iface.create,
+                     fatal_handled_exceptions=ParamValidationError)
+    results = \
+        utils.run_in_parallel(create, to_create, max_workers) + \
+        utils.run_in_parallel(iface.replace, to_replace, max_workers)
+    failures = dict((_entry_key(entry), error)
+                    for entry, _, error in results if error)
+
+    # Only entries created or replaced here are removed on delete, entries
+    # that already matched are left alone.
+    applied = set(tuple(key) for key in
+                  ctx.instance.runtime_properties.get('entries') or [])
+    applied.update(_entry_key(entry) for entry, _, error in results
+                   if not error)
+    ctx.instance.runtime_properties['entries'] = \
+        [list(key) for key in sorted(applied)]
+
+    # One consolidated status check for the whole set
+    current = get_current_entries(iface, network_acl_id)
+    for key, entry in desired.items():
+        if key not in failures and \
+                (key not in current or _entry_differs(entry, current[key])):
+            failures[key] = None
+    if failures:
+        message = 'Failed to apply {0} entries of Network ACL {1}: {2}'.format(
+            len(failures), network_acl_id,
+            ['RuleNumber {0} Egress {1}: {2}'.format(
+                key[0], key[1], failures[key] or 'Entry was not applied.')
+             for key in sorted(failures)])
+        # The diff runs against the live ACL, so a retry is idempotent
+        if all(not error or utils.is_retryable_error(error)
+               for error in failures.values()):
+            raise OperationRetry(message)
+        raise NonRecoverableError(message)
+
+
+@decorators.aws_resource(EC2NetworkAclEntry, RESOURCE_TYPE,
+                         ignore_properties=True)
+def delete_entries(ctx, iface, resource_config, **_):
+    """Deletes the AWS EC2 NetworkAcl Entries created by create_entries"""
+    network_acl_id = ctx.instance.runtime_properties.get('network_acl_id')
+    entries = ctx.instance.runtime_properties.get('entries') or []
+    if not network_acl_id or not entries:
+        return
+    max_workers = \
+        ctx.node.properties.get('max_workers') or DEFAULT_MAX_WORKERS
+    failures = []
+    for params, _, error in utils.run_in_parallel(
+            iface.delete,
+            [{NETWORKACL_ID: network_acl_id,
+              RULE_NUMBER: rule_number,
+              EGRESS: egress} for rule_number, egress in entries],
+            max_workers):
+        if isinstance(error, ClientError) and \
+                error.response['Error'].get('Code') == ENTRY_NOT_FOUND:
+            continue
+        elif error:
+            failures.append('RuleNumber {0} Egress {1}: {2}'.format(
+                params[RULE_NUMBER], params[EGRESS], error))
+    if failures:
+        raise OperationRetry(
+            'Failed to delete {0} entries of Network ACL {1}: {2}'.format(
+                len(failures), network_acl_id, failures))
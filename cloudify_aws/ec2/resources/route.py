@@ -16,10 +16,21 @@
     ~~~~~~~~~~~~~~
     AWS EC2 Route interface
 '''
+# Standard imports
+from functools import partial
+
+# Boto
+from botocore.exceptions import ClientError, ParamValidationError
+
 # Cloudify
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 from cloudify_aws.common import decorators, utils
+from cloudify_aws.common._compat import text_type
 from cloudify_aws.ec2 import EC2Base
-from cloudify_aws.common.constants import EXTERNAL_RESOURCE_ID
+from cloudify_aws.common.constants import (
+    DEFAULT_MAX_WORKERS,
+    EXTERNAL_RESOURCE_ID
+)
 
 RESOURCE_TYPE = 'EC2 Route'
 ROUTETABLE_ID = 'RouteTableId'
@@ -33,6 +44,16 @@ INTERNETGATEWAY_TYPE_DEPRECATED = 'cloudify.aws.nodes.InternetGateway'
 VPNGATEWAY_TYPE = 'cloudify.nodes.aws.ec2.VPNGateway'
 VPNGATEWAY_TYPE_DEPRECATED = 'cloudify.aws.nodes.VPNGateway'
 DESTINATION_CIDR_BLOCK = 'DestinationCidrBlock'
+ROUTES = 'Routes'
+ROUTETABLES = 'RouteTables'
+ROUTETABLE_IDS = 'RouteTableIds'
+DESTINATION_KEYS = [DESTINATION_CIDR_BLOCK,
+                    'DestinationIpv6CidrBlock',
+                    'DestinationPrefixListId']
+TARGET_KEYS = ['EgressOnlyInternetGatewayId', GATEWAY_ID, 'InstanceId',
+               NATGATEWAY_ID, 'TransitGatewayId', 'LocalGatewayId',
+               'NetworkInterfaceId', 'VpcPeeringConnectionId']
+ROUTE_NOT_FOUND = 'InvalidRoute.NotFound'
 
 
 class EC2Route(EC2Base):
@@ -43,11 +64,33 @@ class EC2Route(EC2Base):
         EC2Base.__init__(self, ctx_node, resource_id, client, logger)
         self.type_name = RESOURCE_TYPE
 
-    def create(self, params):
+    def create(self, params, **kwargs):
         '''
             Create a new AWS EC2 Route.
         '''
-        return self.make_client_call('create_route', params)
+        return self.make_client_call(
+            'create_route', params, **kwargs)
+
+    def replace(self, params):
+        '''
+            Replaces the target of an existing AWS EC2 Route.
+        '''
+        self.logger.debug('Replacing %s with parameters: %s'
+                          % (self.type_name, params))
+        res = self.client.replace_route(**params)
+        self.logger.debug('Response: %s' % res)
+        return res
+
+    def get_properties_by_filter(self, **filters):
+        '''
+            Gets the first AWS EC2 Route Table matching the filters.
+        '''
+        try:
+            resources = self.client.describe_route_tables(**filters)
+        except ClientError:
+            pass
+        else:
+            return resources.get(ROUTETABLES)[0] if resources else None
 
     def delete(self, params=None):
         '''
@@ -156,3 +199,161 @@ def delete(ctx, iface, resource_config, **_):
         ctx.instance.runtime_properties['destination_cidr_block']
 
     iface.delete(params)
+
+
+def _get_routetable_id(ctx, params):
+    routetable_id = params.get(ROUTETABLE_ID)
+    if not routetable_id:
+        targ = \
+            utils.find_rel_by_node_type(ctx.instance, ROUTETABLE_TYPE) or \
+            utils.find_rel_by_node_type(ctx.instance,
+                                        ROUTETABLE_TYPE_DEPRECATED)
+        if not targ:
+            raise NonRecoverableError(
+                '{0} requires a {1} or a connected {2}.'.format(
+                    RESOURCE_TYPE, ROUTETABLE_ID, ROUTETABLE_TYPE))
+        routetable_id = \
+            targ.target.instance.runtime_properties.get(EXTERNAL_RESOURCE_ID)
+    return routetable_id
+
+
+def _get_default_target(ctx):
+    '''Gets the target of routes without one from connected gateways'''
+    targ = \
+        utils.find_rel_by_node_type(ctx.instance, INTERNETGATEWAY_TYPE) or \
+        utils.find_rel_by_node_type(ctx.instance,
+                                    INTERNETGATEWAY_TYPE_DEPRECATED) or \
+        utils.find_rel_by_node_type(ctx.instance, VPNGATEWAY_TYPE) or \
+        utils.find_rel_by_node_type(ctx.instance, VPNGATEWAY_TYPE_DEPRECATED)
+    if targ:
+        return {GATEWAY_ID: targ.target.instance.runtime_properties.get(
+            EXTERNAL_RESOURCE_ID)}
+    targ = utils.find_rel_by_node_type(ctx.instance, NATGATEWAY_TYPE)
+    if targ:
+        return {NATGATEWAY_ID: targ.target.instance.runtime_properties.get(
+            EXTERNAL_RESOURCE_ID)}
+    return dict()
+
+
+def _route_key(route):
+    for key in DESTINATION_KEYS:
+        if route.get(key):
+            return key, route[key]
+    raise NonRecoverableError(
+        'Route {0} has no destination.'.format(route))
+
+
+def _route_differs(desired, current):
+    for key in TARGET_KEYS:
+        if key in desired and \
+                text_type(desired[key]) != text_type(current.get(key)):
+            return True
+    return False
+
+
+def get_current_routes(iface, routetable_id):
+    '''Gets the routes of a Route Table keyed by destination'''
+    routetable = iface.get_properties_by_filter(
+        **{ROUTETABLE_IDS: [routetable_id]}) or dict()
+    return dict((_route_key(route), route)
+                for route in routetable.get(ROUTES, [])
+                if route.get('Origin') != 'CreateRouteTable')
+
+
+@decorators.aws_resource(EC2Route, RESOURCE_TYPE)
+def create_routes(ctx, iface, resource_config, **_):
+    '''Applies a full set of AWS EC2 Routes'''
+    params = dict() if not resource_config else resource_config.copy()
+    routetable_id = _get_routetable_id(ctx, params)
+    max_workers = \
+        ctx.node.properties.get('max_workers') or DEFAULT_MAX_WORKERS
+    default_target = _get_default_target(ctx)
+
+    desired = dict()
+    for route in params.get(ROUTES) or []:
+        route = dict(route)
+        route[ROUTETABLE_ID] = routetable_id
+        if not any(route.get(key) for key in TARGET_KEYS):
+            route.update(default_target)
+        desired[_route_key(route)] = route
+
+    # Diff the desired set against a single describe of the route table
+    current = get_current_routes(iface, routetable_id)
+    to_create = [route for key, route in sorted(desired.items())
+                 if key not in current]
+    to_replace = [route for key, route in sorted(desired.items())
+                  if key in current and _route_differs(route, current[key])]
+    ctx.logger.info(
+        'Route Table {0}: creating {1}, replacing {2}, keeping {3} '
+        'routes.'.format(routetable_id, len(to_create), len(to_replace),
+                         len(desired) - len(to_create) - len(to_replace)))
+
+    ctx.instance.runtime_properties['routetable_id'] = routetable_id
+
+    # Only parameter validation errors are fatal, API errors are reraised
+    # as ClientError so that transient ones can be told apart.
+    create = partial(iface.create,
+                     fatal_handled_exceptions=ParamValidationError)
+    results = \
+        utils.run_in_parallel(create, to_create, max_workers) + \
+        utils.run_in_parallel(iface.replace, to_replace, max_workers)
+    failures = dict((_route_key(route), error)
+                    for route, _, error in results if error)
+
+    # Only routes created or replaced here are removed on delete, routes
+    # that already matched are left alone.
+    applied = set(tuple(key) for key in
+                  ctx.instance.runtime_properties.get('destinations') or [])
+    applied.update(_route_key(route) for route, _, error in results
+                   if not error)
+    ctx.instance.runtime_properties['destinations'] = \
+        [list(key) for key in sorted(applied)]
+
+    # One consolidated status check for the whole set
+    current = get_current_routes(iface, routetable_id)
+    for key, route in desired.items():
+        if key in failures:
+            continue
+        elif key not in current or _route_differs(route, current[key]):
+            failures[key] = None
+        elif current[key].get('State') == 'blackhole':
+            failures[key] = 'Route target is not available (blackhole).'
+    if failures:
+        message = 'Failed to apply {0} routes of Route Table {1}: {2}'.format(
+            len(failures), routetable_id,
+            ['{0}: {1}'.format(key[1], failures[key] or
+                               'Route was not applied.')
+             for key in sorted(failures)])
+        # The diff runs against the live table, so a retry is idempotent
+        if all(not error or utils.is_retryable_error(error)
+               for error in failures.values()):
+            raise OperationRetry(message)
+        raise NonRecoverableError(message)
+
+
+@decorators.aws_resource(EC2Route, RESOURCE_TYPE,
+                         ignore_properties=True)
+def delete_routes(ctx, iface, resource_config, **_):
+    '''Deletes the AWS EC2 Routes created by create_routes'''
+    routetable_id = ctx.instance.runtime_properties.get('routetable_id')
+    destinations = ctx.instance.runtime_properties.get('destinations') or []
+    if not routetable_id or not destinations:
+        return
+    max_workers = \
+        ctx.node.properties.get('max_workers') or DEFAULT_MAX_WORKERS
+    failures = []
+    for params, _, error in utils.run_in_parallel(
+            iface.delete,
+            [{ROUTETABLE_ID: routetable_id, key: value}
+             for key, value in destinations],
+            max_workers):
+        if isinstance(error, ClientError) and \
+                error.response['Error'].get('Code') == ROUTE_NOT_FOUND:
+            continue
+        elif error:
+            failures.append('{0}: {1}'.format(
+                _route_key(params)[1], error))
+    if failures:
+        raise OperationRetry(
+            'Failed to delete {0} routes of Route Table {1}: {2}'.format(
+                len(failures), routetable_id, failures))
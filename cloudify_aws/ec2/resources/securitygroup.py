@@ -20,9 +20,11 @@
 from botocore.exceptions import ClientError
 
 # Cloudify
+from cloudify.exceptions import OperationRetry
 from cloudify_aws.common import decorators, utils
 from cloudify_aws.common.constants import EXTERNAL_RESOURCE_ID
 from cloudify_aws.ec2 import EC2Base
+from cloudify_aws.ec2.resources import eni
 
 RESOURCE_TYPE = 'EC2 Security Group'
 GROUP = 'SecurityGroup'
@@ -181,6 +183,17 @@ def delete(ctx, iface, resource_config, **_):
     if not group_id:
         group_id = iface.resource_id
 
+    # Lambda functions leave their ENIs behind, which blocks the deletion
+    remaining = eni.reap_network_interfaces(
+        eni.EC2NetworkInterface(
+            ctx.node, client=iface.client, logger=ctx.logger),
+        eni.get_lambda_eni_filters(group_ids=[group_id]))
+    if remaining:
+        raise OperationRetry(
+            '{0} ID# "{1}" still has network interfaces {2}.'.format(
+                RESOURCE_TYPE, group_id, remaining),
+            retry_after=utils.get_retry_interval(ctx.operation.retry_number))
+
     iface.delete({GROUPID: group_id})
 
 
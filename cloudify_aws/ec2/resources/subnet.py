@@ -21,9 +21,10 @@ from botocore.exceptions import ClientError
 from botocore.exceptions import CapacityNotAvailableError
 
 # Cloudify
-from cloudify.exceptions import NonRecoverableError
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 from cloudify_aws.common import decorators, utils
 from cloudify_aws.ec2 import EC2Base
+from cloudify_aws.ec2.resources import eni
 from cloudify_aws.common.constants import EXTERNAL_RESOURCE_ID
 
 RESOURCE_TYPE = 'EC2 Subnet'
@@ -203,6 +204,17 @@ def delete(ctx, iface, resource_config, **_):
             iface.resource_id or \
             ctx.instance.runtime_properties.get(EXTERNAL_RESOURCE_ID)
 
+    # Lambda functions leave their ENIs behind, which blocks the deletion
+    remaining = eni.reap_network_interfaces(
+        eni.EC2NetworkInterface(
+            ctx.node, client=iface.client, logger=ctx.logger),
+        eni.get_lambda_eni_filters(subnet_id=params[SUBNET_ID]))
+    if remaining:
+        raise OperationRetry(
+            '{0} ID# "{1}" still has network interfaces {2}.'.format(
+                RESOURCE_TYPE, params[SUBNET_ID], remaining),
+            retry_after=utils.get_retry_interval(ctx.operation.retry_number))
+
     iface.delete(params)
 
 
@@ -18,6 +18,10 @@ import unittest
 # Third Party Imports
 from mock import patch, MagicMock
 
+from botocore.exceptions import ClientError
+
+from cloudify.exceptions import NonRecoverableError, OperationRetry
+
 # Local Imports
 from cloudify_aws.common._compat import reload_module
 from cloudify_aws.ec2.resources.ebs import (
@@ -26,7 +30,9 @@ from cloudify_aws.ec2.resources.ebs import (
     VOLUME_ID,
     VOLUMES,
     VOLUME_STATE,
-    AVAILABLE
+    AVAILABLE,
+    ATTACHED,
+    INUSE
 )
 from cloudify_aws.common.tests.test_base import (
     TestBase,
@@ -387,5 +393,195 @@ class TestEC2VolumeAttachment(TestBase):
         self.assertTrue(iface.delete.called)
 
 
+class TestEC2Volumes(TestBase):
+
+    def setUp(self):
+        super(TestEC2Volumes, self).setUp()
+        mock1 = patch(
+            'cloudify_aws.common.decorators.aws_resource', mock_decorator
+        )
+        mock1.start()
+        reload_module(ebs)
+
+    def _volumes(self, *volumes):
+        return {VOLUMES: [dict(zip([VOLUME_ID, VOLUME_STATE, 'Attachments'],
+                                   volume)) for volume in volumes]}
+
+    def test_create_volumes(self):
+        tags = [{'Key': 'Name', 'Value': 'data'}]
+        ctx = self.get_mock_ctx("EBSVolumes", test_properties={'Tags': tags})
+        iface = MagicMock()
+        iface.create.side_effect = [{VOLUME_ID: 'vol-1'}, {VOLUME_ID: 'vol-2'}]
+        # vol-2 is not described yet right after creation
+        iface.client.describe_volumes.return_value = self._volumes(
+            ('vol-1', AVAILABLE))
+        config = {'Count': 2, 'AvailabilityZone': 'aq-testzone-1a'}
+        with self.assertRaises(OperationRetry):
+            ebs.create_volumes(ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(iface.create.call_count, 2)
+        self.assertNotIn('Count', iface.create.call_args[0][0])
+        self.assertEqual(
+            sorted(ctx.instance.runtime_properties['volumes']),
+            ['vol-1', 'vol-2'])
+
+        iface.client.describe_volumes.return_value = self._volumes(
+            ('vol-1', AVAILABLE), ('vol-2', 'creating'))
+        with self.assertRaises(OperationRetry):
+            ebs.create_volumes(ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(iface.create.call_count, 2)
+        self.assertFalse(iface.tag.called)
+
+        volume = EC2Volume(ctx.node, client=MagicMock(), logger=ctx.logger)
+        volume.client.describe_volumes.return_value = self._volumes(
+            ('vol-1', AVAILABLE), ('vol-2', AVAILABLE))
+        ebs.create_volumes(ctx=ctx, iface=volume, resource_config=config)
+        self.assertFalse(volume.client.create_volume.called)
+        volume.client.create_tags.assert_called_once_with(
+            Tags=tags, Resources=['vol-1', 'vol-2'])
+
+        iface.client.describe_volumes.return_value = self._volumes(
+            ('vol-1', AVAILABLE), ('vol-2', 'error'))
+        with self.assertRaises(NonRecoverableError):
+            ebs.create_volumes(ctx=ctx, iface=iface, resource_config=config)
+
+    def test_allocate_device_names(self):
+        iface = MagicMock()
+        iface.client.describe_instances.return_value = {
+            'Reservations': [{'Instances': [{
+                'RootDeviceName': '/dev/xvda',
+                'BlockDeviceMappings': [{'DeviceName': '/dev/xvda'},
+                                        {'DeviceName': '/dev/sdf'}]}]}]}
+        self.assertEqual(
+            ebs.allocate_device_names(iface, 'i-1', 3, ['/dev/sdf',
+                                                        '/dev/sdz']),
+            ['/dev/sdz', '/dev/sdg', '/dev/sdh'])
+
+    def test_attach_volumes(self):
+        ctx = self.get_mock_ctx("EBSVolumes")
+        ctx.instance.runtime_properties['volumes'] = ['vol-1', 'vol-2']
+        iface = MagicMock()
+        iface.client.describe_instances.return_value = {}
+        iface.client.describe_volumes.return_value = self._volumes(
+            ('vol-1', INUSE, [{VOLUME_STATE: ATTACHED}]),
+            ('vol-2', INUSE, [{VOLUME_STATE: ATTACHED}]))
+        rel = MagicMock()
+        rel.target.instance.runtime_properties = {
+            constants.EXTERNAL_RESOURCE_ID: 'i-1'}
+        with patch('cloudify_aws.common.utils.find_rel_by_node_type',
+                   return_value=rel):
+            ebs.attach_volumes(ctx=ctx, iface=iface, resource_config={})
+        self.assertEqual(iface.attach.call_count, 2)
+        self.assertEqual(ctx.instance.runtime_properties['devices'],
+                         {'vol-1': '/dev/sdf', 'vol-2': '/dev/sdg'})
+
+    def test_detach_and_delete_volumes(self):
+        ctx = self.get_mock_ctx("EBSVolumes")
+        ctx.instance.runtime_properties['volumes'] = ['vol-1', 'vol-2']
+        ctx.instance.runtime_properties['devices'] = {'vol-1': '/dev/sdf'}
+        iface = MagicMock()
+        iface.client.describe_volumes.side_effect = [
+            self._volumes(('vol-1', INUSE, [{VOLUME_STATE: ATTACHED}]),
+                          ('vol-2', AVAILABLE)),
+            self._volumes(('vol-1', INUSE, [{VOLUME_STATE: 'detaching'}]),
+                          ('vol-2', AVAILABLE)),
+            self._volumes(('vol-1', AVAILABLE), ('vol-2', AVAILABLE))]
+        with self.assertRaises(OperationRetry):
+            ebs.detach_volumes(ctx=ctx, iface=iface, resource_config={})
+        self.assertEqual(iface.detach.call_count, 1)
+        ebs.detach_volumes(ctx=ctx, iface=iface, resource_config={})
+        self.assertEqual(iface.detach.call_count, 1)
+        self.assertEqual(ctx.instance.runtime_properties['devices'], {})
+
+        iface.client.describe_volumes.side_effect = None
+        iface.client.describe_volumes.return_value = self._volumes(
+            ('vol-1', AVAILABLE))
+        ebs.delete_volumes(ctx=ctx, iface=iface, resource_config={})
+        iface.delete.assert_called_once_with({VOLUME_ID: 'vol-1'})
+
+    def test_get_latest_snapshot(self):
+        iface = MagicMock()
+        iface.client.describe_snapshots.side_effect = [
+            {'Snapshots': [{'SnapshotId': 'snap-1', 'StartTime': 1},
+                           {'SnapshotId': 'snap-3', 'StartTime': 3}],
+             'NextToken': 'next'},
+            {'Snapshots': [{'SnapshotId': 'snap-2', 'StartTime': 2}]}]
+        filters = [{'Name': 'tag:Name', 'Values': ['db']}]
+        res = ebs.get_latest_snapshot(iface, filters, ['self'])
+        self.assertEqual(res['SnapshotId'], 'snap-3')
+        _, kwargs = iface.client.describe_snapshots.call_args
+        self.assertEqual(kwargs['NextToken'], 'next')
+        self.assertIn({'Name': 'status', 'Values': ['completed']},
+                      kwargs['Filters'])
+
+    def test_create_volumes_from_snapshot(self):
+        ctx = self.get_mock_ctx("EBSVolumes", test_properties={
+            'snapshot_source': {
+                'filters': [{'Name': 'tag:Name', 'Values': ['db']}],
+                'fast_snapshot_restore': True}})
+        iface = MagicMock()
+        iface.client.describe_snapshots.return_value = {
+            'Snapshots': [{'SnapshotId': 'snap-1', 'StartTime': 1}]}
+        iface.client.describe_fast_snapshot_restores.return_value = {}
+        config = {'Count': 2, 'AvailabilityZone': 'aq-testzone-1a'}
+        with self.assertRaises(OperationRetry):
+            ebs.create_volumes(ctx=ctx, iface=iface, resource_config=config)
+        iface.client.enable_fast_snapshot_restores.assert_called_once_with(
+            AvailabilityZones=['aq-testzone-1a'],
+            SourceSnapshotIds=['snap-1'])
+        self.assertFalse(iface.create.called)
+
+        iface.client.describe_fast_snapshot_restores.return_value = {
+            'FastSnapshotRestores': [{'AvailabilityZone': 'aq-testzone-1a',
+                                      'State': 'enabled'}]}
+        iface.create.side_effect = [{VOLUME_ID: 'vol-1'}, {VOLUME_ID: 'vol-2'}]
+        iface.client.describe_volumes.return_value = self._volumes(
+            ('vol-1', AVAILABLE), ('vol-2', AVAILABLE))
+        ebs.create_volumes(ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(iface.create.call_args[0][0]['SnapshotId'],
+                         'snap-1')
+        self.assertEqual(iface.client.describe_snapshots.call_count, 1)
+        self.assertEqual(
+            iface.client.enable_fast_snapshot_restores.call_count, 1)
+
+        iface.client.describe_volumes.return_value = {}
+        ebs.delete_volumes(ctx=ctx, iface=iface, resource_config={})
+        iface.client.disable_fast_snapshot_restores.assert_called_once_with(
+            AvailabilityZones=['aq-testzone-1a'],
+            SourceSnapshotIds=['snap-1'])
+
+    def test_create_snapshot(self):
+        tags = [{'Key': 'Name', 'Value': 'backup'}]
+        ctx = self.get_mock_ctx("EBSSnapshot", test_properties={'Tags': tags})
+        iface = MagicMock()
+        iface.resource_id = None
+        iface.create.return_value = {'SnapshotId': 'snap-1'}
+        iface.properties = {'State': 'pending', 'Progress': '40%'}
+        with self.assertRaises(OperationRetry) as e:
+            ebs.create_snapshot(ctx=ctx, iface=iface,
+                                resource_config={VOLUME_ID: 'vol-1'})
+        self.assertIn('40%', str(e.exception))
+        self.assertFalse(iface.tag.called)
+        self.assertEqual(ctx.instance.runtime_properties[
+            constants.EXTERNAL_RESOURCE_ID], 'snap-1')
+
+        iface.resource_id = 'snap-1'
+        iface.properties = {'State': 'completed', 'Progress': '100%'}
+        ebs.create_snapshot(ctx=ctx, iface=iface,
+                            resource_config={VOLUME_ID: 'vol-1'})
+        self.assertEqual(iface.create.call_count, 1)
+        iface.tag.assert_called_once_with({
+            'Tags': tags, 'Resources': ['snap-1']})
+
+    def test_delete_snapshot(self):
+        ctx = self.get_mock_ctx("EBSSnapshot")
+        iface = MagicMock()
+        iface.resource_id = 'snap-1'
+        iface.delete.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidSnapshot.NotFound',
+                       'Message': 'gone'}}, 'DeleteSnapshot')
+        ebs.delete_snapshot(ctx=ctx, iface=iface, resource_config={})
+        iface.delete.assert_called_once_with({'SnapshotId': 'snap-1'})
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -19,6 +19,7 @@ import unittest
 from mock import patch, MagicMock
 
 # Local imports
+from cloudify_aws.common import utils
 from cloudify_aws.ec2.resources import elasticip
 from cloudify_aws.common._compat import reload_module
 from cloudify_aws.common.tests.test_base import (
@@ -41,6 +42,7 @@ from cloudify_aws.ec2.resources.elasticip import (
 class TestEC2NetworkInterface(TestBase):
 
     def setUp(self):
+        super(TestEC2NetworkInterface, self).setUp()
         self.elasticip = EC2ElasticIP("ctx_node", resource_id=True,
                                       client=True, logger=None)
         mock1 = patch('cloudify_aws.common.decorators.aws_resource',
@@ -140,7 +142,9 @@ class TestEC2NetworkInterface(TestBase):
         self.assertEqual(self.elasticip.resource_id,
                          'elasticip')
 
-    def test_create_use_allocated(self):
+    @patch('cloudify_aws.ec2.resources.elasticip.get_account_id',
+           return_value='123456789012')
+    def test_create_use_allocated(self, *_):
         value = {
             ADDRESSES: [
                 {
@@ -173,7 +177,9 @@ class TestEC2NetworkInterface(TestBase):
             ctx.instance.runtime_properties.get('allocation_id'),
             'test_name2')
 
-    def test_create_use_allocated_no_allocated(self):
+    @patch('cloudify_aws.ec2.resources.elasticip.get_account_id',
+           return_value='123456789012')
+    def test_create_use_allocated_no_allocated(self, *_):
         value = {
             ADDRESSES: [
                 {
@@ -210,6 +216,72 @@ class TestEC2NetworkInterface(TestBase):
             ctx.instance.runtime_properties.get('allocation_id'),
             'elasticip')
 
+    def test_pool_claims_distinct_addresses(self):
+        free = [{ELASTICIP_ID: 'ip-{0}'.format(i),
+                 ALLOCATION_ID: 'eipalloc-{0}'.format(i)} for i in range(4)]
+        iface = MagicMock()
+        iface.list = self.mock_return(free)
+        pool = elasticip.EC2ElasticIPPool(iface, region_name='region')
+        res = utils.run_in_parallel(pool.claim, ['a', 'b', 'c', 'd'])
+        claimed = [address[ALLOCATION_ID] for _, address, _ in res]
+        self.assertEqual(sorted(claimed),
+                         ['eipalloc-{0}'.format(i) for i in range(4)])
+        self.assertFalse(iface.create.called)
+        # Claims are idempotent and cached addresses are only verified
+        self.assertEqual(pool.claim('a'), res[0][1])
+        iface.list.reset_mock()
+        pool.release('b')
+        self.assertEqual(pool.claim('e')[ALLOCATION_ID], claimed[1])
+        self.assertEqual(
+            iface.list.call_args[0][0]['Filters'][1],
+            {'Name': 'allocation-id', 'Values': [claimed[1]]})
+
+    def test_pool_grow_and_release(self):
+        iface = MagicMock()
+        iface.list = self.mock_return([])
+        iface.create = MagicMock(side_effect=[
+            {ELASTICIP_ID: 'ip-{0}'.format(i),
+             ALLOCATION_ID: 'eipalloc-{0}'.format(i)} for i in range(3)])
+        pool = elasticip.EC2ElasticIPPool(
+            iface, allocation_batch_size=3, max_idle_addresses=1)
+        first = pool.claim('a', {'Domain': 'vpc'})
+        self.assertEqual(iface.create.call_count, 3)
+        self.assertEqual(
+            sorted(iface.client.create_tags.call_args[1]['Resources']),
+            ['eipalloc-0', 'eipalloc-1', 'eipalloc-2'])
+        iface.list = self.mock_return([
+            {ELASTICIP_ID: 'ip-{0}'.format(i),
+             ALLOCATION_ID: 'eipalloc-{0}'.format(i)} for i in range(3)])
+        second = pool.claim('b')
+        self.assertEqual(iface.create.call_count, 3)
+        self.assertNotEqual(first, second)
+        # One idle address is kept in the pool, the surplus is released
+        self.assertEqual(len(pool.release('a')), 1)
+        self.assertEqual(len(pool.release('b')), 1)
+        self.assertEqual(iface.delete.call_count, 2)
+
+    def test_pool_store_per_account(self):
+        ctx = self.get_mock_ctx("PublicIp", test_properties={
+            'client_config': {'region_name': 'region'}})
+        with patch('cloudify_aws.ec2.resources.elasticip.get_account_id',
+                   side_effect=['123456789012', '210987654321']):
+            first = elasticip.get_address_pool(ctx, MagicMock())
+            second = elasticip.get_address_pool(ctx, MagicMock())
+        self.assertIn('123456789012', first.store_name)
+        self.assertNotEqual(first.store_name, second.store_name)
+
+    def test_delete_use_allocated(self):
+        test_node_props = {'use_unassociated_addresses': True}
+        ctx = self.get_mock_ctx("PublicIp",
+                                test_properties=test_node_props)
+        ctx.instance.runtime_properties['unassociated_address'] = 'ip'
+        iface = MagicMock()
+        with patch('cloudify_aws.ec2.resources.elasticip.'
+                   'EC2ElasticIPPool.release') as release:
+            elasticip.delete(ctx=ctx, iface=iface, resource_config={})
+            release.assert_called_once_with('PublicIp/PublicIp')
+        self.assertFalse(iface.delete.called)
+
     def test_create_with_relationships(self):
         ctx = self.get_mock_ctx("PublicIp",
                                 type_hierarchy=[INSTANCE_TYPE_DEPRECATED])
@@ -18,6 +18,7 @@ import unittest
 
 # Third party imports
 from mock import patch, MagicMock
+from botocore.exceptions import ClientError
 
 # Local imports
 from cloudify_aws.common._compat import reload_module
@@ -89,6 +90,61 @@ class TestEC2NetworkInterface(TestBase):
         res = self.eni.status
         self.assertEqual(res, 'available')
 
+    def test_class_list_network_interfaces(self):
+        self.eni.client = self.make_client_function(
+            'describe_network_interfaces',
+            side_effect=[
+                {NETWORKINTERFACES: [{NETWORKINTERFACE_ID: 'eni-1'}],
+                 'NextToken': 'token'},
+                {NETWORKINTERFACES: [{NETWORKINTERFACE_ID: 'eni-2'}]}])
+        res = self.eni.list_network_interfaces([{'Name': 'a'}])
+        self.assertEqual([i[NETWORKINTERFACE_ID] for i in res],
+                         ['eni-1', 'eni-2'])
+        self.eni.client.describe_network_interfaces.assert_called_with(
+            Filters=[{'Name': 'a'}], NextToken='token')
+
+    def test_reap_network_interfaces(self):
+        self.eni.logger = MagicMock()
+        listed = {NETWORKINTERFACES: [
+            {NETWORKINTERFACE_ID: 'eni-1', 'Status': 'in-use',
+             'Attachment': {ATTACHMENT_ID: 'attach-1',
+                            'Status': 'attached'}},
+            {NETWORKINTERFACE_ID: 'eni-2', 'Status': 'available'},
+            {NETWORKINTERFACE_ID: 'eni-3', 'Status': 'available'}]}
+        self.eni.client = self.make_client_function(
+            'describe_network_interfaces', return_value=listed)
+        self.eni.client.delete_network_interface = MagicMock(side_effect=[
+            None,
+            ClientError({'Error': {'Code': 'InvalidNetworkInterfaceID.'
+                                           'NotFound', 'Message': 'gone'}},
+                        'DeleteNetworkInterface')])
+        remaining = eni.reap_network_interfaces(
+            self.eni, eni.get_lambda_eni_filters(subnet_id='subnet'))
+        # Detaching interfaces are left to the next pass, without waiting
+        self.assertEqual(remaining, ['eni-1'])
+        self.assertEqual(
+            self.eni.client.describe_network_interfaces.call_count, 1)
+        self.eni.client.detach_network_interface.assert_called_once_with(
+            AttachmentId='attach-1')
+        self.assertEqual(
+            sorted(c[1][NETWORKINTERFACE_ID] for c in
+                   self.eni.client.delete_network_interface.call_args_list),
+            ['eni-2', 'eni-3'])
+
+    def test_reap_network_interfaces_failed_delete(self):
+        self.eni.logger = MagicMock()
+        listed = {NETWORKINTERFACES: [
+            {NETWORKINTERFACE_ID: 'eni-1', 'Status': 'available'}]}
+        self.eni.client = self.make_client_function(
+            'describe_network_interfaces', return_value=listed)
+        self.eni.client.delete_network_interface = MagicMock(
+            side_effect=ClientError(
+                {'Error': {'Code': 'InvalidNetworkInterface.InUse',
+                           'Message': 'in use'}},
+                'DeleteNetworkInterface'))
+        self.assertEqual(eni.reap_network_interfaces(self.eni, []),
+                         ['eni-1'])
+
     def test_class_create(self):
         value = {'NetworkInterface': 'test'}
         self.eni.client = \
@@ -13,10 +13,11 @@
 # limitations under the License.
 
 # Standard imports
+import time
 import unittest
 
 # Third party imports
-from mock import patch, MagicMock
+from mock import patch, MagicMock, PropertyMock
 
 from cloudify.exceptions import NonRecoverableError
 
@@ -30,13 +31,15 @@ from cloudify_aws.ec2.resources.image import (
     EC2Image,
     IMAGES,
     IMAGE_ID,
-    OWNERS
+    OWNERS,
+    FILTERS
 )
 
 
 class TestEC2Image(TestBase):
 
     def setUp(self):
+        super(TestEC2Image, self).setUp()
         self.image = EC2Image("ctx_node", resource_id=True,
                               client=True, logger=None)
         mock1 = patch('cloudify_aws.common.decorators.aws_resource',
@@ -93,14 +96,129 @@ class TestEC2Image(TestBase):
         res = self.image.create(value)
         self.assertEqual(res['Image'], value['Image'])
 
-    def test_prepare(self):
+    def test_class_properties_newest(self):
+        self.image.client = self.make_client_function(
+            'describe_images', side_effect=[
+                {IMAGES: [{IMAGE_ID: 'old', 'CreationDate': '2019-01-01'},
+                          {IMAGE_ID: 'new', 'CreationDate': '2020-01-01'}],
+                 'NextToken': 'next'},
+                {IMAGES: [{IMAGE_ID: 'mid', 'CreationDate': '2019-06-01'}]}])
+        self.assertEqual(self.image.properties[IMAGE_ID], 'new')
+        _, kwargs = self.image.client.describe_images.call_args
+        self.assertEqual(kwargs['NextToken'], 'next')
+        self.assertNotIn('MaxResults', kwargs)
+
+    def test_class_iter_images_paging(self):
+        self.image.client = self.make_client_function(
+            'describe_images', return_value={IMAGES: []})
+        self.image.client.meta.service_model.operation_model.return_value.\
+            input_shape.members = {'MaxResults': None, 'NextToken': None}
+        list(self.image.iter_images({OWNERS: ['amazon']}))
+        self.image.client.describe_images.assert_called_once_with(
+            Owners=['amazon'], MaxResults=image.PAGE_SIZE)
+        self.image.client.meta.service_model.operation_model.\
+            assert_called_with('DescribeImages')
+
+    def test_get_account_id(self):
+        config = {'region_name': 'aq-testzone-1', 'endpoint_url': 'url'}
+        with patch('cloudify_aws.ec2.resources.image.boto3') as mock_boto3:
+            mock_boto3.client.return_value.get_caller_identity.\
+                return_value = {'Account': '123456789012'}
+            self.assertEqual(image.get_account_id(config), '123456789012')
+            self.assertEqual(image.get_account_id(config), '123456789012')
+            mock_boto3.client.assert_called_once_with(
+                'sts', region_name='aq-testzone-1')
+
+            mock_boto3.client.return_value.get_caller_identity.\
+                side_effect = self.get_client_error_exception(name='STS')
+            self.assertIsNone(image.get_account_id(
+                {'region_name': 'aq-testzone-2'}))
+
+    @patch('cloudify_aws.ec2.resources.image.get_account_id',
+           return_value='123456789012')
+    def test_resolve_image_cached(self, _):
+        iface = MagicMock()
+        iface.describe_image_filters = {
+            OWNERS: ['amazon'],
+            FILTERS: [{'Name': 'name', 'Values': ['b', 'a']}]}
+        iface.properties = {IMAGE_ID: 'ami-1'}
+        config = {'region_name': 'aq-testzone-1'}
+        self.assertEqual(image.resolve_image(iface, config)[IMAGE_ID],
+                         'ami-1')
+
+        other = MagicMock()
+        other.describe_image_filters = {
+            OWNERS: ['amazon'],
+            FILTERS: [{'Name': 'name', 'Values': ['a', 'b']}]}
+        type(other).properties = PropertyMock(
+            side_effect=AssertionError('not cached'))
+        self.assertEqual(image.resolve_image(other, config)[IMAGE_ID],
+                         'ami-1')
+
+        with patch('cloudify_aws.ec2.resources.image.time.time',
+                   return_value=time.time() + 2 * image.IMAGE_CACHE_TTL):
+            iface.properties = {IMAGE_ID: 'ami-2'}
+            self.assertEqual(image.resolve_image(iface, config)[IMAGE_ID],
+                             'ami-2')
+
+    def test_resolve_image_accounts(self):
+        iface = MagicMock()
+        iface.describe_image_filters = {OWNERS: ['self']}
+        iface.properties = {IMAGE_ID: 'ami-1'}
+        config = {'region_name': 'aq-testzone-1'}
+        with patch('cloudify_aws.ec2.resources.image.get_account_id',
+                   return_value='111111111111'):
+            image.resolve_image(iface, config)
+
+        # Same filters and region, but another account
+        iface.properties = {IMAGE_ID: 'ami-2'}
+        with patch('cloudify_aws.ec2.resources.image.get_account_id',
+                   return_value='222222222222'):
+            self.assertEqual(image.resolve_image(iface, config)[IMAGE_ID],
+                             'ami-2')
+
+        # Unknown accounts never use the cache
+        iface.properties = {IMAGE_ID: 'ami-3'}
+        with patch('cloudify_aws.ec2.resources.image.get_account_id',
+                   return_value=None):
+            self.assertEqual(image.resolve_image(iface, config)[IMAGE_ID],
+                             'ami-3')
+
+    @patch('cloudify_aws.ec2.resources.image.get_account_id',
+           return_value='123456789012')
+    def test_resolve_image_failed_refresh(self, _):
+        iface = MagicMock()
+        iface.describe_image_filters = {OWNERS: ['amazon']}
+        iface.properties = {IMAGE_ID: 'ami-1'}
+        config = {'region_name': 'aq-testzone-1'}
+        image.resolve_image(iface, config)
+
+        # A refresh failing to find the image keeps the cached one
+        iface.properties = None
+        key = image.get_image_cache_key(iface, config, '123456789012')
+        image._refresh_image(iface, key, image.IMAGE_CACHE_TTL)
+        self.assertEqual(image.resolve_image(iface, config)[IMAGE_ID],
+                         'ami-1')
+
+        # Entries without an image are cache misses
+        image._cache_image(key, None, image.IMAGE_CACHE_TTL)
+        iface.properties = {IMAGE_ID: 'ami-2'}
+        self.assertEqual(image.resolve_image(iface, config)[IMAGE_ID],
+                         'ami-2')
+
+    @patch('cloudify_aws.ec2.resources.image.get_account_id',
+           return_value='123456789012')
+    def test_prepare(self, _):
         ctx = self.get_mock_ctx("Image")
         config = {IMAGE_ID: 'image', OWNERS: 'owner'}
         iface = MagicMock()
         iface.create = self.mock_return(config)
+        iface.properties = {IMAGE_ID: 'image'}
         image.prepare(ctx, iface, config)
         self.assertEqual(ctx.instance.runtime_properties['resource_config'],
                          config)
+        self.assertEqual(
+            ctx.instance.runtime_properties['aws_resource_id'], 'image')
 
     def test_delete(self):
         config = {IMAGE_ID: 'image'}
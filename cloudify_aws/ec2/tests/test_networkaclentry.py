@@ -17,6 +17,9 @@ import unittest
 
 # Third party imports
 from mock import patch, MagicMock
+from botocore.exceptions import ClientError
+
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 
 # Local imports
 from cloudify_aws.common._compat import reload_module
@@ -164,6 +167,102 @@ class TestEC2NetworkAclEntry(TestBase):
             networkaclentry.delete(ctx, iface, config)
             self.assertTrue(iface.delete.called)
 
+    def test_create_entries(self):
+        ctx = self.get_mock_ctx("NetworkAcl")
+        iface = MagicMock()
+        keep = {RULE_NUMBER: 100, EGRESS: False, 'Protocol': '-1',
+                'RuleAction': 'allow', 'CidrBlock': '0.0.0.0/0'}
+        change = {RULE_NUMBER: 110, EGRESS: True, 'Protocol': '6',
+                  'RuleAction': 'allow', 'CidrBlock': '10.0.0.0/8'}
+        add = {RULE_NUMBER: 120, 'Protocol': '-1',
+               'RuleAction': 'deny', 'CidrBlock': '10.1.0.0/16'}
+        default = {RULE_NUMBER: 32767, EGRESS: False, 'Protocol': '-1',
+                   'RuleAction': 'deny', 'CidrBlock': '0.0.0.0/0'}
+        before = dict(change, RuleAction='deny')
+        after = dict(add, **{EGRESS: False})
+        iface.get_properties_by_filter.side_effect = [
+            {'Entries': [keep, before, default]},
+            {'Entries': [keep, change, after, default]}]
+        config = {NETWORKACL_ID: 'network acl',
+                  'Entries': [keep, change, add]}
+        networkaclentry.create_entries(ctx, iface, config)
+        self.assertEqual(iface.create.call_count, 1)
+        self.assertEqual(iface.create.call_args[0][0][RULE_NUMBER], 120)
+        self.assertEqual(iface.replace.call_count, 1)
+        self.assertEqual(iface.replace.call_args[0][0][RULE_NUMBER], 110)
+        self.assertEqual(iface.get_properties_by_filter.call_count, 2)
+        self.assertEqual(
+            ctx.instance.runtime_properties['entries'],
+            [[110, True], [120, False]])
+
+    def test_create_entries_protocol_names(self):
+        ctx = self.get_mock_ctx("NetworkAcl")
+        iface = MagicMock()
+        current = {RULE_NUMBER: 100, EGRESS: False, 'Protocol': '6',
+                   'RuleAction': 'allow', 'CidrBlock': '0.0.0.0/0',
+                   'PortRange': {'From': 443, 'To': 443}}
+        everything = {RULE_NUMBER: 110, EGRESS: False, 'Protocol': '-1',
+                      'RuleAction': 'deny', 'CidrBlock': '10.0.0.0/8'}
+        iface.get_properties_by_filter.return_value = {
+            'Entries': [current, everything]}
+        config = {NETWORKACL_ID: 'network acl',
+                  'Entries': [dict(current, Protocol='TCP'),
+                              dict(everything, Protocol='all')]}
+        networkaclentry.create_entries(ctx, iface, config)
+        self.assertFalse(iface.create.called)
+        self.assertFalse(iface.replace.called)
+
+        config['Entries'][0]['Protocol'] = 'udp'
+        iface.get_properties_by_filter.side_effect = [
+            {'Entries': [current, everything]},
+            {'Entries': [dict(current, Protocol='17'), everything]}]
+        networkaclentry.create_entries(ctx, iface, config)
+        self.assertEqual(iface.replace.call_count, 1)
+
+    def test_create_entries_failure(self):
+        ctx = self.get_mock_ctx("NetworkAcl")
+        iface = MagicMock()
+        iface.get_properties_by_filter.return_value = {'Entries': []}
+        iface.create.side_effect = NonRecoverableError('invalid')
+        config = {NETWORKACL_ID: 'network acl',
+                  'Entries': [{RULE_NUMBER: 100, 'RuleAction': 'allow'}]}
+        with self.assertRaises(NonRecoverableError):
+            networkaclentry.create_entries(ctx, iface, config)
+
+    def test_create_entries_retry(self):
+        ctx = self.get_mock_ctx("NetworkAcl")
+        iface = MagicMock()
+        applied = {RULE_NUMBER: 100, EGRESS: False, 'RuleAction': 'allow'}
+        iface.get_properties_by_filter.return_value = {'Entries': [applied]}
+        iface.create.side_effect = ClientError(
+            {'Error': {'Code': 'RequestLimitExceeded', 'Message': 'slow'}},
+            'CreateNetworkAclEntry')
+        config = {NETWORKACL_ID: 'network acl',
+                  'Entries': [applied,
+                              {RULE_NUMBER: 110, 'RuleAction': 'deny'}]}
+        with self.assertRaises(OperationRetry):
+            networkaclentry.create_entries(ctx, iface, config)
+
+        iface.create.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidParameterValue', 'Message': 'bad'}},
+            'CreateNetworkAclEntry')
+        with self.assertRaises(NonRecoverableError):
+            networkaclentry.create_entries(ctx, iface, config)
+
+    def test_delete_entries(self):
+        ctx = self.get_mock_ctx("NetworkAcl")
+        ctx.instance.runtime_properties['network_acl_id'] = 'network acl'
+        ctx.instance.runtime_properties['entries'] = \
+            [[100, False], [110, True]]
+        iface = MagicMock()
+        iface.delete.side_effect = [
+            None,
+            ClientError({'Error': {'Code': 'InvalidNetworkAclEntry.NotFound',
+                                   'Message': 'gone'}},
+                        'DeleteNetworkAclEntry')]
+        networkaclentry.delete_entries(ctx, iface, {})
+        self.assertEqual(iface.delete.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
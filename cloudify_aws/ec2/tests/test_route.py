@@ -17,6 +17,9 @@ import unittest
 
 # Third party imports
 from mock import patch, MagicMock
+from botocore.exceptions import ClientError
+
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 
 # Local imports
 from cloudify_aws.common._compat import reload_module
@@ -113,6 +116,85 @@ class TestEC2Route(TestBase):
             route.delete(ctx, iface, config)
             self.assertTrue(iface.delete.called)
 
+    def test_create_routes(self):
+        ctx = self.get_mock_ctx("RouteTable")
+        iface = MagicMock()
+        local = {'DestinationCidrBlock': '10.0.0.0/16', GATEWAY_ID: 'local',
+                 'Origin': 'CreateRouteTable', 'State': 'active'}
+        keep = {'DestinationCidrBlock': '0.0.0.0/0', GATEWAY_ID: 'igw',
+                'Origin': 'CreateRoute', 'State': 'active'}
+        change = {'DestinationCidrBlock': '10.1.0.0/16',
+                  'NatGatewayId': 'nat-2'}
+        add = {'DestinationIpv6CidrBlock': '::/0', GATEWAY_ID: 'igw'}
+        iface.get_properties_by_filter.side_effect = [
+            {'Routes': [local, keep,
+                        dict(change, NatGatewayId='nat-1', State='active')]},
+            {'Routes': [local, keep, dict(change, State='active'),
+                        dict(add, State='active')]}]
+        config = {ROUTETABLE_ID: 'route table',
+                  'Routes': [keep, change, add]}
+        route.create_routes(ctx, iface, config)
+        self.assertEqual(iface.create.call_count, 1)
+        self.assertEqual(iface.create.call_args[0][0][ROUTETABLE_ID],
+                         'route table')
+        self.assertEqual(iface.replace.call_count, 1)
+        self.assertEqual(
+            iface.replace.call_args[0][0]['NatGatewayId'], 'nat-2')
+        self.assertEqual(iface.get_properties_by_filter.call_count, 2)
+        # The adopted default route is not removed on delete
+        self.assertEqual(
+            ctx.instance.runtime_properties['destinations'],
+            [['DestinationCidrBlock', '10.1.0.0/16'],
+             ['DestinationIpv6CidrBlock', '::/0']])
+
+    def test_create_routes_blackhole(self):
+        ctx = self.get_mock_ctx("RouteTable")
+        iface = MagicMock()
+        add = {'DestinationCidrBlock': '0.0.0.0/0', GATEWAY_ID: 'igw'}
+        iface.get_properties_by_filter.side_effect = [
+            {'Routes': []},
+            {'Routes': [dict(add, State='blackhole')]}]
+        with self.assertRaises(NonRecoverableError):
+            route.create_routes(ctx, iface, {ROUTETABLE_ID: 'route table',
+                                             'Routes': [add]})
+
+    def test_create_routes_retry(self):
+        ctx = self.get_mock_ctx("RouteTable")
+        iface = MagicMock()
+        add = {'DestinationCidrBlock': '0.0.0.0/0', GATEWAY_ID: 'igw'}
+        iface.get_properties_by_filter.return_value = {'Routes': []}
+        iface.create.side_effect = ClientError(
+            {'Error': {'Code': 'Throttling', 'Message': 'slow'}},
+            'CreateRoute')
+        config = {ROUTETABLE_ID: 'route table', 'Routes': [add]}
+        with self.assertRaises(OperationRetry):
+            route.create_routes(ctx, iface, config)
+        self.assertEqual(ctx.instance.runtime_properties['destinations'], [])
+
+        # Applied, but not visible yet
+        iface.create.side_effect = None
+        with self.assertRaises(OperationRetry):
+            route.create_routes(ctx, iface, config)
+        self.assertEqual(ctx.instance.runtime_properties['destinations'],
+                         [['DestinationCidrBlock', '0.0.0.0/0']])
+
+        iface.create.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidGatewayID.Malformed',
+                       'Message': 'bad'}},
+            'CreateRoute')
+        with self.assertRaises(NonRecoverableError):
+            route.create_routes(ctx, iface, config)
+
+    def test_delete_routes(self):
+        ctx = self.get_mock_ctx("RouteTable")
+        ctx.instance.runtime_properties['routetable_id'] = 'route table'
+        ctx.instance.runtime_properties['destinations'] = [
+            ['DestinationCidrBlock', '0.0.0.0/0'],
+            ['DestinationIpv6CidrBlock', '::/0']]
+        iface = MagicMock()
+        route.delete_routes(ctx, iface, {})
+        self.assertEqual(iface.delete.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
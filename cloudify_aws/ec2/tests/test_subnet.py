@@ -138,9 +138,28 @@ class TestEC2Subnet(TestBase):
     def test_delete(self):
         ctx = self.get_mock_ctx("Subnet")
         iface = MagicMock()
+        iface.client.describe_network_interfaces.return_value = {}
         subnet.delete(ctx=ctx, iface=iface, resource_config={})
         self.assertTrue(iface.delete.called)
 
+    def test_delete_with_lambda_enis(self):
+        ctx = self.get_mock_ctx("Subnet")
+        iface = MagicMock()
+        iface.client.describe_network_interfaces.return_value = {
+            'NetworkInterfaces': [{'NetworkInterfaceId': 'eni',
+                                   'Status': 'in-use'}]}
+        with self.assertRaises(OperationRetry) as e:
+            subnet.delete(ctx=ctx, iface=iface,
+                          resource_config={SUBNET_ID: 'subnet'})
+        self.assertEqual(e.exception.retry_after, 5)
+        self.assertFalse(iface.delete.called)
+        self.assertEqual(
+            iface.client.describe_network_interfaces.call_count, 1)
+        filters = \
+            iface.client.describe_network_interfaces.call_args_list[0][1][
+                'Filters']
+        self.assertIn({'Name': 'subnet-id', 'Values': ['subnet']}, filters)
+
     def test_modify_subnet_attribute(self):
         ctx = self.get_mock_ctx("Subnet")
         iface = MagicMock()
@@ -16,8 +16,10 @@
     ~~~
     AWS EKS base interface
 """
+# Cloudify
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 # Cloudify AWS
-from cloudify_aws.common import AWSResourceBase
+from cloudify_aws.common import AWSResourceBase, utils
 from cloudify_aws.common.connection import Boto3Connection
 
 
@@ -47,3 +49,26 @@ class EKSBase(AWSResourceBase):
     def delete(self, params=None):
         """Deletes a resource"""
         raise NotImplementedError()
+
+    def check_status(self, retry_number, status_good, status_pending,
+                     fail_on_missing=True):
+        """
+            Checks the status of the resource, retrying the operation with
+            a growing interval while it is pending.
+        """
+        status = self.status
+        self.logger.debug('%s ID# "%s" reported status: %s'
+                          % (self.type_name, self.resource_id, status))
+        if status in status_pending:
+            raise OperationRetry(
+                '%s ID# "%s" is still in a pending state.'
+                % (self.type_name, self.resource_id),
+                retry_after=utils.get_retry_interval(
+                    retry_number, initial=15, maximum=60))
+        if not status and not fail_on_missing:
+            return status
+        if status not in status_good:
+            raise NonRecoverableError(
+                '%s ID# "%s" reported an unexpected status: "%s"'
+                % (self.type_name, self.resource_id, status))
+        return status
@@ -19,6 +19,9 @@
 """
 import base64
 import json
+import time
+import hashlib
+import threading
 
 # Boto
 import boto3
@@ -38,6 +41,14 @@ CLUSTER = 'cluster'
 CLUSTER_NAME_HEADER = 'x-k8s-aws-id'
 TOKEN_PREFIX = 'k8s-aws-v1.'
 TOKEN_EXPIRATION_MINS = 60
+# EKS accepts a token for 15 minutes after it was presigned
+TOKEN_LIFETIME = 14 * 60
+# Seconds before expiry from which a cached token is refreshed
+TOKEN_REFRESH_MARGIN = 5 * 60
+
+STATUS_ACTIVE = ['ACTIVE']
+STATUS_CREATING = ['CREATING', 'PENDING']
+STATUS_DELETING = ['DELETING']
 
 
 def _retrieve_cluster_name(params, context, **kwargs):
@@ -51,14 +62,41 @@ def _inject_cluster_name_header(request, **kwargs):
 
 
 def _register_cluster_name_handlers(sts_client):
-        sts_client.meta.events.register(
-            'provide-client-params.sts.GetCallerIdentity',
-            _retrieve_cluster_name
-        )
-        sts_client.meta.events.register(
-            'before-sign.sts.GetCallerIdentity',
-            _inject_cluster_name_header
-        )
+    sts_client.meta.events.register(
+        'provide-client-params.sts.GetCallerIdentity',
+        _retrieve_cluster_name
+    )
+    sts_client.meta.events.register(
+        'before-sign.sts.GetCallerIdentity',
+        _inject_cluster_name_header
+    )
+
+
+_sts_clients = dict()
+_sts_clients_lock = threading.Lock()
+# Tokens are bearer credentials, so they are only kept in memory
+_tokens = dict()
+_tokens_lock = threading.Lock()
+
+
+def _get_config_key(client_config, *args):
+    data = json.dumps([client_config] + list(args),
+                      sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def get_sts_client(client_config):
+    """
+        Gets an STS client with the cluster name handlers registered,
+        shared by all operations of this process using the same credentials.
+    """
+    key = _get_config_key(client_config)
+    with _sts_clients_lock:
+        if key not in _sts_clients:
+            sts_client = boto3.client('sts', **client_config)
+            _register_cluster_name_handlers(sts_client)
+            _sts_clients[key] = sts_client
+        return _sts_clients[key]
 
 
 class EKSCluster(EKSBase):
@@ -97,37 +135,51 @@ class EKSCluster(EKSBase):
         """
         return self.make_client_call('create_cluster', params)
 
-    def wait_for_cluster(self, params, status):
-        """
-            wait for AWS EKS cluster.
-        """
-        waiter = self.client.get_waiter(status)
-        waiter.wait(
-            name=params.get(CLUSTER_NAME),
-            WaiterConfig={
-                'Delay': 30,
-                'MaxAttempts': 40
-            }
-        )
-
-    def get_kubeconf(self, client_config, params):
+    def generate_token(self, client_config, cluster_name):
         """
-            get kubernetes configuration for cluster.
+            Presigns a new token for the cluster.
         """
-        cluster = \
-            self.client.describe_cluster(name=params.get(CLUSTER_NAME))
-        cluster_cert = cluster["cluster"]["certificateAuthority"]["data"]
-        cluster_ep = cluster["cluster"]["endpoint"]
-        sts_client = boto3.client('sts', **client_config)
-        _register_cluster_name_handlers(sts_client)
-        url = sts_client.generate_presigned_url(
+        url = get_sts_client(client_config).generate_presigned_url(
             'get_caller_identity',
-            {'ClusterName': params.get(CLUSTER_NAME)},
+            {'ClusterName': cluster_name},
             HttpMethod='GET',
             ExpiresIn=TOKEN_EXPIRATION_MINS)
         encoded = base64.urlsafe_b64encode(url.encode('utf-8'))
-        token = TOKEN_PREFIX + \
-            encoded.decode('utf-8').rstrip('=')
+        return TOKEN_PREFIX + encoded.decode('utf-8').rstrip('=')
+
+    def get_token(self, client_config, cluster_name=None,
+                  min_ttl=TOKEN_REFRESH_MARGIN):
+        """
+            Gets a token for the cluster valid for at least min_ttl seconds,
+            from the tokens cached by this process for the same credentials.
+        :return: the token and its expiration timestamp
+        """
+        cluster_name = cluster_name or self.resource_id
+        key = _get_config_key(client_config, cluster_name)
+        with _tokens_lock:
+            now = time.time()
+            for old_key in [k for k, v in _tokens.items()
+                            if v['expiration'] < now]:
+                del _tokens[old_key]
+            cached = _tokens.get(key)
+            if not cached or cached['expiration'] - now < min_ttl:
+                cached = dict(
+                    token=self.generate_token(client_config, cluster_name),
+                    expiration=now + TOKEN_LIFETIME)
+                _tokens[key] = cached
+        return cached['token'], cached['expiration']
+
+    def get_kubeconf(self, client_config, params, cluster=None):
+        """
+            get kubernetes configuration for cluster.
+        """
+        cluster = cluster or \
+            self.client.describe_cluster(
+                name=params.get(CLUSTER_NAME))[CLUSTER]
+        cluster_cert = cluster["certificateAuthority"]["data"]
+        cluster_ep = cluster["endpoint"]
+        token, _ = self.get_token(
+            client_config, params.get(CLUSTER_NAME) or self.resource_id)
         # build the cluster config hash
         cluster_config = {
             "apiVersion": "v1",
@@ -176,7 +228,7 @@ class EKSCluster(EKSBase):
 
 def prepare_describe_cluster_filter(params, iface):
     iface.describe_param = {
-        CLUSTER_NAME: params.get(CLUSTER_NAME),
+        CLUSTER_NAME: params.get(CLUSTER_NAME) or iface.resource_id,
     }
     return iface
 
@@ -191,33 +243,35 @@ def prepare(ctx, resource_config, **_):
 @decorators.aws_resource(EKSCluster, RESOURCE_TYPE)
 def create(ctx, iface, resource_config, **_):
     """Creates an AWS EKS Cluster"""
-    store_kube_config_in_runtime = \
-        ctx.node.properties['store_kube_config_in_runtime']
     params = dict() if not resource_config else resource_config.copy()
-    resource_id = \
-        utils.get_resource_id(
-            ctx.node,
-            ctx.instance,
-            params.get(CLUSTER_NAME),
-            use_instance_id=True
-        )
-
-    utils.update_resource_id(ctx.instance, resource_id)
-    iface = prepare_describe_cluster_filter(resource_config.copy(), iface)
-    response = iface.create(params)
-    if response and response.get(CLUSTER):
-        resource_arn = response.get(CLUSTER).get(CLUSTER_ARN)
-        utils.update_resource_arn(ctx.instance, resource_arn)
-    # wait for cluster to be active
-    ctx.logger.info("Waiting for Cluster to become Active")
-    iface.wait_for_cluster(params, 'cluster_active')
-    if store_kube_config_in_runtime:
+    if ctx.operation.retry_number == 0:
+        resource_id = \
+            utils.get_resource_id(
+                ctx.node,
+                ctx.instance,
+                params.get(CLUSTER_NAME),
+                use_instance_id=True
+            )
+        utils.update_resource_id(ctx.instance, resource_id)
+        iface.resource_id = resource_id
+        response = iface.create(params)
+        if response and response.get(CLUSTER):
+            resource_arn = response.get(CLUSTER).get(CLUSTER_ARN)
+            utils.update_resource_arn(ctx.instance, resource_arn)
+        ctx.logger.info("Waiting for Cluster to become Active")
+    # Poll in later retries instead of blocking the operation
+    iface = prepare_describe_cluster_filter(params, iface)
+    iface.check_status(ctx.operation.retry_number,
+                       STATUS_ACTIVE, STATUS_CREATING)
+    if ctx.node.properties['store_kube_config_in_runtime']:
         try:
             client_config = ctx.node.properties['client_config']
-            kubeconf = iface.get_kubeconf(client_config, params)
+            kubeconf = iface.get_kubeconf(
+                client_config, params, iface.properties)
             # check if kubeconf is json serializable or not
             json.dumps(kubeconf)
             ctx.instance.runtime_properties['kubeconf'] = kubeconf
+            _store_token(ctx, iface, client_config)
         except TypeError as error:
             raise NonRecoverableError(
                 'kubeconf not json serializable {0}'.format(text_type(error)))
@@ -226,9 +280,37 @@ def create(ctx, iface, resource_config, **_):
 @decorators.aws_resource(EKSCluster, RESOURCE_TYPE)
 def delete(ctx, iface, resource_config, **_):
     """Deletes an AWS EKS Cluster"""
-
     params = dict() if not resource_config else resource_config.copy()
-    iface.delete(params)
-    # wait for cluster to be deleted
-    ctx.logger.info("Waiting for Cluster to be deleted")
-    iface.wait_for_cluster(params, 'cluster_deleted')
+    iface = prepare_describe_cluster_filter(params, iface)
+    if not ctx.instance.runtime_properties.get('__deleted'):
+        params[CLUSTER_NAME] = iface.describe_param[CLUSTER_NAME]
+        iface.delete(params)
+        ctx.instance.runtime_properties['__deleted'] = True
+        ctx.logger.info("Waiting for Cluster to be deleted")
+    iface.check_status(ctx.operation.retry_number,
+                       [], STATUS_DELETING, fail_on_missing=False)
+
+
+def _store_token(ctx, iface, client_config, min_ttl=TOKEN_REFRESH_MARGIN):
+    runtime_properties = ctx.instance.runtime_properties
+    token, expiration = iface.get_token(client_config, min_ttl=min_ttl)
+    runtime_properties['token'] = token
+    runtime_properties['token_expiration'] = expiration
+    kubeconf = runtime_properties.get('kubeconf')
+    if kubeconf:
+        kubeconf['users'][0]['user']['token'] = token
+        runtime_properties['kubeconf'] = kubeconf
+
+
+@decorators.aws_resource(EKSCluster, RESOURCE_TYPE, ignore_properties=True)
+def refresh_token(ctx, iface, min_ttl=TOKEN_REFRESH_MARGIN, **_):
+    """
+        Stores a token of an AWS EKS Cluster valid for at least min_ttl
+        seconds in the "token" runtime property and in "kubeconf". Cheap
+        to call before every use, the token is only presigned again when
+        it is close to expiry.
+    """
+    expiration = ctx.instance.runtime_properties.get('token_expiration')
+    if expiration and expiration - time.time() >= min_ttl:
+        return
+    _store_token(ctx, iface, ctx.node.properties['client_config'], min_ttl)
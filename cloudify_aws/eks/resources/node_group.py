@@ -20,12 +20,16 @@
 
 from __future__ import unicode_literals
 
+# Standard imports
+from functools import partial
+
 # Boto
 
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ParamValidationError
 
 # Cloudify
-from cloudify_aws.common import decorators, utils
+from cloudify.exceptions import NonRecoverableError, OperationRetry
+from cloudify_aws.common import constants, decorators, utils
 from cloudify_aws.eks import EKSBase
 
 RESOURCE_TYPE = 'EKS Node Group'
@@ -34,6 +38,14 @@ NODEGROUP_NAME = 'nodegroupName'
 NODEGROUP_ARN = 'nodegroupArn'
 NODEGROUP = 'nodegroup'
 
+STATUS_ACTIVE = ['ACTIVE']
+STATUS_CREATING = ['CREATING']
+STATUS_DELETING = ['DELETING']
+STATUS_FAILED = ['CREATE_FAILED', 'DELETE_FAILED', 'DEGRADED']
+NODEGROUPS = 'NodeGroups'
+CLUSTER_TYPE = 'cloudify.nodes.aws.eks.Cluster'
+NOT_FOUND = 'ResourceNotFoundException'
+
 
 class EKSNodeGroup(EKSBase):
     """
@@ -65,25 +77,24 @@ class EKSNodeGroup(EKSBase):
             return None
         return props.get('status')
 
-    def create(self, params):
+    def create(self, params, **kwargs):
         """
             Create a new AWS EKS Node Group.
         """
-        return self.make_client_call('create_nodegroup', params)
+        return self.make_client_call('create_nodegroup', params, **kwargs)
 
-    def wait_for_nodegroup(self, params, status):
+    def describe(self, cluster_name, nodegroup_name):
         """
-            wait for AWS EKS Node Group.
+            Gets the properties of a Node Group of a cluster.
         """
-        waiter = self.client.get_waiter(status)
-        waiter.wait(
-            clusterName=params.get(CLUSTER_NAME),
-            nodegroupName=params.get(NODEGROUP_NAME),
-            WaiterConfig={
-                'Delay': 30,
-                'MaxAttempts': 40
-            }
-        )
+        try:
+            return self.client.describe_nodegroup(
+                **{CLUSTER_NAME: cluster_name,
+                   NODEGROUP_NAME: nodegroup_name})[NODEGROUP]
+        except ClientError as error:
+            if _is_not_found(error):
+                return None
+            raise
 
     def delete(self, params=None):
         """
@@ -97,10 +108,15 @@ class EKSNodeGroup(EKSBase):
         return res
 
 
+def _is_not_found(error):
+    return isinstance(error, ClientError) and \
+        error.response.get('Error', dict()).get('Code') == NOT_FOUND
+
+
 def prepare_describe_node_group_filter(params, iface):
     iface.describe_param = {
         CLUSTER_NAME: params.get(CLUSTER_NAME),
-        NODEGROUP_NAME: params.get(NODEGROUP_NAME),
+        NODEGROUP_NAME: params.get(NODEGROUP_NAME) or iface.resource_id,
     }
     return iface
 
@@ -116,31 +132,203 @@ def prepare(ctx, resource_config, **_):
 def create(ctx, iface, resource_config, **_):
     """Creates an AWS EKS Node Group"""
     params = dict() if not resource_config else resource_config.copy()
-    resource_id = \
-        utils.get_resource_id(
-            ctx.node,
-            ctx.instance,
-            params.get(NODEGROUP_NAME),
-            use_instance_id=True
-        )
-
-    utils.update_resource_id(ctx.instance, resource_id)
-    iface = prepare_describe_node_group_filter(resource_config.copy(), iface)
-    response = iface.create(params)
-    if response and response.get(NODEGROUP):
-        resource_arn = response.get(NODEGROUP).get(NODEGROUP_ARN)
-        utils.update_resource_arn(ctx.instance, resource_arn)
-    # wait for nodegroup to be active
-    ctx.logger.info("Waiting for NodeGroup to become Active")
-    iface.wait_for_nodegroup(params, 'nodegroup_active')
+    if ctx.operation.retry_number == 0:
+        resource_id = \
+            utils.get_resource_id(
+                ctx.node,
+                ctx.instance,
+                params.get(NODEGROUP_NAME),
+                use_instance_id=True
+            )
+        utils.update_resource_id(ctx.instance, resource_id)
+        iface.resource_id = resource_id
+        response = iface.create(params)
+        if response and response.get(NODEGROUP):
+            resource_arn = response.get(NODEGROUP).get(NODEGROUP_ARN)
+            utils.update_resource_arn(ctx.instance, resource_arn)
+        ctx.logger.info("Waiting for NodeGroup to become Active")
+    # Poll in later retries instead of blocking the operation
+    iface = prepare_describe_node_group_filter(params, iface)
+    iface.check_status(ctx.operation.retry_number,
+                       STATUS_ACTIVE, STATUS_CREATING)
 
 
 @decorators.aws_resource(EKSNodeGroup, RESOURCE_TYPE)
 def delete(ctx, iface, resource_config, **_):
     """Deletes an AWS EKS Node Group"""
-
     params = dict() if not resource_config else resource_config.copy()
-    iface.delete(params)
-    # wait for nodegroup to be deleted
-    ctx.logger.info("Waiting for NodeGroup to be deleted")
-    iface.wait_for_nodegroup(params, 'nodegroup_deleted')
+    iface = prepare_describe_node_group_filter(params, iface)
+    if not ctx.instance.runtime_properties.get('__deleted'):
+        params.update(iface.describe_param)
+        iface.delete(params)
+        ctx.instance.runtime_properties['__deleted'] = True
+        ctx.logger.info("Waiting for NodeGroup to be deleted")
+    iface.check_status(ctx.operation.retry_number,
+                       [], STATUS_DELETING, fail_on_missing=False)
+
+
+def _get_cluster_name(ctx, params):
+    cluster_name = params.get(CLUSTER_NAME)
+    if not cluster_name:
+        rel = utils.find_rel_by_node_type(ctx.instance, CLUSTER_TYPE)
+        if rel:
+            cluster_name = utils.get_resource_id(
+                node=rel.target.node,
+                instance=rel.target.instance,
+                raise_on_missing=True)
+    if not cluster_name:
+        raise NonRecoverableError(
+            '{0} is not set and no {1} is connected.'.format(
+                CLUSTER_NAME, CLUSTER_TYPE))
+    return cluster_name
+
+
+def _describe_node_groups(iface, cluster_name, names, max_workers):
+    """Describes Node Groups of a cluster concurrently"""
+    return utils.run_in_parallel(
+        lambda name: iface.describe(cluster_name, name), names, max_workers)
+
+
+def _get_health_issues(nodegroup):
+    issues = (nodegroup.get('health') or dict()).get('issues') or []
+    return '; '.join('{0}: {1}'.format(issue.get('code'),
+                                       issue.get('message'))
+                     for issue in issues)
+
+
+@decorators.aws_resource(EKSNodeGroup, RESOURCE_TYPE)
+def create_node_groups(ctx, iface, resource_config, **_):
+    """
+    Creates all Node Groups of an AWS EKS Cluster concurrently and waits for
+    all of them with one batched describe per retry.
+    :param ctx:
+    :param iface:
+    :param resource_config:
+    :param _:
+    """
+    params = utils.clean_params(
+        dict() if not resource_config else resource_config.copy())
+    cluster_name = _get_cluster_name(ctx, params)
+    max_workers = \
+        ctx.node.properties.get('max_workers') or constants.DEFAULT_MAX_WORKERS
+    statuses = ctx.instance.runtime_properties.get('nodegroups') or dict()
+    errors = ctx.instance.runtime_properties.get('nodegroup_errors') or dict()
+
+    missing = [dict(group, **{CLUSTER_NAME: cluster_name})
+               for group in params.get(NODEGROUPS) or []
+               if group[NODEGROUP_NAME] not in statuses]
+    retrying = dict()
+    if missing:
+        ctx.logger.info('Creating {0} {1}s of {2}.'.format(
+            len(missing), RESOURCE_TYPE, cluster_name))
+        # Only parameter validation errors are fatal, API errors are
+        # reraised as ClientError so that transient ones can be told apart.
+        create = partial(iface.create,
+                         fatal_handled_exceptions=ParamValidationError)
+        for group, res, error in utils.run_in_parallel(
+                create, missing, max_workers):
+            name = group[NODEGROUP_NAME]
+            if error and utils.is_retryable_error(error):
+                # Left out of the statuses, so it is created on a retry
+                retrying[name] = str(error)
+            elif error:
+                statuses[name] = 'CREATE_FAILED'
+                errors[name] = str(error)
+            else:
+                statuses[name] = res[NODEGROUP]['status']
+
+    pending = [name for name, status in statuses.items()
+               if status in STATUS_CREATING]
+    for name, nodegroup, error in _describe_node_groups(
+            iface, cluster_name, pending, max_workers):
+        if error:
+            # Keep polling the group on the next retry
+            ctx.logger.warn('Failed to describe {0} {1}: {2}'.format(
+                RESOURCE_TYPE, name, error))
+        elif not nodegroup:
+            statuses[name] = 'CREATE_FAILED'
+            errors[name] = 'No longer exists.'
+        else:
+            statuses[name] = nodegroup['status']
+            if nodegroup['status'] in STATUS_FAILED:
+                errors[name] = _get_health_issues(nodegroup)
+    ctx.instance.runtime_properties['nodegroups'] = statuses
+    ctx.instance.runtime_properties['nodegroup_errors'] = errors
+    ctx.logger.debug('{0} statuses: {1}'.format(RESOURCE_TYPE, statuses))
+
+    pending = [name for name, status in statuses.items()
+               if status in STATUS_CREATING]
+    if pending or retrying:
+        raise OperationRetry(
+            'Waiting for {0} of {1} {2}s to become active{3}.'.format(
+                len(pending) + len(retrying), len(statuses) + len(retrying),
+                RESOURCE_TYPE,
+                ', retrying: {0}'.format(retrying) if retrying else ''),
+            retry_after=utils.get_retry_interval(
+                ctx.operation.retry_number, initial=15, maximum=60))
+    if errors:
+        raise NonRecoverableError(
+            '{0} of {1} {2}s failed: {3}'.format(
+                len(errors), len(statuses), RESOURCE_TYPE, errors))
+
+
+@decorators.aws_resource(EKSNodeGroup, RESOURCE_TYPE)
+def delete_node_groups(ctx, iface, resource_config, **_):
+    """
+    Deletes all Node Groups of an AWS EKS Cluster concurrently and waits for
+    all of them with one batched describe per retry.
+    :param ctx:
+    :param iface:
+    :param resource_config:
+    :param _:
+    """
+    params = utils.clean_params(
+        dict() if not resource_config else resource_config.copy())
+    cluster_name = _get_cluster_name(ctx, params)
+    max_workers = \
+        ctx.node.properties.get('max_workers') or constants.DEFAULT_MAX_WORKERS
+    statuses = ctx.instance.runtime_properties.get('nodegroups') or dict()
+
+    undeleted = [dict(**{CLUSTER_NAME: cluster_name, NODEGROUP_NAME: name})
+                 for name, status in statuses.items()
+                 if status not in STATUS_DELETING]
+    errors = dict()
+    for group, res, error in utils.run_in_parallel(
+            iface.delete, undeleted, max_workers):
+        name = group[NODEGROUP_NAME]
+        if not error:
+            statuses[name] = STATUS_DELETING[0]
+        elif _is_not_found(error):
+            del statuses[name]
+        else:
+            errors[name] = str(error)
+
+    deleting = [name for name, status in statuses.items()
+                if status in STATUS_DELETING]
+    failed = dict()
+    for name, nodegroup, error in _describe_node_groups(
+            iface, cluster_name, deleting, max_workers):
+        if error:
+            ctx.logger.warn('Failed to describe {0} {1}: {2}'.format(
+                RESOURCE_TYPE, name, error))
+        elif not nodegroup:
+            del statuses[name]
+        elif nodegroup['status'] in STATUS_FAILED:
+            statuses[name] = nodegroup['status']
+            failed[name] = _get_health_issues(nodegroup)
+    ctx.instance.runtime_properties['nodegroups'] = statuses
+    ctx.logger.debug('{0} statuses: {1}'.format(RESOURCE_TYPE, statuses))
+
+    # Failed deletions do not recover by waiting
+    if statuses and set(statuses) == set(failed):
+        raise NonRecoverableError(
+            'Failed to delete {0} {1}s: {2}'.format(
+                len(failed), RESOURCE_TYPE, failed))
+    errors.update(failed)
+    if statuses:
+        raise OperationRetry(
+            'Waiting for {0} {1}s to be deleted{2}.'.format(
+                len(statuses), RESOURCE_TYPE,
+                ', failures: {0}'.format(errors) if errors else ''),
+            retry_after=utils.get_retry_interval(
+                ctx.operation.retry_number, initial=15, maximum=60))
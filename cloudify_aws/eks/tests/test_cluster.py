@@ -18,6 +18,8 @@ import unittest
 # Third party imports
 from mock import patch, MagicMock
 
+from cloudify.exceptions import OperationRetry, NonRecoverableError
+
 # Local imports
 from cloudify_aws.common._compat import reload_module
 from cloudify_aws.common.tests.test_base import (
@@ -28,6 +30,8 @@ from cloudify_aws.eks.resources.cluster import EKSCluster
 from cloudify_aws.eks.resources import cluster
 from cloudify_aws.common import constants
 
+PATCH_PREFIX = 'cloudify_aws.eks.resources.cluster.'
+
 
 class TestEKSCluster(TestBase):
 
@@ -161,6 +165,127 @@ class TestEKSCluster(TestBase):
         cluster.delete(ctx, iface, {})
         self.assertTrue(iface.delete.called)
 
+    def test_create_pending(self):
+        ctx = self.get_mock_ctx("Cluster")
+        ctx.node.properties['store_kube_config_in_runtime'] = True
+        iface = EKSCluster("ctx_node", client=MagicMock(), logger=MagicMock())
+        iface.client.create_cluster.return_value = {
+            cluster.CLUSTER: {'arn': 'test_cluster_arn'}}
+        iface.client.describe_cluster.return_value = {
+            cluster.CLUSTER: {'status': 'CREATING'}}
+        config = {cluster.CLUSTER_NAME: 'test_cluster_name'}
+        with self.assertRaises(OperationRetry) as error:
+            cluster.create(ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(error.exception.retry_after, 15)
+        iface.client.describe_cluster.assert_called_with(
+            name='test_cluster_name')
+        self.assertNotIn('kubeconf', ctx.instance.runtime_properties)
+
+    def test_create_active_on_retry(self):
+        ctx = self.get_mock_ctx("Cluster")
+        ctx.operation._operation_context['retry_number'] = 3
+        ctx.node.properties['store_kube_config_in_runtime'] = True
+        ctx.node.properties['client_config'] = {}
+        iface = EKSCluster("ctx_node", resource_id='test_cluster_name',
+                           client=MagicMock(), logger=MagicMock())
+        iface.client.describe_cluster.return_value = {
+            cluster.CLUSTER: {'status': 'ACTIVE'}}
+        kubeconf = {'kind': 'Config', 'users': [{'user': {'token': 'old'}}]}
+        with patch.object(EKSCluster, 'get_kubeconf', return_value=kubeconf), \
+                patch.object(EKSCluster, 'get_token',
+                             return_value=('token', 100)):
+            cluster.create(ctx=ctx, iface=iface, resource_config={})
+        self.assertFalse(iface.client.create_cluster.called)
+        self.assertEqual(
+            ctx.instance.runtime_properties['kubeconf']['users'][0],
+            {'user': {'token': 'token'}})
+        self.assertEqual(ctx.instance.runtime_properties['token'], 'token')
+        self.assertEqual(
+            ctx.instance.runtime_properties['token_expiration'], 100)
+
+    def test_create_failed(self):
+        ctx = self.get_mock_ctx("Cluster")
+        ctx.operation._operation_context['retry_number'] = 1
+        iface = EKSCluster("ctx_node", resource_id='test_cluster_name',
+                           client=MagicMock(), logger=MagicMock())
+        iface.client.describe_cluster.return_value = {
+            cluster.CLUSTER: {'status': 'FAILED'}}
+        with self.assertRaises(NonRecoverableError):
+            cluster.create(ctx=ctx, iface=iface, resource_config={})
+
+    def test_delete_pending(self):
+        ctx = self.get_mock_ctx("Cluster")
+        iface = EKSCluster("ctx_node", resource_id='test_cluster_name',
+                           client=MagicMock(), logger=MagicMock())
+        iface.client.describe_cluster.return_value = {
+            cluster.CLUSTER: {'status': 'DELETING'}}
+        with self.assertRaises(OperationRetry):
+            cluster.delete(ctx=ctx, iface=iface, resource_config={})
+        iface.client.delete_cluster.assert_called_once_with(
+            name='test_cluster_name')
+        # The retry only polls until the cluster is gone
+        ctx.operation._operation_context['retry_number'] = 1
+        iface.client.describe_cluster.side_effect = \
+            self.get_client_error_exception(name=cluster.RESOURCE_TYPE)
+        cluster.delete(ctx=ctx, iface=iface, resource_config={})
+        self.assertEqual(iface.client.delete_cluster.call_count, 1)
+
+    def test_get_sts_client(self):
+        with patch(PATCH_PREFIX + 'boto3') as boto3:
+            boto3.client.side_effect = lambda *args, **kwargs: MagicMock()
+            first = cluster.get_sts_client({'region_name': 'us-east-1'})
+            self.assertIs(
+                cluster.get_sts_client({'region_name': 'us-east-1'}), first)
+            self.assertIsNot(
+                cluster.get_sts_client({'region_name': 'eu-west-1'}), first)
+        self.assertEqual(boto3.client.call_count, 2)
+        self.assertEqual(first.meta.events.register.call_count, 2)
+
+    def test_class_get_token(self):
+        self.cluster.resource_id = 'test_cluster_name'
+        cluster._tokens.clear()
+        self.addCleanup(cluster._tokens.clear)
+        with patch(PATCH_PREFIX + 'get_sts_client') as sts, \
+                patch(PATCH_PREFIX + 'time') as mock_time:
+            mock_time.time.return_value = 1000
+            sts().generate_presigned_url.return_value = 'https://sts/'
+            token, expiration = self.cluster.get_token({})
+            self.assertTrue(token.startswith(cluster.TOKEN_PREFIX))
+            self.assertEqual(expiration, 1000 + cluster.TOKEN_LIFETIME)
+            sts().generate_presigned_url.assert_called_once_with(
+                'get_caller_identity',
+                {'ClusterName': 'test_cluster_name'},
+                HttpMethod='GET',
+                ExpiresIn=cluster.TOKEN_EXPIRATION_MINS)
+            # Cached until close to expiry
+            mock_time.time.return_value = 1000 + cluster.TOKEN_LIFETIME - \
+                cluster.TOKEN_REFRESH_MARGIN
+            self.assertEqual(self.cluster.get_token({}), (token, expiration))
+            self.assertEqual(sts().generate_presigned_url.call_count, 1)
+            mock_time.time.return_value += 1
+            self.cluster.get_token({})
+            self.assertEqual(sts().generate_presigned_url.call_count, 2)
+            # Tokens are cached per cluster
+            self.cluster.get_token({}, cluster_name='other')
+            self.assertEqual(sts().generate_presigned_url.call_count, 3)
+
+    def test_refresh_token(self):
+        ctx = self.get_mock_ctx("Cluster")
+        ctx.node.properties['client_config'] = {}
+        iface = MagicMock()
+        iface.get_token.return_value = ('token', 2000)
+        with patch(PATCH_PREFIX + 'time') as mock_time:
+            mock_time.time.return_value = 1000
+            cluster.refresh_token(ctx=ctx, iface=iface)
+            self.assertEqual(ctx.instance.runtime_properties['token'],
+                             'token')
+            # A valid token does not need any call
+            cluster.refresh_token(ctx=ctx, iface=iface)
+            self.assertEqual(iface.get_token.call_count, 1)
+            mock_time.time.return_value = 1800
+            cluster.refresh_token(ctx=ctx, iface=iface)
+            self.assertEqual(iface.get_token.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
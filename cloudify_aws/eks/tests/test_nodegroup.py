@@ -18,6 +18,9 @@ import unittest
 # Third party imports
 from mock import patch, MagicMock
 
+from botocore.exceptions import ClientError
+from cloudify.exceptions import OperationRetry, NonRecoverableError
+
 # Local imports
 from cloudify_aws.common._compat import reload_module
 from cloudify_aws.common.tests.test_base import (
@@ -182,6 +185,178 @@ class TestEKSNodeGroup(TestBase):
         node_group.delete(ctx, iface, {})
         self.assertTrue(iface.delete.called)
 
+    def test_create_pending(self):
+        ctx = self.get_mock_ctx("NodeGroup")
+        ctx.operation._operation_context['retry_number'] = 4
+        iface = EKSNodeGroup("ctx_node", resource_id='test_node_group_name',
+                             client=MagicMock(), logger=MagicMock())
+        iface.client.describe_nodegroup.return_value = {
+            node_group.NODEGROUP: {'status': 'CREATING'}}
+        config = {node_group.CLUSTER_NAME: 'test_cluster_name'}
+        with self.assertRaises(OperationRetry) as error:
+            node_group.create(ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(error.exception.retry_after, 60)
+        self.assertFalse(iface.client.create_nodegroup.called)
+        iface.client.describe_nodegroup.assert_called_once_with(
+            clusterName='test_cluster_name',
+            nodegroupName='test_node_group_name')
+
+    def test_delete_deleted(self):
+        ctx = self.get_mock_ctx("NodeGroup")
+        iface = EKSNodeGroup("ctx_node", resource_id='test_node_group_name',
+                             client=MagicMock(), logger=MagicMock())
+        iface.client.describe_nodegroup.side_effect = \
+            self.get_client_error_exception(name=node_group.RESOURCE_TYPE)
+        config = {node_group.CLUSTER_NAME: 'test_cluster_name'}
+        node_group.delete(ctx=ctx, iface=iface, resource_config=config)
+        iface.client.delete_nodegroup.assert_called_once_with(
+            clusterName='test_cluster_name',
+            nodegroupName='test_node_group_name')
+
+    def _nodegroups_iface(self, statuses):
+        iface = EKSNodeGroup("ctx_node", client=MagicMock(),
+                             logger=MagicMock())
+
+        def describe_nodegroup(clusterName, nodegroupName):
+            status = statuses.get(nodegroupName)
+            if not status:
+                raise ClientError(
+                    {'Error': {'Code': node_group.NOT_FOUND}},
+                    'DescribeNodegroup')
+            return {node_group.NODEGROUP: {
+                'status': status,
+                'health': {'issues': [{'code': 'Ec2LaunchTemplateNotFound',
+                                       'message': 'missing'}]}}}
+        iface.client.describe_nodegroup.side_effect = describe_nodegroup
+        iface.client.create_nodegroup.side_effect = \
+            lambda **params: {node_group.NODEGROUP: {'status': 'CREATING'}}
+        return iface
+
+    def test_create_node_groups(self):
+        ctx = self.get_mock_ctx("NodeGroups")
+        statuses = {'gpu': 'CREATING', 'spot': 'CREATING'}
+        iface = self._nodegroups_iface(statuses)
+        config = {
+            node_group.CLUSTER_NAME: 'test_cluster_name',
+            node_group.NODEGROUPS: [{node_group.NODEGROUP_NAME: 'gpu'},
+                                    {node_group.NODEGROUP_NAME: 'spot'}]}
+        with self.assertRaises(OperationRetry):
+            node_group.create_node_groups(
+                ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(iface.client.create_nodegroup.call_count, 2)
+        iface.client.create_nodegroup.assert_any_call(
+            clusterName='test_cluster_name', nodegroupName='spot')
+
+        # Groups are not created again, and fail independently
+        statuses.update(gpu='ACTIVE', spot='CREATE_FAILED')
+        with self.assertRaises(NonRecoverableError) as error:
+            node_group.create_node_groups(
+                ctx=ctx, iface=iface, resource_config=config)
+        self.assertIn('Ec2LaunchTemplateNotFound', str(error.exception))
+        self.assertEqual(iface.client.create_nodegroup.call_count, 2)
+        self.assertEqual(
+            ctx.instance.runtime_properties['nodegroups'],
+            {'gpu': 'ACTIVE', 'spot': 'CREATE_FAILED'})
+        self.assertEqual(
+            list(ctx.instance.runtime_properties['nodegroup_errors']),
+            ['spot'])
+
+    def test_create_node_groups_retryable(self):
+        ctx = self.get_mock_ctx("NodeGroups")
+        statuses = {'gpu': 'CREATING'}
+        iface = self._nodegroups_iface(statuses)
+
+        def create_nodegroup(**params):
+            if params['nodegroupName'] == 'spot':
+                raise ClientError(
+                    {'Error': {'Code': 'ThrottlingException'}},
+                    'CreateNodegroup')
+            if params['nodegroupName'] == 'bad':
+                raise ClientError(
+                    {'Error': {'Code': 'InvalidParameterException'}},
+                    'CreateNodegroup')
+            return {node_group.NODEGROUP: {'status': 'CREATING'}}
+        iface.client.create_nodegroup.side_effect = create_nodegroup
+        config = {
+            node_group.CLUSTER_NAME: 'test_cluster_name',
+            node_group.NODEGROUPS: [{node_group.NODEGROUP_NAME: 'gpu'},
+                                    {node_group.NODEGROUP_NAME: 'spot'},
+                                    {node_group.NODEGROUP_NAME: 'bad'}]}
+        with self.assertRaises(OperationRetry):
+            node_group.create_node_groups(
+                ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(ctx.instance.runtime_properties['nodegroups'],
+                         {'gpu': 'CREATING', 'bad': 'CREATE_FAILED'})
+
+        # Only the throttled group is created again
+        statuses.update(gpu='ACTIVE', spot='ACTIVE')
+        iface.client.create_nodegroup.side_effect = \
+            lambda **params: {node_group.NODEGROUP: {'status': 'CREATING'}}
+        with self.assertRaises(NonRecoverableError) as error:
+            node_group.create_node_groups(
+                ctx=ctx, iface=iface, resource_config=config)
+        self.assertIn('InvalidParameterException', str(error.exception))
+        self.assertEqual(iface.client.create_nodegroup.call_count, 4)
+        iface.client.create_nodegroup.assert_called_with(
+            clusterName='test_cluster_name', nodegroupName='spot')
+        self.assertEqual(
+            ctx.instance.runtime_properties['nodegroups'],
+            {'gpu': 'ACTIVE', 'spot': 'ACTIVE', 'bad': 'CREATE_FAILED'})
+
+    def test_create_node_groups_active(self):
+        ctx = self.get_mock_ctx("NodeGroups")
+        iface = self._nodegroups_iface({'gpu': 'ACTIVE'})
+        config = {
+            node_group.CLUSTER_NAME: 'test_cluster_name',
+            node_group.NODEGROUPS: [{node_group.NODEGROUP_NAME: 'gpu'}]}
+        # Polled in the same call as the create
+        node_group.create_node_groups(
+            ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(ctx.instance.runtime_properties['nodegroups'],
+                         {'gpu': 'ACTIVE'})
+
+    def test_delete_node_groups(self):
+        ctx = self.get_mock_ctx("NodeGroups", test_runtime_properties={
+            'nodegroups': {'gpu': 'ACTIVE', 'spot': 'CREATE_FAILED',
+                           'gone': 'CREATE_FAILED'}})
+        statuses = {'gpu': 'DELETING', 'spot': 'DELETING'}
+        iface = self._nodegroups_iface(statuses)
+        iface.client.delete_nodegroup.side_effect = \
+            lambda **params: statuses.get(params['nodegroupName']) or \
+            iface.client.describe_nodegroup(**params)
+        config = {node_group.CLUSTER_NAME: 'test_cluster_name'}
+        with self.assertRaises(OperationRetry):
+            node_group.delete_node_groups(
+                ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(iface.client.delete_nodegroup.call_count, 3)
+        self.assertEqual(ctx.instance.runtime_properties['nodegroups'],
+                         {'gpu': 'DELETING', 'spot': 'DELETING'})
+
+        statuses.clear()
+        node_group.delete_node_groups(
+            ctx=ctx, iface=iface, resource_config=config)
+        self.assertEqual(iface.client.delete_nodegroup.call_count, 3)
+        self.assertEqual(ctx.instance.runtime_properties['nodegroups'], {})
+
+    def test_delete_node_groups_failed(self):
+        ctx = self.get_mock_ctx("NodeGroups", test_runtime_properties={
+            'nodegroups': {'gpu': 'ACTIVE', 'spot': 'ACTIVE'}})
+        statuses = {'gpu': 'DELETING', 'spot': 'DELETE_FAILED'}
+        iface = self._nodegroups_iface(statuses)
+        config = {node_group.CLUSTER_NAME: 'test_cluster_name'}
+        with self.assertRaises(OperationRetry):
+            node_group.delete_node_groups(
+                ctx=ctx, iface=iface, resource_config=config)
+
+        # Only failed groups are left
+        statuses.pop('gpu')
+        with self.assertRaises(NonRecoverableError) as error:
+            node_group.delete_node_groups(
+                ctx=ctx, iface=iface, resource_config=config)
+        self.assertIn('Ec2LaunchTemplateNotFound', str(error.exception))
+        self.assertEqual(ctx.instance.runtime_properties['nodegroups'],
+                         {'spot': 'DELETE_FAILED'})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -17,14 +17,21 @@
     AWS Lambda Function interface
 '''
 import json
+import time
+import base64
+import binascii
+import hashlib
 
 from contextlib import contextmanager
 from os import remove as os_remove
 from os.path import exists as path_exists
 # Cloudify
-from cloudify_aws.common import decorators, utils
+from cloudify.exceptions import NonRecoverableError
+from cloudify_aws.common import constants, decorators, utils
+from cloudify_aws.common.connection import Boto3Connection
 from cloudify_aws.lambda_serverless import LambdaBase
 # Boto
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
 RESOURCE_ID = 'FunctionName'
@@ -33,6 +40,15 @@ SUBNET_TYPE = 'cloudify.nodes.aws.ec2.Subnet'
 SUBNET_TYPE_DEPRECATED = 'cloudify.aws.nodes.Subnet'
 SECGROUP_TYPE = 'cloudify.nodes.aws.ec2.SecurityGroup'
 SECGROUP_TYPE_DEPRECATED = 'cloudify.aws.nodes.SecurityGroup'
+CODE_SHA256 = 'CodeSha256'
+RESOURCE_TYPE_CONCURRENCY = 'Lambda Provisioned Concurrency'
+CODE_CHUNK_SIZE = 8 * 1024 * 1024
+CODE_STAGING_DEFAULTS = {
+    'bucket': '',
+    'prefix': 'lambda/',
+    # Packages up to this size are sent inline in the API call
+    'inline_max_size': 50 * 1024 * 1024,
+}
 
 
 class LambdaFunction(LambdaBase):
@@ -84,6 +100,45 @@ class LambdaFunction(LambdaBase):
                           % (self.type_name, params))
         self.client.delete_function(**params)
 
+    def update_code(self, params):
+        '''
+            Updates the code of an AWS Lambda Function.
+        '''
+        params = dict(params, FunctionName=self.resource_id)
+        return self.make_client_call('update_function_code', params,
+                                     log_response=False)
+
+    def publish_version(self, params=None):
+        '''
+            Publishes a version of an AWS Lambda Function.
+        '''
+        params = dict(params or dict(), FunctionName=self.resource_id)
+        return self.make_client_call('publish_version', params)
+
+    def get_alias(self, name):
+        '''
+            Gets an alias of an AWS Lambda Function.
+        '''
+        try:
+            return self.client.get_alias(FunctionName=self.resource_id,
+                                         Name=name)
+        except ClientError:
+            return None
+
+    def create_alias(self, params):
+        '''
+            Creates an alias of an AWS Lambda Function.
+        '''
+        params = dict(params, FunctionName=self.resource_id)
+        return self.make_client_call('create_alias', params)
+
+    def update_alias(self, params):
+        '''
+            Updates an alias of an AWS Lambda Function.
+        '''
+        params = dict(params, FunctionName=self.resource_id)
+        return self.make_client_call('update_alias', params)
+
     def invoke(self, params):
         '''
             Invokes an AWS Lambda Function.
@@ -103,6 +158,58 @@ class LambdaFunction(LambdaBase):
         self.logger.debug('Response: %s' % res)
         return res
 
+    def invoke_batch(self,
+                     payloads,
+                     results_path,
+                     invocation_type='RequestResponse',
+                     max_workers=constants.DEFAULT_MAX_WORKERS):
+        '''
+            Invokes an AWS Lambda Function once per payload on a bounded
+            pool of threads. Results are written as JSON lines to
+            results_path, with response payloads left as undecoded text.
+        :return: summary of counts, throughput and latency percentiles
+        '''
+        def _invoke(item):
+            started = time.time()
+            res = self.client.invoke(FunctionName=self.resource_id,
+                                     InvocationType=invocation_type,
+                                     Payload=json.dumps(item[1]))
+            latency = time.time() - started
+            payload = res.get('Payload')
+            if payload is not None:
+                payload = payload.read()
+                if isinstance(payload, bytes):
+                    payload = payload.decode(self.resource_encoding,
+                                             'replace')
+            return dict(StatusCode=res.get('StatusCode'),
+                        FunctionError=res.get('FunctionError'),
+                        Payload=payload), latency
+
+        self.logger.debug('Invoking %s in batch with invocation type %s'
+                          % (self.type_name, invocation_type))
+        invocations = errors = 0
+        latencies = []
+        started = time.time()
+        with open(results_path, 'w') as results_file:
+            for (index, _), res, error in utils.iter_in_parallel(
+                    _invoke, enumerate(payloads), max_workers):
+                invocations += 1
+                if error:
+                    errors += 1
+                    record = dict(error=str(error))
+                else:
+                    record, latency = res
+                    latencies.append(latency)
+                    if record['FunctionError']:
+                        errors += 1
+                record['index'] = index
+                results_file.write(json.dumps(record) + '\n')
+        return dict(
+            invocations=invocations,
+            errors=errors,
+            results_file=results_path,
+            **utils.get_throughput_summary(invocations, started, latencies))
+
     @contextmanager
     def _encode_payload(self, payload):
         if isinstance(payload, str):
@@ -129,6 +236,136 @@ class LambdaFunction(LambdaBase):
         return payload
 
 
+class LambdaProvisionedConcurrency(LambdaBase):
+    '''
+        AWS Lambda Provisioned Concurrency interface, of a function
+        version or alias
+    '''
+    def __init__(self,
+                 ctx_node,
+                 resource_id=None,
+                 client=None,
+                 logger=None,
+                 qualifier=None):
+        LambdaBase.__init__(self, ctx_node, resource_id, client, logger)
+        self.type_name = RESOURCE_TYPE_CONCURRENCY
+        self.qualifier = qualifier
+
+    @property
+    def properties(self):
+        '''Gets the properties of an external resource'''
+        try:
+            return self.client.get_provisioned_concurrency_config(
+                FunctionName=self.resource_id, Qualifier=self.qualifier)
+        except ClientError:
+            return None
+
+    @property
+    def status(self):
+        '''Gets the status of an external resource'''
+        props = self.properties
+        if not props:
+            return None
+        return props.get('Status')
+
+    def create(self, params):
+        '''
+            Puts the provisioned concurrency configuration.
+        '''
+        params = dict(params, FunctionName=self.resource_id,
+                      Qualifier=self.qualifier)
+        return self.make_client_call('put_provisioned_concurrency_config',
+                                     params)
+
+    def delete(self, params=None):
+        '''
+            Deletes the provisioned concurrency configuration.
+        '''
+        params = dict(FunctionName=self.resource_id, Qualifier=self.qualifier)
+        self.logger.debug('Deleting %s with parameters: %s'
+                          % (self.type_name, params))
+        self.client.delete_provisioned_concurrency_config(**params)
+
+
+def get_code_sha256(path):
+    '''
+        Hashes a code package in one streaming pass.
+    :return: the base64 encoded SHA-256, as Lambda reports CodeSha256, and
+        the size of the package
+    '''
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, mode='rb') as _file:
+        for chunk in iter(lambda: _file.read(CODE_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return base64.b64encode(digest.digest()).decode('ascii'), size
+
+
+def stage_code(ctx, path, code_sha256, config):
+    '''
+        Uploads a code package to the staging bucket with a multipart
+        upload, unless an object with the same hash is already there.
+    :return: the S3 location as Code parameters
+    '''
+    bucket = config['bucket']
+    key = '{0}{1}.zip'.format(
+        config['prefix'],
+        binascii.hexlify(
+            base64.b64decode(code_sha256.encode('ascii'))).decode('ascii'))
+    client = Boto3Connection(ctx.node).client('s3')
+    try:
+        staged = client.head_object(Bucket=bucket, Key=key).get(
+            'Metadata', dict()).get('sha256') == code_sha256
+    except ClientError as e:
+        if e.response['Error'].get('Code') not in ['404', 'NoSuchKey']:
+            raise
+        staged = False
+    if not staged:
+        ctx.logger.info('Staging code to s3://{0}/{1}.'.format(bucket, key))
+        client.upload_file(
+            path, bucket, key,
+            ExtraArgs={'Metadata': {'sha256': code_sha256}},
+            Config=TransferConfig(
+                multipart_threshold=CODE_CHUNK_SIZE,
+                multipart_chunksize=CODE_CHUNK_SIZE,
+                max_concurrency=constants.DEFAULT_MAX_WORKERS))
+    return dict(S3Bucket=bucket, S3Key=key)
+
+
+def deploy_code(ctx, iface, code, skip_unchanged=False):
+    '''
+        Prepares the Code parameters of a function from its ZIP package.
+        Large packages are staged to S3 when code_staging sets a bucket.
+    :param skip_unchanged: compare the package with the CodeSha256 of the
+        deployed function
+    :return: the Code parameters, or None when the deployed code already
+        matches the package, and the properties of the deployed function
+    '''
+    codezip = code['ZipFile']
+    downloaded = not path_exists(codezip)
+    if downloaded:
+        codezip = ctx.download_resource(codezip)
+        ctx.logger.debug('Downloaded resource: "%s"' % codezip)
+    try:
+        code_sha256, size = get_code_sha256(codezip)
+        current = iface.properties if skip_unchanged else None
+        if current and current.get(CODE_SHA256) == code_sha256:
+            ctx.logger.info('%s code is unchanged (%s), skipping upload.'
+                            % (RESOURCE_TYPE, code_sha256))
+            return None, current
+        config = CODE_STAGING_DEFAULTS.copy()
+        config.update(ctx.node.properties.get('code_staging') or dict())
+        if config['bucket'] and size > config['inline_max_size']:
+            return stage_code(ctx, codezip, code_sha256, config), current
+        with open(codezip, mode='rb') as _file:
+            return dict(ZipFile=_file.read()), current
+    finally:
+        if downloaded:
+            ctx.logger.debug('Deleting resource: "%s"' % codezip)
+            os_remove(codezip)
+
+
 def _get_subnets_to_attach(ctx, vpc_config):
     # Attach a Subnet Group if it exists
     subnet_ids = vpc_config.get('SubnetIds', list())
@@ -205,18 +442,7 @@ def create(ctx, iface, resource_config, **_):
 
     # Handle user-profided code ZIP file
     if params.get('Code', dict()).get('ZipFile'):
-        codezip = params['Code']['ZipFile']
-        ctx.logger.debug('ZipFile: "%s" (%s)' % (codezip, type(codezip)))
-        if not path_exists(codezip):
-            codezip = ctx.download_resource(codezip)
-            ctx.logger.debug('Downloaded resource: "%s"' % codezip)
-            with open(codezip, mode='rb') as _file:
-                params['Code']['ZipFile'] = _file.read()
-            ctx.logger.debug('Deleting resource: "%s"' % codezip)
-            os_remove(codezip)
-        else:
-            with open(codezip, mode='rb') as _file:
-                params['Code']['ZipFile'] = _file.read()
+        params['Code'] = deploy_code(ctx, iface, params['Code'])[0]
     # Actually create the resource
     create_response = iface.create(params)
     resource_id = create_response['FunctionName']
@@ -237,3 +463,91 @@ def create(ctx, iface, resource_config, **_):
 def delete(iface, resource_config, **_):
     '''Deletes an AWS Lambda Function'''
     iface.delete(resource_config)
+
+
+@decorators.aws_resource(LambdaFunction, RESOURCE_TYPE)
+def update_code(ctx, iface, resource_config, **_):
+    '''Updates the code of an AWS Lambda Function when it changed'''
+    code = (resource_config or dict()).get('Code') or dict()
+    if not code.get('ZipFile'):
+        return
+    code = deploy_code(ctx, iface, code, skip_unchanged=True)[0]
+    if code:
+        iface.update_code(code)
+
+
+@decorators.aws_resource(LambdaFunction, RESOURCE_TYPE,
+                         ignore_properties=True)
+def publish_version(ctx, iface, description=None, **_):
+    '''Publishes a version of an AWS Lambda Function'''
+    params = utils.clean_params(dict(Description=description))
+    version = iface.publish_version(params)['Version']
+    ctx.logger.info('Published version %s of %s ID# "%s".'
+                    % (version, RESOURCE_TYPE, iface.resource_id))
+    ctx.instance.runtime_properties['version'] = version
+
+
+@decorators.aws_resource(LambdaFunction, RESOURCE_TYPE,
+                         ignore_properties=True)
+def configure_alias(ctx,
+                    iface,
+                    name,
+                    function_version=None,
+                    routing_weights=None,
+                    description=None,
+                    **_):
+    '''
+        Creates or updates an alias of an AWS Lambda Function. Weighted
+        routing sends part of the traffic to additional versions, e.g.
+        {"2": 0.1} during a gradual rollout of version 2.
+    '''
+    params = dict(
+        Name=name,
+        FunctionVersion=function_version or
+        ctx.instance.runtime_properties.get('version') or '$LATEST',
+        RoutingConfig=dict(AdditionalVersionWeights=dict(
+            (str(version), float(weight))
+            for version, weight in (routing_weights or dict()).items())))
+    if description:
+        params['Description'] = description
+    if iface.get_alias(name):
+        alias = iface.update_alias(params)
+    else:
+        alias = iface.create_alias(params)
+    aliases = ctx.instance.runtime_properties.get('aliases') or dict()
+    aliases[name] = dict(
+        AliasArn=alias.get('AliasArn'),
+        FunctionVersion=alias.get('FunctionVersion'),
+        RoutingConfig=alias.get('RoutingConfig'))
+    ctx.instance.runtime_properties['aliases'] = aliases
+
+
+@decorators.wait_for_status(status_good=['READY'],
+                            status_pending=['IN_PROGRESS'])
+def _put_provisioned_concurrency(iface, provisioned_concurrency, **_):
+    iface.create(dict(
+        ProvisionedConcurrentExecutions=int(provisioned_concurrency)))
+
+
+@decorators.aws_resource(LambdaFunction, RESOURCE_TYPE,
+                         ignore_properties=True)
+def put_provisioned_concurrency(ctx,
+                                iface,
+                                qualifier=None,
+                                provisioned_concurrency=1,
+                                **_):
+    '''
+        Puts provisioned concurrency on a version or alias of an AWS Lambda
+        Function and waits until it is READY.
+    '''
+    qualifier = qualifier or ctx.instance.runtime_properties.get('version')
+    if not qualifier:
+        raise NonRecoverableError(
+            'A qualifier is required when no version was published.')
+    _put_provisioned_concurrency(
+        ctx=ctx,
+        iface=LambdaProvisionedConcurrency(
+            ctx.node, resource_id=iface.resource_id, client=iface.client,
+            logger=ctx.logger, qualifier=qualifier),
+        resource_type=RESOURCE_TYPE_CONCURRENCY,
+        provisioned_concurrency=provisioned_concurrency)
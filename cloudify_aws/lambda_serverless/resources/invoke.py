@@ -16,12 +16,62 @@
     ~~~~~~~~~~~~~~~~~
     AWS Lambda Function invocation interface
 '''
+# Standard imports
+import os
+import tempfile
+
 # Cloudify
-from cloudify_aws.common import decorators, utils
+from cloudify.exceptions import OperationRetry
+from cloudify_aws.common import constants, decorators, utils
 from cloudify_aws.lambda_serverless.resources.function import LambdaFunction
 from cloudify_aws.ec2.resources import eni
 
 RESOURCE_TYPE = 'Lambda Function Invocation'
+BATCH_DEFAULTS = {
+    'payloads': [],
+    'payloads_file': '',
+    'invocation_type': 'RequestResponse',
+    'max_workers': constants.DEFAULT_MAX_WORKERS,
+    'results_file': '',
+}
+
+
+def _iter_payloads(ctx, batch):
+    for payload in batch['payloads']:
+        yield payload
+    if batch['payloads_file']:
+        path = batch['payloads_file']
+        downloaded = not os.path.exists(path)
+        if downloaded:
+            path = ctx.download_resource(path)
+        try:
+            for payload in utils.iter_json_lines(path):
+                yield payload
+        finally:
+            if downloaded:
+                os.remove(path)
+
+
+def invoke_batch(ctx, function, batch):
+    '''
+        Invokes a function once per payload of the batch configuration,
+        from the payloads list and then the payloads_file JSON lines.
+    '''
+    batch = dict(BATCH_DEFAULTS, **batch)
+    results_path = batch['results_file']
+    if not results_path:
+        handle, results_path = tempfile.mkstemp(
+            prefix='lambda-invoke-', suffix='.jsonl')
+        os.close(handle)
+    summary = function.invoke_batch(
+        _iter_payloads(ctx, batch), results_path,
+        batch['invocation_type'], batch['max_workers'])
+    ctx.logger.info(
+        'Invoked {0} times with {1} errors, {2} per second, latency '
+        '{3} ms. Results are in {4}.'.format(
+            summary['invocations'], summary['errors'],
+            summary['throughput'], summary['latency'], results_path))
+    return summary
 
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
@@ -40,14 +90,21 @@ def attach_to(ctx, resource_config, **_):
         ctx.source.node.properties.get('resource_encoding')
     if utils.is_node_type(ctx.target.node,
                           'cloudify.nodes.aws.lambda.Function'):
-        ctx.source.instance.runtime_properties['output'] = LambdaFunction(
+        function = LambdaFunction(
             ctx.target.node, logger=ctx.logger,
             resource_encoding=resource_encoding,
             resource_id=utils.get_resource_id(
                 node=ctx.target.node,
                 instance=ctx.target.instance,
-                raise_on_missing=True)).invoke(
-                    resource_config or rtprops.get('resource_config'))
+                raise_on_missing=True))
+        batch = ctx.source.node.properties.get('batch') or dict()
+        if batch.get('payloads') or batch.get('payloads_file'):
+            # Only the summary is kept, results are in the results file
+            ctx.source.instance.runtime_properties['output'] = \
+                invoke_batch(ctx, function, batch)
+            return
+        ctx.source.instance.runtime_properties['output'] = function.invoke(
+            resource_config or rtprops.get('resource_config'))
 
 
 @decorators.aws_relationship(resource_type=RESOURCE_TYPE)
@@ -58,47 +115,20 @@ def detach_from(ctx, resource_config, **_):
     vpc_config = props.get('vpc_config')
 
     # Check to see if the invoked function is placed in vpc or not so that we
-    # can remove the eni created by invoke method
+    # can remove the enis created by invoke method
     if vpc_config:
         eni_instance = eni.EC2NetworkInterface(
             ctx_node=ctx.target.node,
             logger=ctx.logger
         )
-
-        eni_filter = [
-            {
-                'Name': 'vpc-id',
-                'Values': [vpc_config['VpcId']]
-            },
-            {
-                'Name': 'group-id',
-                'Values': [
-                    group_id for group_id in
-                    vpc_config['SecurityGroupIds']
-                ]
-            },
-            {
-                'Name': 'description',
-                'Values': ['AWS Lambda VPC ENI:*']
-            },
-            {
-                'Name': 'requester-id',
-                'Values': ['*:{0}*'.format(function_name)]
-            }
-        ]
-
-        eni_interfaces = eni_instance.list_network_interfaces(eni_filter)
-        if eni_interfaces:
-            eni_interface = eni_interfaces[0]
-            eni_id = eni_interface['NetworkInterfaceId']
-            attachment = eni_interface.get('Attachment')
-            if attachment:
-                eni_attachment_id = attachment.get('AttachmentId')
-                params = {
-                    eni.ATTACHMENT_ID: eni_attachment_id
-                }
-                eni_instance.detach(params)
-
-            params = dict()
-            params[eni.NETWORKINTERFACE_ID] = eni_id
-            eni_instance.delete(params)
+        eni_filter = eni.get_lambda_eni_filters(
+            vpc_id=vpc_config['VpcId'],
+            group_ids=vpc_config['SecurityGroupIds'],
+            function_name=function_name)
+        remaining = eni.reap_network_interfaces(eni_instance, eni_filter)
+        if remaining:
+            raise OperationRetry(
+                'Network interfaces {0} of {1} ID# "{2}" are still '
+                'in use.'.format(remaining, RESOURCE_TYPE, function_name),
+                retry_after=utils.get_retry_interval(
+                    ctx.operation.retry_number))
@@ -13,16 +13,26 @@
 # limitations under the License.
 
 # Standard imports
+import os
+import base64
+import hashlib
+import json
 import unittest
+import tempfile
+from io import BytesIO
 
 # Third party imports
-from mock import patch, MagicMock
+from mock import patch, MagicMock, PropertyMock
+from botocore.exceptions import ClientError
 
 from cloudify.mocks import MockCloudifyContext
+from cloudify.state import current_ctx
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 from cloudify_aws.common._compat import StringIO
 
 # Local imports
 from cloudify_aws.common._compat import reload_module
+from cloudify_aws.common import decorators
 from cloudify_aws.lambda_serverless.resources import function
 from cloudify_aws.common.tests.test_base import (
     TestBase,
@@ -31,6 +41,8 @@ from cloudify_aws.common.tests.test_base import (
 
 
 PATCH_PREFIX = 'cloudify_aws.lambda_serverless.resources.function.'
+# Other test modules leave wait_for_status patched
+WAIT_FOR_STATUS = decorators.wait_for_status
 # Constants
 SUBNET_GROUP_I = ['cloudify.nodes.Root',
                   'cloudify.nodes.aws.lambda.Invoke']
@@ -47,7 +59,9 @@ class TestLambdaFunction(TestBase):
         mock2 = patch('cloudify_aws.common.decorators.wait_for_delete',
                       mock_decorator)
         mock1.start()
+        self.addCleanup(mock1.stop)
         mock2.start()
+        self.addCleanup(mock2.stop)
         reload_module(function)
 
     def _get_ctx(self):
@@ -286,6 +300,199 @@ class TestLambdaFunction(TestBase):
                 resource_config['VpcConfig']
             )
 
+    def _code_ctx(self, code_staging=None):
+        ctx = self.get_mock_ctx('test_code', {
+            'code_staging': code_staging or {}})
+        self._mock_function_file()
+        return ctx
+
+    def test_get_code_sha256(self):
+        self._mock_function_file()
+        self.assertEqual(
+            function.get_code_sha256('/tmp/mock_function.txt'),
+            (base64.b64encode(hashlib.sha256(b'test').digest()).decode(),
+             4))
+
+    def test_deploy_code_unchanged(self):
+        ctx = self._code_ctx()
+        iface = MagicMock()
+        code_sha256, _ = function.get_code_sha256('/tmp/mock_function.txt')
+        iface.properties = {'CodeSha256': code_sha256}
+        code, current = function.deploy_code(
+            ctx, iface, {'ZipFile': '/tmp/mock_function.txt'},
+            skip_unchanged=True)
+        self.assertIsNone(code)
+        self.assertEqual(current, iface.properties)
+
+    def test_deploy_code_inline(self):
+        ctx = self._code_ctx({'bucket': 'bucket'})
+        iface = MagicMock()
+        iface.properties = None
+        code, current = function.deploy_code(
+            ctx, iface, {'ZipFile': '/tmp/mock_function.txt'})
+        self.assertEqual(code, {'ZipFile': b'test'})
+        self.assertIsNone(current)
+
+    def test_deploy_code_staged(self):
+        ctx = self._code_ctx({'bucket': 'bucket', 'inline_max_size': 1})
+        iface = MagicMock()
+        iface.properties = {'CodeSha256': 'old'}
+        code_sha256, _ = function.get_code_sha256('/tmp/mock_function.txt')
+        key = 'lambda/{0}.zip'.format(hashlib.sha256(b'test').hexdigest())
+        with patch(PATCH_PREFIX + 'Boto3Connection') as connection:
+            s3 = connection().client()
+            s3.head_object.side_effect = ClientError(
+                {'Error': {'Code': '404'}}, 'HeadObject')
+            code, _ = function.deploy_code(
+                ctx, iface, {'ZipFile': '/tmp/mock_function.txt'})
+            self.assertEqual(code, {'S3Bucket': 'bucket', 'S3Key': key})
+            s3.upload_file.assert_called_once()
+            self.assertEqual(
+                s3.upload_file.call_args[1]['ExtraArgs'],
+                {'Metadata': {'sha256': code_sha256}})
+
+            # An object with the same hash is not uploaded again
+            s3.head_object.side_effect = None
+            s3.head_object.return_value = {
+                'Metadata': {'sha256': code_sha256}}
+            function.deploy_code(
+                ctx, iface, {'ZipFile': '/tmp/mock_function.txt'})
+            self.assertEqual(s3.upload_file.call_count, 1)
+
+    def test_create_code_package(self):
+        ctx = self._code_ctx()
+        iface = MagicMock()
+        iface.resource_id = 'test_function'
+        type(iface).properties = PropertyMock(
+            side_effect=AssertionError('create must not adopt functions'))
+        iface.create.return_value = {'FunctionName': 'test_function',
+                                     'FunctionArn': 'test_function_arn'}
+        with patch(PATCH_PREFIX + '_get_subnets_to_attach'), \
+                patch(PATCH_PREFIX + '_get_security_groups_to_attach'), \
+                patch(PATCH_PREFIX + '_get_iam_role_to_attach'):
+            function.create(ctx, iface, {
+                'Code': {'ZipFile': '/tmp/mock_function.txt'}})
+        self.assertEqual(iface.create.call_args[0][0]['Code'],
+                         {'ZipFile': b'test'})
+        self.assertFalse(iface.update_code.called)
+        self.assertEqual(
+            ctx.instance.runtime_properties['aws_resource_arn'],
+            'test_function_arn')
+
+    def test_update_code(self):
+        ctx = self._code_ctx()
+        iface = MagicMock()
+        code_sha256, _ = function.get_code_sha256('/tmp/mock_function.txt')
+        iface.properties = {'CodeSha256': code_sha256}
+        config = {'Code': {'ZipFile': '/tmp/mock_function.txt'}}
+        function.update_code(ctx, iface, config)
+        self.assertFalse(iface.update_code.called)
+        iface.properties = {'CodeSha256': 'old'}
+        function.update_code(ctx, iface, config)
+        iface.update_code.assert_called_once_with({'ZipFile': b'test'})
+
+    def test_class_invoke_batch(self):
+        fun = function.LambdaFunction(
+            'ctx_node', resource_id='test_function', client=MagicMock(),
+            logger=MagicMock())
+
+        def invoke(FunctionName, InvocationType, Payload):
+            if Payload == '"fail"':
+                raise self.get_client_error_exception(name='invoke')
+            response = {'StatusCode': 200,
+                        'Payload': BytesIO(Payload.encode('utf-8'))}
+            if Payload == '"error"':
+                response['FunctionError'] = 'Unhandled'
+            return response
+        fun.client.invoke.side_effect = invoke
+        fd, results_path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.addCleanup(os.remove, results_path)
+        summary = fun.invoke_batch(
+            iter([{'key': 1}, 'fail', 'error']), results_path,
+            max_workers=2)
+        self.assertEqual(summary['invocations'], 3)
+        self.assertEqual(summary['errors'], 2)
+        self.assertEqual(sorted(summary['latency']), ['p50', 'p90', 'p99'])
+        with open(results_path) as results_file:
+            results = [json.loads(line) for line in results_file]
+        self.assertEqual(results[0], {'index': 0, 'StatusCode': 200,
+                                      'FunctionError': None,
+                                      'Payload': '{"key": 1}'})
+        self.assertIn('error', results[1])
+        self.assertEqual(results[2]['FunctionError'], 'Unhandled')
+
+    def test_publish_version(self):
+        ctx = self._get_ctx()
+        iface = MagicMock()
+        iface.publish_version.return_value = {'Version': '3'}
+        function.publish_version(ctx, iface, description='release')
+        iface.publish_version.assert_called_once_with(
+            {'Description': 'release'})
+        self.assertEqual(ctx.instance.runtime_properties['version'], '3')
+
+    def test_configure_alias(self):
+        ctx = self._get_ctx()
+        ctx.instance.runtime_properties['version'] = '3'
+        iface = MagicMock()
+        iface.get_alias.return_value = None
+        iface.create_alias.return_value = {'AliasArn': 'arn:live',
+                                           'FunctionVersion': '3'}
+        function.configure_alias(ctx, iface, 'live')
+        iface.create_alias.assert_called_once_with({
+            'Name': 'live', 'FunctionVersion': '3',
+            'RoutingConfig': {'AdditionalVersionWeights': {}}})
+
+        # Existing aliases are updated, with weighted routing
+        iface.get_alias.return_value = {'Name': 'live'}
+        iface.update_alias.return_value = {'AliasArn': 'arn:live',
+                                           'FunctionVersion': '3'}
+        function.configure_alias(ctx, iface, 'live', routing_weights={4: 0.1})
+        iface.update_alias.assert_called_once_with({
+            'Name': 'live', 'FunctionVersion': '3',
+            'RoutingConfig': {'AdditionalVersionWeights': {'4': 0.1}}})
+        self.assertEqual(
+            ctx.instance.runtime_properties['aliases']['live']['AliasArn'],
+            'arn:live')
+
+    def test_put_provisioned_concurrency(self):
+        ctx = self.get_mock_ctx('test_concurrency', {}, {
+            'aws_resource_id': 'test_function', 'version': '3'})
+        current_ctx.set(ctx)
+        real_wait = patch('cloudify_aws.common.decorators.wait_for_status',
+                          WAIT_FOR_STATUS)
+        real_wait.start()
+        self.addCleanup(real_wait.stop)
+        reload_module(function)
+        iface = MagicMock()
+        iface.resource_id = 'test_function'
+        client = iface.client
+        client.get_provisioned_concurrency_config.return_value = {
+            'Status': 'IN_PROGRESS'}
+        with self.assertRaises(OperationRetry):
+            function.put_provisioned_concurrency(
+                ctx=ctx, iface=iface, provisioned_concurrency=5)
+        client.put_provisioned_concurrency_config.assert_called_once_with(
+            FunctionName='test_function', Qualifier='3',
+            ProvisionedConcurrentExecutions=5)
+
+        # Retries only poll the status
+        ctx.operation._operation_context['retry_number'] = 1
+        client.get_provisioned_concurrency_config.return_value = {
+            'Status': 'READY'}
+        function.put_provisioned_concurrency(
+            ctx=ctx, iface=iface, provisioned_concurrency=5)
+        self.assertEqual(
+            client.put_provisioned_concurrency_config.call_count, 1)
+        client.get_provisioned_concurrency_config.assert_called_with(
+            FunctionName='test_function', Qualifier='3')
+
+        client.get_provisioned_concurrency_config.return_value = {
+            'Status': 'FAILED'}
+        with self.assertRaises(NonRecoverableError):
+            function.put_provisioned_concurrency(
+                ctx=ctx, iface=iface, qualifier='live')
+
     def test_delete(self):
         iface = MagicMock()
         function.delete(iface, None)
@@ -13,12 +13,16 @@
 # limitations under the License.
 
 # Standard imports
+import os
+import shutil
 import unittest
+import tempfile
 
 # Third party imports
 from mock import patch, MagicMock
 
 from cloudify.manager import DirtyTrackingDict
+from cloudify.exceptions import OperationRetry
 
 # Local imports
 from cloudify_aws.common._compat import reload_module
@@ -98,10 +102,59 @@ class TestLambdaInvoke(TestBase):
             invoke.attach_to(ctx=relation_ctx, resource_config=True)
             self.assertFalse(mock.called)
 
+    def test_attach_to_batch(self):
+        relation_ctx = self._get_relationship_context(SUBNET_GROUP_F)
+        relation_ctx.source.node.properties['batch'] = {
+            'payloads': [{'a': 1}], 'payloads_file': 'payloads.jsonl',
+            'invocation_type': 'Event', 'max_workers': 5}
+        # The operation removes the downloaded file itself
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        payloads_path = os.path.join(tmpdir, 'payloads.jsonl')
+        with open(payloads_path, 'w') as payloads_file:
+            payloads_file.write('{"b": 2}\n{"c": 3}\n')
+        relation_ctx.download_resource = MagicMock(return_value=payloads_path)
+        with patch(LAMBDA_PATH) as mock, \
+                patch(INVOKE_PATH + 'utils.is_node_type', return_value=True):
+            mock().invoke_batch.side_effect = \
+                lambda payloads, *args: dict(
+                    invocations=len(list(payloads)), errors=0,
+                    throughput=1, latency={}, results_file=args[0])
+            invoke.attach_to(ctx=relation_ctx, resource_config=None)
+            args = mock().invoke_batch.call_args[0]
+            self.assertEqual(args[2:], ('Event', 5))
+            self.assertFalse(mock().invoke.called)
+        output = relation_ctx.source.instance.runtime_properties['output']
+        self.assertEqual(output['invocations'], 3)
+        self.assertTrue(output['results_file'].endswith('.jsonl'))
+        # The downloaded payloads file is removed
+        relation_ctx.download_resource.assert_called_once_with(
+            'payloads.jsonl')
+        self.assertFalse(os.path.exists(payloads_path))
+
     def test_detach_from(self):
         relation_ctx = self._get_relationship_context(SUBNET_GROUP_I)
         invoke.detach_from(ctx=relation_ctx, resource_config=None)
 
+    def test_detach_from_vpc(self):
+        relation_ctx = self._get_relationship_context(SUBNET_GROUP_F)
+        relation_ctx.target.instance.runtime_properties['vpc_config'] = {
+            'VpcId': 'vpc', 'SecurityGroupIds': ['sg']}
+        with patch(INVOKE_PATH + 'eni.EC2NetworkInterface'), \
+                patch(INVOKE_PATH + 'eni.reap_network_interfaces',
+                      return_value=[]) as reap:
+            invoke.detach_from(ctx=relation_ctx, resource_config=None)
+            filters = reap.call_args[0][1]
+            self.assertIn({'Name': 'group-id', 'Values': ['sg']}, filters)
+
+        relation_ctx.operation._operation_context['retry_number'] = 2
+        with patch(INVOKE_PATH + 'eni.EC2NetworkInterface'), \
+                patch(INVOKE_PATH + 'eni.reap_network_interfaces',
+                      return_value=['eni']):
+            with self.assertRaises(OperationRetry) as e:
+                invoke.detach_from(ctx=relation_ctx, resource_config=None)
+            self.assertEqual(e.exception.retry_after, 20)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -17,10 +17,11 @@
     AWS Route53 Hosted Zone interface
 '''
 # Standard Imports
-from time import sleep
+import time
 
 # Third party imports
 from botocore.exceptions import ClientError
+from cloudify.exceptions import OperationRetry
 
 from cloudify_aws.common._compat import text_type
 
@@ -30,6 +31,20 @@ from cloudify_aws.common.connection import Boto3Connection
 from cloudify_aws.route53 import Route53Base
 
 RESOURCE_TYPE = 'Route53 Hosted Zone'
+# Route53 allows 5 requests per second per account
+RATE_LIMIT = 5
+# ChangeBatch limits: ResourceRecord elements and characters of their values
+CHANGE_BATCH_MAX_RECORDS = 1000
+CHANGE_BATCH_MAX_CHARS = 32000
+LIST_MAX_ITEMS = '300'
+INSYNC = 'INSYNC'
+CHANGE_POLL_INTERVAL = 2
+CHANGE_POLL_ATTEMPTS = 60
+
+
+def get_rate_limiter():
+    '''Gets the Route53 rate limiter shared by operations on this host'''
+    return utils.RateLimiter('route53', RATE_LIMIT)
 
 
 class Route53HostedZone(Route53Base):
@@ -91,6 +106,115 @@ class Route53HostedZone(Route53Base):
         self.logger.debug('Response: %s' % res)
         return res['ResourceRecordSets']
 
+    def iter_resource_record_sets(self, limiter=None):
+        '''
+            Yields all AWS Route53 Resource Record Sets, page by page.
+        '''
+        params = dict(HostedZoneId=self.resource_id, MaxItems=LIST_MAX_ITEMS)
+        while True:
+            if limiter:
+                limiter.acquire()
+            res = self.client.list_resource_record_sets(**params)
+            for record in res.get('ResourceRecordSets', []):
+                yield record
+            if not res.get('IsTruncated'):
+                break
+            params['StartRecordName'] = res['NextRecordName']
+            params['StartRecordType'] = res['NextRecordType']
+            if res.get('NextRecordIdentifier'):
+                params['StartRecordIdentifier'] = res['NextRecordIdentifier']
+            else:
+                params.pop('StartRecordIdentifier', None)
+
+    def get_change(self, change_id):
+        '''
+            Gets the status of an AWS Route53 change.
+        '''
+        return self.client.get_change(Id=change_id)['ChangeInfo']
+
+
+def _count_change(change):
+    records = change['ResourceRecordSet'].get('ResourceRecords') or []
+    chars = sum(len(record.get('Value', '')) for record in records)
+    # UPSERT counts twice against the limits
+    weight = 2 if change['Action'] == 'UPSERT' else 1
+    return weight * max(len(records), 1), weight * chars
+
+
+def pack_change_batches(changes):
+    '''
+        Packs changes into as few ChangeBatches as the API limits allow.
+    :param changes: iterable of Route53 changes
+    :yields: lists of changes
+    '''
+    batch, batch_records, batch_chars = [], 0, 0
+    for change in changes:
+        records, chars = _count_change(change)
+        if batch and (batch_records + records > CHANGE_BATCH_MAX_RECORDS or
+                      batch_chars + chars > CHANGE_BATCH_MAX_CHARS):
+            yield batch
+            batch, batch_records, batch_chars = [], 0, 0
+        batch.append(change)
+        batch_records += records
+        batch_chars += chars
+    if batch:
+        yield batch
+
+
+def wait_for_changes(iface, change_ids, limiter=None,
+                     poll_interval=CHANGE_POLL_INTERVAL,
+                     poll_attempts=CHANGE_POLL_ATTEMPTS):
+    '''
+        Waits for Route53 changes to be INSYNC.
+    :return: list of change IDs still pending
+    '''
+    pending = list(change_ids)
+    for attempt in range(poll_attempts):
+        for change_id in list(pending):
+            if limiter:
+                limiter.acquire()
+            if iface.get_change(change_id)['Status'] == INSYNC:
+                pending.remove(change_id)
+        if not pending or attempt == poll_attempts - 1:
+            break
+        time.sleep(poll_interval)
+    return pending
+
+
+def _normalize_name(name):
+    return name.lower().rstrip('.') + '.'
+
+
+def purge_resource_record_sets(iface, logger, limiter=None):
+    '''
+        Deletes all Resource Record Sets of a Hosted Zone except its own
+        SOA and NS records, in as few change requests as possible.
+    :return: list of change IDs
+    '''
+    if limiter:
+        limiter.acquire()
+    zone_name = _normalize_name(iface.client.get_hosted_zone(
+        Id=iface.resource_id)['HostedZone']['Name'])
+
+    def deletions():
+        for record in iface.iter_resource_record_sets(limiter):
+            # Records are listed by name then type, so the apex NS comes
+            # before the SOA
+            if record['Type'] in ['SOA', 'NS'] and \
+                    _normalize_name(record['Name']) == zone_name:
+                continue
+            yield dict(Action='DELETE', ResourceRecordSet=record)
+
+    change_ids = []
+    for batch in pack_change_batches(deletions()):
+        if limiter:
+            limiter.acquire()
+        logger.debug('Deleting %d Resource Record Sets' % len(batch))
+        change_ids.append(iface.change_resource_record_sets(dict(
+            HostedZoneId=iface.resource_id,
+            ChangeBatch=dict(Changes=batch)))['Id'])
+    return change_ids
+
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
 def prepare(ctx, resource_config, **_):
@@ -126,22 +250,12 @@ def delete(ctx, iface, resource_config, resource_type,
         ctx.logger.warn(
             'Attempting to purge all Resource Record Sets from the %s'
             % resource_type)
-        # Iterate over all Record Sets
-        for record in iface.list_resource_record_sets(dict(
-                HostedZoneId=iface.resource_id,
-                MaxItems='100')):
-            # Skip default record types
-            if record['Type'] in ['NS', 'SOA']:
-                continue
-            # Delete the Record Set
-            iface.change_resource_record_sets(dict(
-                HostedZoneId=iface.resource_id,
-                ChangeBatch=dict(
-                    Changes=[dict(
-                        Action='DELETE',
-                        ResourceRecordSet=record)])))
-            # Sleep to avoid hitting AWS throttling / limits
-            sleep(1)
+        limiter = get_rate_limiter()
+        change_ids = purge_resource_record_sets(iface, ctx.logger, limiter)
+        if wait_for_changes(iface, change_ids, limiter):
+            raise OperationRetry(
+                'Waiting for Resource Record Sets of the %s to be deleted.'
+                % resource_type)
     iface.delete(resource_config)
 
 
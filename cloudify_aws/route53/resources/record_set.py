@@ -16,12 +16,220 @@
     ~~~~~~~~~~~~~~~~~
     AWS Route53 Resource Record Set interface
 '''
+# Standard Imports
+import time
+
+# Third party imports
+from botocore.exceptions import ClientError
+
 # Cloudify
-from cloudify.exceptions import NonRecoverableError
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 from cloudify_aws.common import decorators, utils
-from cloudify_aws.route53.resources.hosted_zone import Route53HostedZone
+from cloudify_aws.route53.resources.hosted_zone import (
+    Route53HostedZone,
+    INSYNC,
+    CHANGE_POLL_INTERVAL,
+    CHANGE_POLL_ATTEMPTS,
+    get_rate_limiter,
+    pack_change_batches
+)
 
 RESOURCE_TYPE = 'Route53 Resource Record Set'
+CHANGE_STORE = 'route53-changes'
+# Seconds an operation waits for concurrent operations to queue changes
+COALESCE_WINDOW = 1
+# Seconds after which a batch taken by another operation is given up on
+BATCH_TIMEOUT = 300
+NOT_FOUND_MESSAGE = 'not found'
+
+
+class RecordSetBatcher(object):
+    '''
+        Merges Resource Record Set changes of concurrent operations on this
+        host into shared ChangeBatches per Hosted Zone.
+
+        Each operation queues its change in the local store. After a short
+        window, the first operation to find its change still queued takes
+        the whole queue, submits it and records the change ID of every
+        contributor; the others pick their change ID up from the store.
+        INSYNC status is cached in the store as well, so one get_change
+        call serves every operation waiting on the same change.
+    '''
+    def __init__(self, iface, zone_id, logger, limiter=None):
+        self.iface = iface
+        self.zone_id = zone_id
+        self.logger = logger
+        self.limiter = limiter or get_rate_limiter()
+
+    def _zone(self, store):
+        return store.setdefault('zones', dict()).setdefault(
+            self.zone_id, dict(queue=dict(), submitted=dict()))
+
+    def enqueue(self, owner, change):
+        '''Queues a change unless it was already taken into a batch'''
+        with utils.local_store(CHANGE_STORE) as store:
+            zone = self._zone(store)
+            if owner not in zone['submitted']:
+                zone['queue'][owner] = change
+
+    def _take(self, owner):
+        with utils.local_store(CHANGE_STORE) as store:
+            zone = self._zone(store)
+            if owner not in zone['queue']:
+                return None
+            batch = zone['queue']
+            zone['queue'] = dict()
+            for contributor in batch:
+                zone['submitted'][contributor] = dict(taken=time.time())
+            return batch
+
+    def _change(self, changes):
+        self.limiter.acquire()
+        return self.iface.change_resource_record_sets(dict(
+            HostedZoneId=self.zone_id,
+            ChangeBatch=dict(Changes=changes)))['Id']
+
+    @staticmethod
+    def _error(error):
+        # Errors other than API ones (e.g. network) are worth a retry
+        return dict(error=str(error),
+                    retry=not isinstance(error, ClientError))
+
+    def _submit(self, batch):
+        owners = sorted(batch)
+        results = dict()
+        try:
+            for changes in pack_change_batches([batch[o] for o in owners]):
+                batch_owners, owners = \
+                    owners[:len(changes)], owners[len(changes):]
+                try:
+                    change_id = self._change(changes)
+                    results.update(
+                        (o, dict(Id=change_id)) for o in batch_owners)
+                    continue
+                except Exception as e:
+                    if len(changes) == 1:
+                        results[batch_owners[0]] = self._error(e)
+                        continue
+                    self.logger.warn(
+                        'Batch of %d changes failed, submitting them one by '
+                        'one: %s' % (len(changes), e))
+                # Isolate the change that made the batch fail
+                for contributor, change in zip(batch_owners, changes):
+                    try:
+                        results[contributor] = dict(
+                            Id=self._change([change]))
+                    except Exception as e:
+                        results[contributor] = self._error(e)
+        except Exception as e:
+            # Every contributor gets a result, so none waits on the batch
+            for contributor in batch:
+                results.setdefault(contributor, self._error(e))
+        finally:
+            self.logger.debug('Submitted %d changes to %s'
+                              % (len(batch), self.zone_id))
+            with utils.local_store(CHANGE_STORE) as store:
+                self._zone(store)['submitted'].update(results)
+
+    def _result(self, owner):
+        '''
+            Waits for the result of a submitted change. Changes whose batch
+            was not submitted in time are dropped, so they can be queued
+            again.
+        :return: dict with either "Id" or "error", empty on timeout
+        '''
+        for _ in range(BATCH_TIMEOUT):
+            with utils.local_store(CHANGE_STORE) as store:
+                submitted = self._zone(store)['submitted']
+                result = submitted.get(owner) or dict()
+                if 'Id' in result or 'error' in result:
+                    submitted.pop(owner, None)
+                    return result
+                if time.time() - result.get('taken', 0) > BATCH_TIMEOUT:
+                    submitted.pop(owner, None)
+                    return dict()
+            time.sleep(1)
+        with utils.local_store(CHANGE_STORE) as store:
+            self._zone(store)['submitted'].pop(owner, None)
+        return dict()
+
+    def submit(self, owner, change):
+        '''
+            Submits a change together with the changes queued by concurrent
+            operations.
+        :param owner: unique ID of the contributing operation
+        :param change: Route53 change
+        :return: dict with the change ID as "Id", or the "error"
+        '''
+        self.enqueue(owner, change)
+        time.sleep(COALESCE_WINDOW)
+        batch = self._take(owner)
+        if batch:
+            self._submit(batch)
+        result = self._result(owner)
+        if not result:
+            raise OperationRetry(
+                'Batched change of %s was not submitted in time.' % owner)
+        return result
+
+    def is_insync(self, change_id):
+        '''Checks a change status, sharing get_change calls'''
+        with utils.local_store(CHANGE_STORE) as store:
+            changes = store.setdefault('changes', dict())
+            now = time.time()
+            for old_id in [k for k, v in changes.items()
+                           if now - v['checked'] > BATCH_TIMEOUT]:
+                del changes[old_id]
+            status = changes.get(change_id)
+            if status and (status['Status'] == INSYNC or
+                           now - status['checked'] < CHANGE_POLL_INTERVAL):
+                return status['Status'] == INSYNC
+            # Claim the next poll for this change
+            changes[change_id] = dict(
+                Status=(status or dict()).get('Status'), checked=now)
+        self.limiter.acquire()
+        status = self.iface.get_change(change_id)['Status']
+        with utils.local_store(CHANGE_STORE) as store:
+            store.setdefault('changes', dict())[change_id] = dict(
+                Status=status, checked=time.time())
+        return status == INSYNC
+
+    def wait(self, change_id, poll_attempts=CHANGE_POLL_ATTEMPTS):
+        '''Waits for a change to be INSYNC'''
+        for attempt in range(poll_attempts):
+            if self.is_insync(change_id):
+                return True
+            time.sleep(CHANGE_POLL_INTERVAL)
+        return False
+
+
+def _apply_change(ctx, params, change):
+    '''Applies a change through the batcher and waits for INSYNC'''
+    runtime_properties = ctx.instance.runtime_properties
+    batcher = RecordSetBatcher(
+        Route53HostedZone(
+            ctx.node,
+            resource_id=utils.get_resource_id(raise_on_missing=True),
+            logger=ctx.logger),
+        params['HostedZoneId'],
+        ctx.logger)
+    change_id = runtime_properties.get('change_id')
+    if not change_id:
+        result = batcher.submit(
+            '{0}/{1}'.format(ctx.deployment.id, ctx.instance.id), change)
+        if 'error' in result:
+            if change['Action'] == 'DELETE' and \
+                    NOT_FOUND_MESSAGE in result['error']:
+                return
+            if result.get('retry'):
+                raise OperationRetry(result['error'])
+            raise NonRecoverableError(result['error'])
+        change_id = result['Id']
+        runtime_properties['change_id'] = change_id
+    if not batcher.wait(change_id):
+        raise OperationRetry('Waiting for change %s to be INSYNC.'
+                             % change_id)
+    del runtime_properties['change_id']
 
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
@@ -35,12 +243,12 @@ def prepare(ctx, resource_config, **_):
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
 def create(ctx, resource_config, **_):
     '''Creates an AWS Route53 Resource Record Set'''
-    Route53HostedZone(
-        ctx.node,
-        resource_id=utils.get_resource_id(raise_on_missing=True),
-        logger=ctx.logger
-    ).change_resource_record_sets(
-        ctx.instance.runtime_properties['resource_config'] or dict())
+    params = ctx.instance.runtime_properties['resource_config'] or dict()
+    change = dict(params['ChangeBatch']['Changes'][0])
+    # UPSERT keeps retries and re-installs idempotent
+    if change.get('Action', '').upper() == 'CREATE':
+        change['Action'] = 'UPSERT'
+    _apply_change(ctx, params, change)
 
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
@@ -59,16 +267,9 @@ def delete(ctx, resource_config, resource_type, **_):
         ctx.logger.warn('%s was initially set to by deleted. Skipping...'
                         % resource_type)
         return
-    Route53HostedZone(
-        ctx.node,
-        resource_id=utils.get_resource_id(raise_on_missing=True),
-        logger=ctx.logger
-    ).change_resource_record_sets(dict(
-        HostedZoneId=params['HostedZoneId'],
-        ChangeBatch=dict(
-            Changes=[dict(
-                Action='DELETE',
-                ResourceRecordSet=change['ResourceRecordSet'])])))
+    _apply_change(ctx, params, dict(
+        Action='DELETE',
+        ResourceRecordSet=change['ResourceRecordSet']))
 
 
 @decorators.aws_relationship(resource_type=RESOURCE_TYPE)
@@ -19,6 +19,8 @@ import unittest
 # Third party imports
 from mock import patch, MagicMock
 
+from cloudify.exceptions import OperationRetry
+
 # Local imports
 from cloudify_aws.common._compat import reload_module
 from cloudify_aws.route53.resources import hosted_zone
@@ -171,20 +173,72 @@ class TestHostedZone(TestBase):
         hosted_zone.delete(ctx, iface, resource_config, 'rest_type', False)
         self.assertTrue(iface.delete.called)
 
-        # default types skiped
-        iface.list_resource_record_sets = self.mock_return([{'Type': 'NS'}])
+        # default types skiped, listed by name then type
+        iface.client.get_hosted_zone.return_value = {
+            'HostedZone': {'Name': 'zone.'}}
+        iface.iter_resource_record_sets = self.mock_return([
+            {'Type': 'NS', 'Name': 'zone.'},
+            {'Type': 'SOA', 'Name': 'zone.'}])
         hosted_zone.delete(ctx, iface, resource_config, 'rest_type', True)
         self.assertTrue(iface.delete.called)
+        self.assertFalse(iface.change_resource_record_sets.called)
 
-        iface.list_resource_record_sets = self.mock_return([{'Type': 'SOA'}])
+        # non default, including delegations
+        iface.iter_resource_record_sets = self.mock_return([
+            {'Type': 'A', 'Name': 'zone.'},
+            {'Type': 'NS', 'Name': 'zone.'},
+            {'Type': 'SOA', 'Name': 'zone.'},
+            {'Type': 'NS', 'Name': 'sub.zone.'},
+            {'Type': 'A', 'Name': 'www.zone.'}])
+        iface.get_change = self.mock_return({'Status': 'INSYNC'})
         hosted_zone.delete(ctx, iface, resource_config, 'rest_type', True)
         self.assertTrue(iface.delete.called)
+        changes = iface.change_resource_record_sets.call_args[0][0][
+            'ChangeBatch']['Changes']
+        self.assertEqual([change['ResourceRecordSet']['Name']
+                          for change in changes],
+                         ['zone.', 'sub.zone.', 'www.zone.'])
 
-        # non default
-        iface.list_resource_record_sets = self.mock_return([{'Type': None}])
-        hosted_zone.delete(ctx, iface, resource_config, 'rest_type', True)
-        self.assertTrue(iface.delete.called)
-        self.assertTrue(iface.change_resource_record_sets.called)
+    def test_delete_pending(self):
+        ctx = self._get_ctx()
+        iface = MagicMock()
+        iface.iter_resource_record_sets = self.mock_return([
+            {'Type': 'A', 'Name': 'www.zone.'}])
+        iface.get_change = self.mock_return({'Status': 'PENDING'})
+        with patch(PATCH_PREFIX + 'get_rate_limiter') as limiter:
+            with self.assertRaises(OperationRetry):
+                hosted_zone.delete(ctx, iface, {}, 'rest_type', True)
+        self.assertFalse(iface.delete.called)
+        self.assertEqual(iface.get_change.call_count,
+                         hosted_zone.CHANGE_POLL_ATTEMPTS)
+        self.assertEqual(limiter().acquire.call_count,
+                         hosted_zone.CHANGE_POLL_ATTEMPTS + 2)
+
+    def test_pack_change_batches(self):
+        def change(values):
+            return {'Action': 'DELETE', 'ResourceRecordSet': {
+                'ResourceRecords': [{'Value': value} for value in values]}}
+        batches = list(hosted_zone.pack_change_batches(
+            [change(['x' * 10] * 400)] * 3))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        batches = list(hosted_zone.pack_change_batches(
+            [change(['x' * 20000])] * 3))
+        self.assertEqual([len(batch) for batch in batches], [1, 1, 1])
+
+    def test_class_iter_resource_record_sets(self):
+        iface = hosted_zone.Route53HostedZone(
+            'ctx_node', resource_id='zone', client=MagicMock(),
+            logger=None)
+        iface.client.list_resource_record_sets.side_effect = [
+            {'ResourceRecordSets': [{'Name': 'a.'}], 'IsTruncated': True,
+             'NextRecordName': 'b.', 'NextRecordType': 'A'},
+            {'ResourceRecordSets': [{'Name': 'b.'}], 'IsTruncated': False}]
+        self.assertEqual(
+            [record['Name'] for record in iface.iter_resource_record_sets()],
+            ['a.', 'b.'])
+        iface.client.list_resource_record_sets.assert_called_with(
+            HostedZoneId='zone', MaxItems='300', StartRecordName='b.',
+            StartRecordType='A')
 
     def test_prepare_assoc(self):
         ctx = self._get_relationship_context()
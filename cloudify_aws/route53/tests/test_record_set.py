@@ -14,15 +14,17 @@
 # limitations under the License.
 
 # Standard imports
+import time
 import unittest
 
 # Third party imports
 from mock import patch, MagicMock
+from botocore.exceptions import ClientError
 
 # Local imports
 from cloudify_aws.common._compat import reload_module
 from cloudify_aws.route53.resources import record_set
-from cloudify.exceptions import NonRecoverableError
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 from cloudify_aws.common.tests.test_base import (
     TestBase,
     mock_decorator
@@ -76,12 +78,131 @@ class TestRecordSet(TestBase):
         self.assertEqual(ctx.instance.runtime_properties['resource_config'],
                          {'ChangeBatch': {'Changes': ['resource_config']}})
 
+    def _get_params(self, action='CREATE', name='a.example.com.'):
+        return {'HostedZoneId': 'zid',
+                'ChangeBatch': {'Changes': [{
+                    'Action': action,
+                    'ResourceRecordSet': {
+                        'Name': name, 'Type': 'A', 'TTL': 60,
+                        'ResourceRecords': [{'Value': '10.0.0.1'}]}}]}}
+
     def test_create(self):
         ctx = self._get_ctx()
-        with patch(PATCH_PREFIX + 'utils'), \
+        ctx.instance.runtime_properties['resource_config'] = \
+            self._get_params()
+        with patch(PATCH_PREFIX + 'utils.get_resource_id'), \
+                patch(PATCH_PREFIX + 'get_rate_limiter'), \
                 patch(PATCH_PREFIX + 'Route53HostedZone') as zone:
+            zone().change_resource_record_sets.return_value = {'Id': 'c1'}
+            zone().get_change.return_value = {'Status': 'INSYNC'}
             record_set.create(ctx, {})
-            self.assertTrue(zone.called)
+            params = zone().change_resource_record_sets.call_args[0][0]
+            self.assertEqual(params['HostedZoneId'], 'zid')
+            self.assertEqual(params['ChangeBatch']['Changes'][0]['Action'],
+                             'UPSERT')
+            zone().get_change.assert_called_once_with('c1')
+            self.assertNotIn('change_id', ctx.instance.runtime_properties)
+
+    def test_create_pending(self):
+        ctx = self._get_ctx()
+        ctx.instance.runtime_properties['resource_config'] = \
+            self._get_params()
+        with patch(PATCH_PREFIX + 'utils.get_resource_id'), \
+                patch(PATCH_PREFIX + 'get_rate_limiter'), \
+                patch(PATCH_PREFIX + 'Route53HostedZone') as zone:
+            zone().change_resource_record_sets.return_value = {'Id': 'c1'}
+            zone().get_change.return_value = {'Status': 'PENDING'}
+            with self.assertRaises(OperationRetry):
+                record_set.create(ctx, {})
+            self.assertEqual(ctx.instance.runtime_properties['change_id'],
+                             'c1')
+            # The retry only waits for the submitted change
+            zone().get_change.return_value = {'Status': 'INSYNC'}
+            with patch(PATCH_PREFIX + 'CHANGE_POLL_INTERVAL', 0):
+                record_set.create(ctx, {})
+            self.assertEqual(
+                zone().change_resource_record_sets.call_count, 1)
+            self.assertNotIn('change_id', ctx.instance.runtime_properties)
+
+    def test_batcher_coalesces_changes(self):
+        iface = MagicMock()
+        iface.change_resource_record_sets.return_value = {'Id': 'c1'}
+        iface.get_change.return_value = {'Status': 'INSYNC'}
+        batcher = record_set.RecordSetBatcher(
+            iface, 'zid', MagicMock(), limiter=MagicMock())
+        first = self._get_params()['ChangeBatch']['Changes'][0]
+        second = self._get_params(
+            name='b.example.com.')['ChangeBatch']['Changes'][0]
+        batcher.enqueue('dep/first', first)
+        self.assertEqual(batcher.submit('dep/second', second), {'Id': 'c1'})
+        iface.change_resource_record_sets.assert_called_once_with({
+            'HostedZoneId': 'zid',
+            'ChangeBatch': {'Changes': [first, second]}})
+        # The operation that only queued its change picks up the result
+        self.assertEqual(batcher.submit('dep/first', first), {'Id': 'c1'})
+        self.assertEqual(iface.change_resource_record_sets.call_count, 1)
+        # One get_change call serves every contributor
+        self.assertTrue(batcher.is_insync('c1'))
+        self.assertTrue(batcher.is_insync('c1'))
+        self.assertEqual(iface.get_change.call_count, 1)
+
+    def test_batcher_isolates_failed_change(self):
+        iface = MagicMock()
+        error = self.get_client_error_exception(name='Route53')
+        iface.change_resource_record_sets.side_effect = [
+            error, {'Id': 'c2'}, error]
+        batcher = record_set.RecordSetBatcher(
+            iface, 'zid', MagicMock(), limiter=MagicMock())
+        first = self._get_params()['ChangeBatch']['Changes'][0]
+        second = self._get_params(
+            name='b.example.com.')['ChangeBatch']['Changes'][0]
+        batcher.enqueue('dep/second', second)
+        self.assertEqual(batcher.submit('dep/first', first), {'Id': 'c2'})
+        self.assertIn('error', batcher.submit('dep/second', second))
+        self.assertEqual(iface.change_resource_record_sets.call_count, 3)
+
+    def test_batcher_unexpected_error(self):
+        iface = MagicMock()
+        iface.change_resource_record_sets.side_effect = \
+            ValueError('connection reset')
+        batcher = record_set.RecordSetBatcher(
+            iface, 'zid', MagicMock(), limiter=MagicMock())
+        first = self._get_params()['ChangeBatch']['Changes'][0]
+        second = self._get_params(
+            name='b.example.com.')['ChangeBatch']['Changes'][0]
+        batcher.enqueue('dep/second', second)
+        self.assertEqual(batcher.submit('dep/first', first),
+                         {'error': 'connection reset', 'retry': True})
+        self.assertEqual(batcher.submit('dep/second', second),
+                         {'error': 'connection reset', 'retry': True})
+
+        ctx = self._get_ctx()
+        ctx.instance.runtime_properties['resource_config'] = \
+            self._get_params()
+        with patch(PATCH_PREFIX + 'utils.get_resource_id'), \
+                patch(PATCH_PREFIX + 'get_rate_limiter'), \
+                patch(PATCH_PREFIX + 'Route53HostedZone') as zone:
+            zone().change_resource_record_sets.side_effect = \
+                ValueError('connection reset')
+            with self.assertRaises(OperationRetry):
+                record_set.create(ctx, {})
+            self.assertNotIn('change_id', ctx.instance.runtime_properties)
+
+    def test_batcher_timeout(self):
+        iface = MagicMock()
+        iface.change_resource_record_sets.return_value = {'Id': 'c1'}
+        batcher = record_set.RecordSetBatcher(
+            iface, 'zid', MagicMock(), limiter=MagicMock())
+        change = self._get_params()['ChangeBatch']['Changes'][0]
+        batcher.enqueue('dep/first', change)
+        # Taken into a batch by an operation that never submitted it
+        batcher._take('dep/first')
+        with patch(PATCH_PREFIX + 'time.time',
+                   return_value=time.time() + 2 * record_set.BATCH_TIMEOUT):
+            with self.assertRaises(OperationRetry):
+                batcher.submit('dep/first', change)
+        # The change can be queued again on retry
+        self.assertEqual(batcher.submit('dep/first', change), {'Id': 'c1'})
 
     def test_delete(self):
         ctx = self._get_ctx()
@@ -93,24 +214,38 @@ class TestRecordSet(TestBase):
         ctx = self._get_ctx()
         with patch(PATCH_PREFIX + 'utils'), \
                 patch(PATCH_PREFIX + 'Route53HostedZone') as zone:
-            params = {'HostedZoneId': 'zid',
-                      'ChangeBatch': {'Changes':
-                                      [{'ResourceRecordSet': 'rec_set',
-                                        'Action': 'delete'}]}}
+            params = self._get_params(action='delete')
             ctx.instance.runtime_properties['resource_config'] = params
             record_set.delete(ctx, {}, 'res_type')
             self.assertFalse(zone.called)
 
         ctx = self._get_ctx()
-        with patch(PATCH_PREFIX + 'utils'), \
+        with patch(PATCH_PREFIX + 'utils.get_resource_id'), \
+                patch(PATCH_PREFIX + 'get_rate_limiter'), \
                 patch(PATCH_PREFIX + 'Route53HostedZone') as zone:
-            params = {'HostedZoneId': 'zid',
-                      'ChangeBatch': {'Changes':
-                                      [{'ResourceRecordSet': 'rec_set',
-                                        'Action': 'create'}]}}
+            zone().change_resource_record_sets.return_value = {'Id': 'c1'}
+            zone().get_change.return_value = {'Status': 'INSYNC'}
+            params = self._get_params(action='create')
             ctx.instance.runtime_properties['resource_config'] = params
             record_set.delete(ctx, {}, 'res_type')
-            self.assertTrue(zone.called)
+            change = zone().change_resource_record_sets.call_args[0][0][
+                'ChangeBatch']['Changes'][0]
+            self.assertEqual(change['Action'], 'DELETE')
+
+    def test_delete_not_found(self):
+        ctx = self._get_ctx()
+        ctx.instance.runtime_properties['resource_config'] = \
+            self._get_params()
+        with patch(PATCH_PREFIX + 'utils.get_resource_id'), \
+                patch(PATCH_PREFIX + 'get_rate_limiter'), \
+                patch(PATCH_PREFIX + 'Route53HostedZone') as zone:
+            zone().change_resource_record_sets.side_effect = ClientError(
+                error_response={'Error': {
+                    'Code': 'InvalidChangeBatch',
+                    'Message': 'Record set was not found'}},
+                operation_name='ChangeResourceRecordSets')
+            record_set.delete(ctx, {}, 'res_type')
+            self.assertFalse(zone().get_change.called)
 
     def test_prepare_assoc(self):
         ctx = self._get_relationship_context()
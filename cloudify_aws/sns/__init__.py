@@ -16,12 +16,24 @@
     ~~~~~~~
     AWS SNS base interface
 """
+# Standard imports
+import time
+
+# Third party imports
+from botocore.exceptions import ClientError
+
 # Cloudify AWS
-from cloudify_aws.common import AWSResourceBase
+from cloudify_aws.common import AWSResourceBase, utils
 from cloudify_aws.common.connection import Boto3Connection
 
 # pylint: disable=R0903
 
+ATTRIBUTES_CACHE = 'sns-attributes'
+# Seconds attributes are reused, long enough to serve the status checks of
+# a single workflow step
+ATTRIBUTES_CACHE_TTL = 30
+NOT_FOUND = ['NotFound', 'NotFoundException', 'InvalidParameter']
+
 
 class SNSBase(AWSResourceBase):
     """
@@ -49,3 +61,49 @@ class SNSBase(AWSResourceBase):
     def delete(self, params=None):
         """Deletes a resource"""
         raise NotImplementedError()
+
+    def get_attributes(self, client_method, arn_name,
+                       ttl=ATTRIBUTES_CACHE_TTL):
+        """
+            Gets the attributes of the resource with a direct lookup by
+            ARN. Attributes are cached on this host for ttl seconds.
+        :param str client_method: get_topic_attributes or
+            get_subscription_attributes.
+        :param str arn_name: Name of the ARN parameter of client_method.
+        :returns: Dictionary of attributes, None if the resource is missing.
+        """
+        if not self.resource_id or \
+                not utils.validate_arn(self.resource_id):
+            return None
+        now = time.time()
+        with utils.local_store(ATTRIBUTES_CACHE) as store:
+            entry = store.get(self.resource_id)
+        if ttl and entry and entry['expires'] > now:
+            return entry['attributes']
+        try:
+            attributes = getattr(self.client, client_method)(
+                **{arn_name: self.resource_id}).get('Attributes', dict())
+        except ClientError as error:
+            if error.response.get('Error', dict()).get('Code') not in \
+                    NOT_FOUND:
+                raise
+            self.invalidate_attributes()
+            return None
+        self.cache_attributes(attributes, ttl)
+        return attributes
+
+    def cache_attributes(self, attributes, ttl=ATTRIBUTES_CACHE_TTL):
+        """Caches the attributes of the resource"""
+        now = time.time()
+        with utils.local_store(ATTRIBUTES_CACHE) as store:
+            for key in [key for key, entry in store.items()
+                        if entry['expires'] < now]:
+                del store[key]
+            if ttl:
+                store[self.resource_id] = dict(
+                    attributes=attributes, expires=now + ttl)
+
+    def invalidate_attributes(self):
+        """Drops the cached attributes of the resource"""
+        with utils.local_store(ATTRIBUTES_CACHE) as store:
+            store.pop(self.resource_id, None)
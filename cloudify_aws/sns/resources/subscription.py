@@ -16,9 +16,6 @@
     ~~~~~~~~
     AWS SNS Subscription interface
 """
-# Standard imports
-from botocore.exceptions import ClientError
-
 # Local imports
 from cloudify.exceptions import NonRecoverableError
 from cloudify_aws.common import decorators, utils
@@ -32,6 +29,7 @@ SUB_ARN = 'SubscriptionArn'
 TOPIC_TYPE = 'cloudify.nodes.aws.SNS.Topic'
 TOPIC_ARN = 'TopicArn'
 CONFIRM_AUTHENTICATED = 'ConfirmationWasAuthenticated'
+SUBSCRIPTION_REQUEST = 'subscription_request'
 
 
 class SNSSubscription(SNSBase):
@@ -45,16 +43,7 @@ class SNSSubscription(SNSBase):
     @property
     def properties(self):
         """Gets the properties of an external resource"""
-        try:
-            resources = \
-                self.client.list_subscriptions()
-        except ClientError:
-            pass
-        else:
-            for resource in resources:
-                if resource[SUB_ARN] == self.resource_id:
-                    return resource
-        return None
+        return self.get_attributes('get_subscription_attributes', SUB_ARN)
 
     @property
     def status(self):
@@ -77,6 +66,8 @@ class SNSSubscription(SNSBase):
                           % (self.type_name, params))
         res = self.client.get_subscription_attributes(**params)
         self.logger.debug('Response: %s' % res)
+        if params.get(SUB_ARN) == self.resource_id:
+            self.cache_attributes(res['Attributes'])
         return res['Attributes']
 
     def delete(self, params=None):
@@ -87,6 +78,7 @@ class SNSSubscription(SNSBase):
                           % (self.type_name, params))
         res = self.client.unsubscribe(**params)
         self.logger.debug('Response: %s' % res)
+        self.invalidate_attributes()
         return res
 
 
@@ -146,6 +138,12 @@ def create(ctx, iface, resource_config, **_):
     request_arn = topic_iface.subscribe(params)
     utils.update_resource_id(ctx.instance, request_arn)
     utils.update_resource_arn(ctx.instance, request_arn)
+    if not utils.validate_arn(request_arn):
+        # Subscriptions pending confirmation have no ARN yet, keep what is
+        # needed to find the subscription once it is confirmed
+        ctx.instance.runtime_properties[SUBSCRIPTION_REQUEST] = dict(
+            (key, params.get(key)) for key in [TOPIC_ARN, 'Protocol',
+                                               'Endpoint'])
 
 
 @decorators.aws_resource(SNSSubscription,
@@ -156,6 +154,22 @@ def start(ctx, iface, resource_config, **_):
 
     # Create a copy of the resource config for clean manipulation.
     params = dict() if not resource_config else resource_config.copy()
+    request = ctx.instance.runtime_properties.get(SUBSCRIPTION_REQUEST)
+    if SUB_ARN not in params and request:
+        subscription = SNSTopic(
+            ctx_node=ctx.node,
+            resource_id=request[TOPIC_ARN],
+            client=iface.client,
+            logger=ctx.logger).find_subscription(
+                request['Protocol'], request['Endpoint'])
+        arn = (subscription or dict()).get(SUB_ARN)
+        if not arn or not utils.validate_arn(arn):
+            return ctx.operation.retry(
+                'Subscription is pending confirmation. Retrying...')
+        del ctx.instance.runtime_properties[SUBSCRIPTION_REQUEST]
+        iface.update_resource_id(arn)
+        utils.update_resource_id(ctx.instance, arn)
+        utils.update_resource_arn(ctx.instance, arn)
     # Add the required SubscriptionArn parameter.
     if SUB_ARN not in params:
         arn = \
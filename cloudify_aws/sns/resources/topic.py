@@ -17,16 +17,32 @@
     AWS SNS Topic interface
 """
 # Standard imports
+import os
+import json
+import time
+from numbers import Number
+
+# Boto
 from botocore.exceptions import ClientError
 
 # Local imports
-from cloudify_aws.common import decorators, utils
+from cloudify.exceptions import NonRecoverableError
+from cloudify_aws.common._compat import text_type
+from cloudify_aws.common import constants, decorators, utils
 from cloudify_aws.sns import SNSBase
 
 RESOURCE_TYPE = 'SNS Topic'
 SUB_ARN = 'SubscriptionArn'
 TOPIC_ARN = 'TopicArn'
 RESOURCE_NAME = 'Name'
+# API limits of publish_batch
+BATCH_MAX_ENTRIES = 10
+BATCH_MAX_SIZE = 262144
+PUBLISH_FIELDS = ['Message', 'Subject', 'MessageStructure',
+                  'MessageAttributes', 'MessageDeduplicationId',
+                  'MessageGroupId']
+# Failures kept in the publish summary
+MAX_REPORTED_FAILURES = 10
 
 
 class SNSTopic(SNSBase):
@@ -40,17 +56,14 @@ class SNSTopic(SNSBase):
     @property
     def properties(self):
         """Gets the properties of an external resource"""
-        try:
-            resources = \
-                self.client.list_topics()
-        except ClientError:
-            pass
-        else:
-            for resource in resources:
-                resource_arn = resource.get('TopicArn')
-                if self.resource_id == resource_arn:
-                    return resource_arn
+        if self.attributes is None:
             return None
+        return self.resource_id
+
+    @property
+    def attributes(self):
+        """Gets the attributes of the topic"""
+        return self.get_attributes('get_topic_attributes', TOPIC_ARN)
 
     @property
     def status(self):
@@ -86,6 +99,87 @@ class SNSTopic(SNSBase):
         self.logger.debug('Deleting %s with parameters: %s'
                           % (self.type_name, params))
         self.client.delete_topic(**params)
+        self.invalidate_attributes()
+
+    def publish_batch(self, entries):
+        """
+            Publishes messages with publish_batch, or one publish call per
+            message where the client does not support it (boto3 < 1.20).
+        :param entries: Up to BATCH_MAX_ENTRIES publish_batch entries.
+        :returns: List of failures, with the Id of the failed entries.
+        """
+        publish_batch = getattr(self.client, 'publish_batch', None)
+        if not publish_batch:
+            failed = []
+            for index, entry in enumerate(entries):
+                try:
+                    self.client.publish(TopicArn=self.resource_id, **entry)
+                except ClientError as e:
+                    error = e.response.get('Error', dict())
+                    failed.append(dict(
+                        Id=text_type(index),
+                        Code=error.get('Code'),
+                        Message=error.get('Message'),
+                        SenderFault=error.get('Type') == 'Sender'))
+            return failed
+        res = publish_batch(
+            TopicArn=self.resource_id,
+            PublishBatchRequestEntries=[
+                dict(entry, Id=text_type(index))
+                for index, entry in enumerate(entries)])
+        return res.get('Failed', [])
+
+    def publish_messages(self,
+                         entries,
+                         max_workers=constants.DEFAULT_MAX_WORKERS):
+        """
+            Publishes messages to the topic in batches, on a bounded pool
+            of threads. Entries are consumed lazily.
+        :return: summary of counts, throughput, latency percentiles and the
+            first failures
+        """
+        def _publish(batch):
+            started = time.time()
+            failed = self.publish_batch(batch)
+            return failed, time.time() - started
+
+        published = 0
+        failures = []
+        failed = 0
+        latencies = []
+        started = time.time()
+        for batch, res, error in utils.iter_in_parallel(
+                _publish, iter_publish_batches(entries), max_workers):
+            if error:
+                batch_failures = [dict(Message=text_type(error))] * len(batch)
+            else:
+                batch_failures, latency = res
+                latencies.append(latency)
+            published += len(batch) - len(batch_failures)
+            failed += len(batch_failures)
+            failures.extend(batch_failures[:MAX_REPORTED_FAILURES -
+                                           len(failures)])
+        return dict(
+            published=published,
+            failed=failed,
+            failures=[dict((key, failure.get(key)) for key in
+                           ['Id', 'Code', 'Message'] if key in failure)
+                      for failure in failures],
+            **utils.get_throughput_summary(
+                published, started, latencies, (50, 99)))
+
+    def find_subscription(self, protocol, endpoint):
+        """
+            Finds a subscription of the topic by protocol and endpoint,
+            paginating through list_subscriptions_by_topic.
+        """
+        paginator = self.client.get_paginator('list_subscriptions_by_topic')
+        for page in paginator.paginate(TopicArn=self.resource_id):
+            for subscription in page.get('Subscriptions', []):
+                if subscription.get('Protocol') == protocol and \
+                        subscription.get('Endpoint') == endpoint:
+                    return subscription
+        return None
 
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
@@ -132,3 +226,118 @@ def delete(ctx, iface, resource_config, **_):
 
     # Actually delete the resource
     iface.delete(params)
+
+
+def get_message_attributes(attributes):
+    """
+        Converts message attributes given as plain values to the SNS
+        format, e.g. {"level": "high"} to {"level": {"DataType": "String",
+        "StringValue": "high"}}. Attributes already in the SNS format are
+        kept as is.
+    """
+    message_attributes = dict()
+    for name, value in (attributes or dict()).items():
+        if isinstance(value, dict) and 'DataType' in value:
+            message_attributes[name] = value
+        elif isinstance(value, list):
+            message_attributes[name] = dict(DataType='String.Array',
+                                            StringValue=json.dumps(value))
+        elif isinstance(value, Number) and not isinstance(value, bool):
+            message_attributes[name] = dict(DataType='Number',
+                                            StringValue=text_type(value))
+        else:
+            message_attributes[name] = dict(DataType='String',
+                                            StringValue=text_type(value))
+    return message_attributes
+
+
+def get_publish_entry(message, defaults):
+    """
+        Gets the publish_batch entry of a message. Objects with a Message
+        key are used as entries, strings are the message and any other
+        document is sent as JSON. Defaults fill in the missing fields.
+    """
+    if isinstance(message, dict) and 'Message' in message:
+        entry = dict((key, value) for key, value in message.items()
+                     if key in PUBLISH_FIELDS)
+    elif isinstance(message, text_type):
+        entry = dict(Message=message)
+    else:
+        entry = dict(Message=json.dumps(message))
+    for key, value in defaults.items():
+        if value and key not in entry:
+            entry[key] = value
+    if entry.get('MessageAttributes'):
+        entry['MessageAttributes'] = \
+            get_message_attributes(entry['MessageAttributes'])
+    return entry
+
+
+def iter_publish_batches(entries):
+    """
+        Groups entries into publish_batch calls, within both the entry
+        count and the payload size limits.
+    """
+    return utils.chunks_by_size(
+        entries, BATCH_MAX_ENTRIES, BATCH_MAX_SIZE,
+        lambda entry: utils.get_message_size(
+            entry['Message'], entry.get('MessageAttributes')))
+
+
+@decorators.aws_resource(SNSTopic, RESOURCE_TYPE,
+                         ignore_properties=True)
+def publish(ctx,
+            iface,
+            message=None,
+            messages=None,
+            source=None,
+            subject=None,
+            message_attributes=None,
+            message_group_id=None,
+            max_workers=constants.DEFAULT_MAX_WORKERS,
+            **_):
+    """
+        Publishes a message, a list of messages or the messages of a JSON
+        Lines file to an AWS SNS Topic, in parallel batches. A summary is
+        saved in the publish_summary runtime property.
+    """
+    messages = list(messages or [])
+    if message:
+        messages.insert(0, message)
+    if not messages and not source:
+        raise NonRecoverableError(
+            'One of message, messages or source is required.')
+    defaults = dict(Subject=subject,
+                    MessageAttributes=message_attributes,
+                    MessageGroupId=message_group_id)
+
+    path = source
+    downloaded = source and not os.path.exists(path)
+    if downloaded:
+        path = ctx.download_resource(source)
+
+    def _iter_messages():
+        for item in messages:
+            yield item
+        if path:
+            for item in utils.iter_json_lines(path):
+                yield item
+
+    try:
+        summary = iface.publish_messages(
+            (get_publish_entry(item, defaults) for item in _iter_messages()),
+            max_workers)
+    finally:
+        if downloaded:
+            os.remove(path)
+    ctx.instance.runtime_properties['publish_summary'] = summary
+    ctx.logger.info('Published %d messages to %s ID# "%s" in %.1f seconds, '
+                    '%d failed.'
+                    % (summary['published'], iface.type_name,
+                       iface.resource_id, summary['duration'],
+                       summary['failed']))
+    if summary['failed']:
+        raise NonRecoverableError(
+            'Failed to publish %d messages to %s ID# "%s", first error: %s'
+            % (summary['failed'], iface.type_name, iface.resource_id,
+               summary['failures'][0].get('Message')))
@@ -17,6 +17,7 @@ import unittest
 
 # Third party imports
 from mock import patch, MagicMock
+from botocore.exceptions import ClientError
 
 from cloudify.exceptions import NonRecoverableError
 
@@ -35,6 +36,8 @@ from cloudify_aws.sns.resources.subscription import (
 )
 
 PATCH_PREFIX = 'cloudify_aws.sns.resources.subscription.'
+TOPIC = 'arn:aws:sns:us-east-1:123456789012:topic'
+SUBSCRIPTION = TOPIC + ':a2c4b0b3-2f1f-4c2b-9a65-0a7f1c6f0a61'
 
 
 class TestSNSSubscription(TestBase):
@@ -51,36 +54,34 @@ class TestSNSSubscription(TestBase):
         reload_module(subscription)
 
     def test_class_properties(self):
-        effect = self.get_client_error_exception(name='S3 SNS')
+        effect = ClientError({'Error': {'Code': 'NotFound'}},
+                             'get_subscription_attributes')
         self.subscription.client = self.make_client_function(
-            'list_subscriptions',
+            'get_subscription_attributes',
             side_effect=effect)
+        self.subscription.resource_id = SUBSCRIPTION
         res = self.subscription.properties
         self.assertIsNone(res)
 
+        value = {'Attributes': {SUB_ARN: SUBSCRIPTION}}
         self.subscription.client = self.make_client_function(
-            'list_subscriptions',
-            return_value={})
-        res = self.subscription.properties
-        self.assertIsNone(res)
-
-        value = [{SUB_ARN: 'arn'}]
-        self.subscription.client = self.make_client_function(
-            'list_subscriptions',
+            'get_subscription_attributes',
             return_value=value)
-        self.subscription.resource_id = 'arn'
         res = self.subscription.properties
-        self.assertEqual(res, value[0])
+        self.assertEqual(res, value['Attributes'])
+        self.subscription.client.get_subscription_attributes.\
+            assert_called_once_with(SubscriptionArn=SUBSCRIPTION)
+        self.assertFalse(self.subscription.client.list_subscriptions.called)
 
     def test_class_status(self):
         res = self.subscription.status
         self.assertIsNone(res)
 
-        value = [{SUB_ARN: 'arn'}]
+        value = {'Attributes': {SUB_ARN: SUBSCRIPTION}}
         self.subscription.client = self.make_client_function(
-            'list_subscriptions',
+            'get_subscription_attributes',
             return_value=value)
-        self.subscription.resource_id = 'arn'
+        self.subscription.resource_id = SUBSCRIPTION
         res = self.subscription.status
         self.assertTrue(res)
 
@@ -170,6 +171,33 @@ class TestSNSSubscription(TestBase):
         subscription.start(ctx, iface, config)
         self.assertFalse(ctx.operation.retry.called)
 
+    def test_start_pending_confirmation(self):
+        ctx = self.get_mock_ctx("SNS", test_runtime_properties={
+            'aws_resource_id': 'pending confirmation',
+            'subscription_request': {TOPIC_ARN: TOPIC,
+                                     'Protocol': 'email',
+                                     'Endpoint': 'a@b'}})
+        ctx.operation.retry = MagicMock()
+        iface = MagicMock()
+        paginator = iface.client.get_paginator.return_value
+        paginator.paginate.return_value = [{'Subscriptions': [{
+            'Protocol': 'email', 'Endpoint': 'a@b',
+            SUB_ARN: 'PendingConfirmation'}]}]
+        subscription.start(ctx, iface, {})
+        self.assertTrue(ctx.operation.retry.called)
+        self.assertFalse(iface.confirm.called)
+
+        paginator.paginate.return_value = [{'Subscriptions': [{
+            'Protocol': 'email', 'Endpoint': 'a@b',
+            SUB_ARN: SUBSCRIPTION}]}]
+        iface.confirm = self.mock_return([CONFIRM_AUTHENTICATED])
+        ctx.operation.retry = MagicMock()
+        subscription.start(ctx, iface, {})
+        self.assertFalse(ctx.operation.retry.called)
+        iface.confirm.assert_called_with({SUB_ARN: SUBSCRIPTION})
+        self.assertNotIn('subscription_request',
+                         ctx.instance.runtime_properties)
+
     def test_delete(self):
         ctx = self.get_mock_ctx("SNS")
         config = {SUB_ARN: 'arn'}
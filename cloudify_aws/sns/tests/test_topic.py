@@ -13,12 +13,19 @@
 # limitations under the License.
 
 # Standard imports
+import os
+import time
+import tempfile
 import unittest
 
 # Third party imports
+import boto3
 from mock import patch, MagicMock
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
 
 from cloudify.state import current_ctx
+from cloudify.exceptions import NonRecoverableError
 
 # Local imports
 from cloudify_aws.common._compat import reload_module
@@ -34,6 +41,7 @@ from cloudify_aws.sns.resources.topic import (
 )
 
 PATCH_PREFIX = 'cloudify_aws.sns.resources.topic.'
+TOPIC = 'arn:aws:sns:us-east-1:123456789012:topic'
 
 
 class TestSNSTopic(TestBase):
@@ -50,39 +58,74 @@ class TestSNSTopic(TestBase):
         reload_module(topic)
 
     def test_class_properties(self):
-        effect = self.get_client_error_exception(name='S3 SNS')
+        effect = ClientError({'Error': {'Code': 'NotFound'}},
+                             'get_topic_attributes')
         self.topic.client = self.make_client_function(
-            'list_topics',
+            'get_topic_attributes',
             side_effect=effect)
+        self.topic.resource_id = TOPIC
         res = self.topic.properties
         self.assertIsNone(res)
 
-        self.topic.client = self.make_client_function(
-            'list_topics',
-            return_value={})
-        res = self.topic.properties
-        self.assertIsNone(res)
+        # Resource IDs which are not ARNs are not looked up
+        self.topic.resource_id = 'topic'
+        self.assertIsNone(self.topic.properties)
+        self.assertEqual(
+            self.topic.client.get_topic_attributes.call_count, 1)
 
-        value = [{TOPIC_ARN: 'arn'}]
+        value = {'Attributes': {TOPIC_ARN: TOPIC}}
         self.topic.client = self.make_client_function(
-            'list_topics',
+            'get_topic_attributes',
             return_value=value)
-        self.topic.resource_id = 'arn'
+        self.topic.resource_id = TOPIC
         res = self.topic.properties
-        self.assertEqual(res, 'arn')
+        self.assertEqual(res, TOPIC)
+        self.topic.client.get_topic_attributes.assert_called_once_with(
+            TopicArn=TOPIC)
+
+        # Attributes are cached until they expire
+        self.assertEqual(self.topic.attributes, {TOPIC_ARN: TOPIC})
+        self.assertEqual(
+            self.topic.client.get_topic_attributes.call_count, 1)
+        with patch('time.time', return_value=time.time() + 60):
+            self.assertEqual(self.topic.status, 'available')
+        self.assertEqual(
+            self.topic.client.get_topic_attributes.call_count, 2)
+
+        self.topic.delete({TOPIC_ARN: TOPIC})
+        self.topic.properties
+        self.assertEqual(
+            self.topic.client.get_topic_attributes.call_count, 3)
 
     def test_class_status(self):
         res = self.topic.status
         self.assertIsNone(res)
 
-        value = [{TOPIC_ARN: 'arn'}]
+        value = {'Attributes': {TOPIC_ARN: TOPIC}}
         self.topic.client = self.make_client_function(
-            'list_topics',
+            'get_topic_attributes',
             return_value=value)
-        self.topic.resource_id = 'arn'
+        self.topic.resource_id = TOPIC
         res = self.topic.status
         self.assertEqual(res, 'available')
 
+    def test_class_find_subscription(self):
+        paginator = MagicMock()
+        paginator.paginate.return_value = [
+            {'Subscriptions': [{'Protocol': 'email', 'Endpoint': 'a@b'}]},
+            {'Subscriptions': [{'Protocol': 'sqs', 'Endpoint': 'arn:q',
+                                SUB_ARN: TOPIC + ':sub'}]}]
+        self.topic.client = self.make_client_function(
+            'get_paginator', return_value=paginator)
+        self.topic.resource_id = TOPIC
+        self.assertEqual(
+            self.topic.find_subscription('sqs', 'arn:q')[SUB_ARN],
+            TOPIC + ':sub')
+        self.topic.client.get_paginator.assert_called_with(
+            'list_subscriptions_by_topic')
+        paginator.paginate.assert_called_with(TopicArn=TOPIC)
+        self.assertIsNone(self.topic.find_subscription('sqs', 'arn:other'))
+
     def test_class_create(self):
         value = {TOPIC_ARN: 'arn'}
         self.topic.client = self.make_client_function(
@@ -130,6 +173,110 @@ class TestSNSTopic(TestBase):
         topic.delete(ctx, iface, config)
         self.assertTrue(iface.delete.called)
 
+    def test_get_publish_entry(self):
+        defaults = {'Subject': None, 'MessageGroupId': 'group',
+                    'MessageAttributes': {'level': 'high'}}
+        self.assertEqual(topic.get_publish_entry('text', defaults), {
+            'Message': 'text',
+            'MessageGroupId': 'group',
+            'MessageAttributes': {'level': {'DataType': 'String',
+                                            'StringValue': 'high'}}})
+        self.assertEqual(
+            topic.get_publish_entry({'key': 1}, {})['Message'],
+            '{"key": 1}')
+        entry = topic.get_publish_entry(
+            {'Message': 'text', 'MessageGroupId': 'other', 'Id': 'x',
+             'MessageAttributes': {
+                 'count': 2, 'tags': ['a'],
+                 'raw': {'DataType': 'Binary', 'BinaryValue': b'1'}}},
+            defaults)
+        self.assertEqual(entry, {
+            'Message': 'text',
+            'MessageGroupId': 'other',
+            'MessageAttributes': {
+                'count': {'DataType': 'Number', 'StringValue': '2'},
+                'tags': {'DataType': 'String.Array',
+                         'StringValue': '["a"]'},
+                'raw': {'DataType': 'Binary', 'BinaryValue': b'1'}}})
+
+    def test_publish(self):
+        ctx = self.get_mock_ctx("SNS")
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(fd, 'w') as messages_file:
+            messages_file.write('\n'.join(
+                ['"line %d"' % i for i in range(12)]))
+        self.addCleanup(os.remove, path)
+        iface = SNSTopic("ctx_node", resource_id=TOPIC, client=MagicMock(),
+                         logger=ctx.logger)
+        iface.client.publish_batch.side_effect = [
+            {'Failed': []},
+            {'Failed': [{'Id': '1', 'Code': 'InvalidParameter',
+                         'Message': 'bad', 'SenderFault': True}]}]
+
+        with self.assertRaises(NonRecoverableError):
+            topic.publish(ctx, iface, message='first', messages=['second'],
+                          source=path, message_group_id='group',
+                          max_workers=2)
+
+        calls = iface.client.publish_batch.call_args_list
+        self.assertEqual(calls[0][1]['TopicArn'], TOPIC)
+        self.assertEqual(calls[0][1]['PublishBatchRequestEntries'][:2], [
+            {'Id': '0', 'Message': 'first', 'MessageGroupId': 'group'},
+            {'Id': '1', 'Message': 'second', 'MessageGroupId': 'group'}])
+        self.assertEqual(
+            [len(call[1]['PublishBatchRequestEntries']) for call in calls],
+            [10, 4])
+        summary = ctx.instance.runtime_properties['publish_summary']
+        self.assertEqual(summary['published'], 13)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['failures'], [
+            {'Id': '1', 'Code': 'InvalidParameter', 'Message': 'bad'}])
+        self.assertEqual(sorted(summary['latency']), ['p50', 'p99'])
+
+    def test_publish_without_batch(self):
+        ctx = self.get_mock_ctx("SNS")
+        iface = SNSTopic("ctx_node", resource_id=TOPIC,
+                         client=MagicMock(spec=['publish']),
+                         logger=ctx.logger)
+        topic.publish(ctx, iface, message={'key': 'value'},
+                      subject='subject')
+        iface.client.publish.assert_called_once_with(
+            TopicArn=TOPIC, Message='{"key": "value"}', Subject='subject')
+        self.assertEqual(
+            ctx.instance.runtime_properties['publish_summary']['published'],
+            1)
+
+        with self.assertRaises(NonRecoverableError):
+            topic.publish(ctx, iface)
+
+    def test_publish_batch_fallback(self):
+        # The pinned boto3 has no PublishBatch, entries are published one
+        # by one and failures are reported per entry.
+        client = boto3.client('sns', region_name='us-east-1',
+                              aws_access_key_id='key',
+                              aws_secret_access_key='secret')
+        self.assertFalse(hasattr(client, 'publish_batch'))
+        iface = SNSTopic("ctx_node", resource_id=TOPIC, client=client)
+        with Stubber(client) as stubber:
+            stubber.add_response(
+                'publish', {'MessageId': '1'},
+                {'TopicArn': TOPIC, 'Message': 'first'})
+            stubber.add_client_error(
+                'publish', service_error_code='InvalidParameter',
+                service_message='bad', http_status_code=400,
+                expected_params={'TopicArn': TOPIC, 'Message': 'second'})
+            stubber.add_response(
+                'publish', {'MessageId': '3'},
+                {'TopicArn': TOPIC, 'Message': 'third'})
+            summary = iface.publish_messages(
+                [{'Message': 'first'}, {'Message': 'second'},
+                 {'Message': 'third'}])
+            stubber.assert_no_pending_responses()
+        self.assertEqual(summary['published'], 2)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['failures'], [
+            {'Id': '1', 'Code': 'InvalidParameter', 'Message': 'bad'}])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -17,14 +17,17 @@
     AWS SQS Queue interface
 """
 # Standard imports
+import os
 import json
+import time
 
 # Third party imports
 from botocore.exceptions import ClientError
 
 # Local imports
-from cloudify_aws.common._compat import text_type
-from cloudify_aws.common import decorators, utils
+from cloudify.exceptions import NonRecoverableError, OperationRetry
+from cloudify_aws.common._compat import text_type, urlparse
+from cloudify_aws.common import constants, decorators, utils
 from cloudify_aws.sqs import SQSBase
 
 RESOURCE_TYPE = 'SQS Queue'
@@ -33,6 +36,15 @@ QUEUE_URL = 'QueueUrl'
 QUEUE_URLS = 'QueueUrls'
 QUEUE_ARN = 'QueueArn'
 POLICY = 'Policy'
+QUEUE_NOT_FOUND = ['AWS.SimpleQueueService.NonExistentQueue',
+                   'QueueDoesNotExist']
+# API limits of send_message_batch, receive_message and delete_message_batch
+BATCH_MAX_ENTRIES = 10
+BATCH_MAX_SIZE = 262144
+SEND_MAX_ATTEMPTS = 5
+MESSAGE_FIELDS = ['MessageBody', 'DelaySeconds', 'MessageAttributes',
+                  'MessageSystemAttributes', 'MessageDeduplicationId',
+                  'MessageGroupId']
 
 
 class SQSQueue(SQSBase):
@@ -42,19 +54,53 @@ class SQSQueue(SQSBase):
     def __init__(self, ctx_node, resource_id=None, client=None, logger=None):
         SQSBase.__init__(self, ctx_node, resource_id, client, logger)
         self.type_name = RESOURCE_TYPE
+        self._queue_url = None
+        self._attributes = None
+
+    def update_resource_id(self, resource_id):
+        '''Updates the resource_id value, dropping cached lookups'''
+        SQSBase.update_resource_id(self, resource_id)
+        self._queue_url = None
+        self._attributes = None
+
+    @property
+    def queue_url(self):
+        """
+            Gets the URL of the queue. The resource ID is either the URL or
+            the name of the queue, which is resolved once with get_queue_url.
+        """
+        if not self._queue_url and self.resource_id:
+            if urlparse(self.resource_id).scheme:
+                self._queue_url = self.resource_id
+            else:
+                try:
+                    self._queue_url = self.client.get_queue_url(
+                        QueueName=self.resource_id)[QUEUE_URL]
+                except ClientError as error:
+                    if error.response['Error']['Code'] not in \
+                            QUEUE_NOT_FOUND:
+                        raise
+        return self._queue_url
+
+    @property
+    def attributes(self):
+        """Gets all the attributes of the queue, fetched once"""
+        if self._attributes is None and self.queue_url:
+            try:
+                self._attributes = self.client.get_queue_attributes(
+                    QueueUrl=self.queue_url,
+                    AttributeNames=['All']).get('Attributes', dict())
+            except ClientError as error:
+                if error.response['Error']['Code'] not in QUEUE_NOT_FOUND:
+                    raise
+        return self._attributes
 
     @property
     def properties(self):
         """Gets the properties of an external resource"""
-        try:
-            resource = \
-                self.client.list_queues(
-                    QueueNamePrefix=self.resource_id)
-        except ClientError:
-            pass
-        else:
-            return resource.get(QUEUE_URLS, [None])[0]
-        return None
+        if self.attributes is None:
+            return None
+        return self.queue_url
 
     @property
     def status(self):
@@ -75,6 +121,72 @@ class SQSQueue(SQSBase):
                           % (self.type_name, params))
         self.client.delete_queue(**params)
 
+    def get_arn(self, queue_url):
+        """
+            Gets the ARN of a queue from its URL, which holds the account
+            and the name, falling back to get_queue_attributes.
+        """
+        path = urlparse(queue_url).path.strip('/').split('/')
+        if len(path) == 2 and self.client.meta.region_name:
+            return 'arn:{0}:sqs:{1}:{2}:{3}'.format(
+                self.client.meta.partition, self.client.meta.region_name,
+                path[0], path[1])
+        try:
+            return self.client.get_queue_attributes(
+                QueueUrl=queue_url,
+                AttributeNames=[QUEUE_ARN]).get(
+                    'Attributes', dict()).get(QUEUE_ARN)
+        except ClientError:
+            return None
+
+    def send_batch(self, entries):
+        """
+            Sends messages with send_message_batch, retrying the entries
+            that failed on the server side.
+        :param entries: Up to BATCH_MAX_ENTRIES send_message_batch entries.
+        :returns: List of the entries that failed, with their errors.
+        """
+        entries = dict((text_type(index), entry)
+                       for index, entry in enumerate(entries))
+        failed = []
+        for attempt in range(SEND_MAX_ATTEMPTS):
+            res = self.client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[dict(entry, Id=entry_id)
+                         for entry_id, entry in sorted(entries.items())])
+            retries = dict()
+            for failure in res.get('Failed', []):
+                if failure.get('SenderFault') or \
+                        attempt == SEND_MAX_ATTEMPTS - 1:
+                    failed.append(dict(
+                        failure, Entry=entries[failure['Id']]))
+                else:
+                    retries[failure['Id']] = entries[failure['Id']]
+            if not retries:
+                break
+            entries = retries
+            time.sleep(min(5, 0.1 * 2 ** attempt))
+        return failed
+
+    def drain_batch(self, visibility_timeout=30, wait_time=1):
+        """
+            Receives up to BATCH_MAX_ENTRIES messages and deletes them.
+        :returns: Number of deleted messages.
+        """
+        messages = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=BATCH_MAX_ENTRIES,
+            VisibilityTimeout=visibility_timeout,
+            WaitTimeSeconds=wait_time).get('Messages', [])
+        if not messages:
+            return 0
+        res = self.client.delete_message_batch(
+            QueueUrl=self.queue_url,
+            Entries=[dict(Id=text_type(index),
+                          ReceiptHandle=message['ReceiptHandle'])
+                     for index, message in enumerate(messages)])
+        return len(res.get('Successful', []))
+
 
 @decorators.aws_resource(resource_type=RESOURCE_TYPE)
 def prepare(ctx, resource_config, **_):
@@ -106,19 +218,8 @@ def create(ctx, iface, resource_config, **_):
 
     # Actually create the resource
     create_response = iface.create(params)
-    # Attempt to retrieve the ARN.
-    try:
-        resource_attributes = iface.client.get_queue_attributes(
-            QueueUrl=create_response[QUEUE_URL],
-            AttributeNames=[QUEUE_ARN])
-    except ClientError:
-        utils.update_resource_arn(
-            ctx.instance,
-            None)
-    else:
-        utils.update_resource_arn(
-            ctx.instance,
-            resource_attributes.get('Attributes', {}).get(QUEUE_ARN))
+    utils.update_resource_arn(
+        ctx.instance, iface.get_arn(create_response[QUEUE_URL]))
     utils.update_resource_id(ctx.instance, create_response[QUEUE_URL])
 
 
@@ -135,3 +236,128 @@ def delete(iface, resource_config, **_):
 
     # Actually delete the resource
     iface.delete(params)
+
+
+def _iter_message_entries(path):
+    """
+        Streams send_message_batch entries from a JSON Lines file. Lines
+        holding an object with a MessageBody are used as entries, any other
+        document is sent as the message body.
+    """
+    for document in utils.iter_json_lines(path):
+        if isinstance(document, dict) and 'MessageBody' in document:
+            yield dict((key, value) for key, value in document.items()
+                       if key in MESSAGE_FIELDS)
+        else:
+            yield dict(MessageBody=document
+                       if isinstance(document, text_type)
+                       else json.dumps(document))
+
+
+def iter_message_batches(entries):
+    """
+        Groups entries into send_message_batch calls, within both the
+        entry count and the payload size limits.
+    """
+    return utils.chunks_by_size(
+        entries, BATCH_MAX_ENTRIES, BATCH_MAX_SIZE,
+        lambda entry: utils.get_message_size(
+            entry['MessageBody'], entry.get('MessageAttributes')))
+
+
+@decorators.aws_resource(SQSQueue, RESOURCE_TYPE,
+                         ignore_properties=True)
+def send_messages(ctx,
+                  iface,
+                  source,
+                  max_workers=constants.DEFAULT_MAX_WORKERS,
+                  **_):
+    """
+        Sends the messages of a JSON Lines file to an AWS SQS Queue, in
+        batches sent by a bounded pool of threads. The file is streamed, so
+        it can be larger than the available memory.
+    """
+    path = source
+    downloaded = not os.path.exists(path)
+    if downloaded:
+        path = ctx.download_resource(source)
+    started = time.time()
+    sent = 0
+    failed = []
+    try:
+        for batch, failures, error in utils.iter_in_parallel(
+                iface.send_batch,
+                iter_message_batches(_iter_message_entries(path)),
+                max_workers):
+            if error:
+                failures = [dict(Entry=entry, Message=text_type(error))
+                            for entry in batch]
+            sent += len(batch) - len(failures)
+            failed.extend(failures)
+    finally:
+        if downloaded:
+            os.remove(path)
+    summary = dict(source=source, sent=sent, failed=len(failed),
+                   **utils.get_throughput_summary(sent, started))
+    ctx.instance.runtime_properties['send_summary'] = summary
+    ctx.logger.info('Sent %d messages to %s ID# "%s" in %.1f seconds.'
+                    % (sent, iface.type_name, iface.resource_id,
+                       summary['duration']))
+    if failed:
+        raise NonRecoverableError(
+            'Failed to send %d messages to %s ID# "%s", first error: %s'
+            % (len(failed), iface.type_name, iface.resource_id,
+               failed[0].get('Message')))
+
+
+@decorators.aws_resource(SQSQueue, RESOURCE_TYPE,
+                         ignore_properties=True)
+def purge(ctx,
+          iface,
+          drain=False,
+          max_workers=constants.DEFAULT_MAX_WORKERS,
+          max_messages=0,
+          timeout=300,
+          **_):
+    """
+        Empties an AWS SQS Queue. By default the queue is purged with
+        purge_queue, which is limited to once a minute and takes effect
+        asynchronously. With drain, messages are received and deleted in
+        parallel until the queue is empty, max_messages are deleted or the
+        timeout expires.
+    """
+    if not drain:
+        try:
+            iface.client.purge_queue(QueueUrl=iface.queue_url)
+        except ClientError as error:
+            if error.response['Error']['Code'] != \
+                    'AWS.SimpleQueueService.PurgeQueueInProgress':
+                raise
+            raise OperationRetry(
+                'A purge of %s ID# "%s" is already in progress.'
+                % (iface.type_name, iface.resource_id), retry_after=60)
+        ctx.logger.info('Purged %s ID# "%s".'
+                        % (iface.type_name, iface.resource_id))
+        return
+
+    started = time.time()
+    deleted = 0
+    while time.time() - started < timeout:
+        if max_messages and deleted >= max_messages:
+            break
+        results = utils.run_in_parallel(
+            lambda _worker: iface.drain_batch(), range(max_workers),
+            max_workers)
+        errors = [error for _worker, _count, error in results if error]
+        if errors:
+            raise errors[0]
+        count = sum(count for _worker, count, _error in results)
+        if not count:
+            break
+        deleted += count
+    summary = dict(deleted=deleted,
+                   **utils.get_throughput_summary(deleted, started))
+    ctx.instance.runtime_properties['drain_summary'] = summary
+    ctx.logger.info('Drained %d messages from %s ID# "%s" in %.1f seconds.'
+                    % (deleted, iface.type_name, iface.resource_id,
+                       summary['duration']))
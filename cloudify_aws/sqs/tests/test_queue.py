@@ -14,13 +14,16 @@
 
 # Standard imports
 from __future__ import unicode_literals
+import os
+import tempfile
 import unittest
 
 # Third party imports
 from mock import patch, MagicMock
-from botocore.exceptions import UnknownServiceError
+from botocore.exceptions import ClientError, UnknownServiceError
 
 from cloudify.state import current_ctx
+from cloudify.exceptions import NonRecoverableError, OperationRetry
 
 # Local imports
 from cloudify_aws.common._compat import text_type
@@ -73,6 +76,9 @@ RUNTIME_PROPERTIES_AFTER_CREATE = {
     'resource_config': {}
 }
 
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/test-queue'
+QUEUE_ARN = 'arn:aws:sqs:us-east-1:123456789012:test-queue'
+
 POLICY_STRING = (
     """{"Version": "2012-10-17", "Statement": [{"Action": ["SQS:SendMessag""" +
     """e", "SQS:ReceiveMessage"], "Sid": "Sid1", "Resource": "test-queue",""" +
@@ -249,6 +255,9 @@ class TestSQSQueue(TestBase):
         self.assertEqual(test_instance.status, None)
 
     def test_SQSQueueClass_properties(self):
+        self.fake_client.get_queue_url = MagicMock(side_effect=ClientError(
+            {'Error': {'Code': 'AWS.SimpleQueueService.NonExistentQueue'}},
+            'get_queue_url'))
         test_instance = queue.SQSQueue(
             "ctx_node", resource_id='queue_id', client=self.fake_client,
             logger=None
@@ -256,27 +265,137 @@ class TestSQSQueue(TestBase):
 
         self.assertEqual(test_instance.properties, None)
 
-        self.fake_client.list_queues.assert_called_with(
-            QueueNamePrefix='queue_id'
+        self.fake_client.get_queue_url.assert_called_with(
+            QueueName='queue_id'
         )
+        self.assertFalse(self.fake_client.list_queues.called)
 
-    def test_SQSQueueClass_properties_list_queue(self):
-        self.fake_client.list_queues = MagicMock(
-            return_value={
-                'QueueUrls': ['c']
-            }
+    def test_SQSQueueClass_properties_get_queue_url(self):
+        self.fake_client.get_queue_url = MagicMock(
+            return_value={'QueueUrl': QUEUE_URL})
+        self.fake_client.get_queue_attributes = MagicMock(
+            return_value={'Attributes': {'QueueArn': QUEUE_ARN}})
+
+        test_instance = queue.SQSQueue(
+            "ctx_node", resource_id='queue_id', client=self.fake_client,
+            logger=None
         )
 
+        self.assertEqual(test_instance.properties, QUEUE_URL)
+        self.assertEqual(test_instance.attributes, {'QueueArn': QUEUE_ARN})
+        self.fake_client.get_queue_url.assert_called_once_with(
+            QueueName='queue_id')
+        self.fake_client.get_queue_attributes.assert_called_once_with(
+            QueueUrl=QUEUE_URL, AttributeNames=['All'])
+
+        # A URL resource ID is used as is
+        test_instance.update_resource_id(QUEUE_URL)
+        self.assertEqual(test_instance.properties, QUEUE_URL)
+        self.assertEqual(self.fake_client.get_queue_url.call_count, 1)
+        self.assertEqual(self.fake_client.get_queue_attributes.call_count, 2)
+
+    def test_SQSQueueClass_get_arn(self):
+        self.fake_client.meta.region_name = 'us-east-1'
+        self.fake_client.meta.partition = 'aws'
         test_instance = queue.SQSQueue(
             "ctx_node", resource_id='queue_id', client=self.fake_client,
             logger=None
         )
 
-        self.assertEqual(test_instance.properties, 'c')
+        self.assertEqual(test_instance.get_arn(QUEUE_URL), QUEUE_ARN)
+        self.assertFalse(self.fake_client.get_queue_attributes.called)
 
-        self.fake_client.list_queues.assert_called_with(
-            QueueNamePrefix='queue_id'
+    def _queue_ctx(self):
+        _ctx = self.get_mock_ctx(
+            'test_queue',
+            test_properties=NODE_PROPERTIES,
+            test_runtime_properties={'aws_resource_id': QUEUE_URL,
+                                     'resource_config': {}},
+            type_hierarchy=QUEUE_TH
         )
+        current_ctx.set(_ctx)
+        return _ctx
+
+    def _messages_file(self, lines):
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(fd, 'w') as messages_file:
+            messages_file.write('\n'.join(lines))
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_send_messages(self):
+        _ctx = self._queue_ctx()
+        path = self._messages_file(
+            ['"plain"', '{"key": 1}',
+             '{"MessageBody": "fifo", "MessageGroupId": "g", "Id": "x"}'] +
+            ['"message %d"' % i for i in range(20)])
+        self.fake_client.send_message_batch = MagicMock(side_effect=[
+            {'Failed': [{'Id': '1', 'SenderFault': False}]},
+            {'Failed': []},
+            {'Failed': [{'Id': '0', 'SenderFault': True,
+                         'Message': 'too big'}]},
+            {'Failed': []}])
+
+        with self.assertRaises(NonRecoverableError):
+            queue.send_messages(ctx=_ctx, iface=None, source=path,
+                                max_workers=1)
+
+        calls = self.fake_client.send_message_batch.call_args_list
+        self.assertEqual(calls[0][1]['QueueUrl'], QUEUE_URL)
+        self.assertEqual(calls[0][1]['Entries'][:3], [
+            {'Id': '0', 'MessageBody': 'plain'},
+            {'Id': '1', 'MessageBody': '{"key": 1}'},
+            {'Id': '2', 'MessageBody': 'fifo', 'MessageGroupId': 'g'}])
+        # The failed entry is retried alone
+        self.assertEqual(calls[1][1]['Entries'], [
+            {'Id': '1', 'MessageBody': '{"key": 1}'}])
+        self.assertEqual([len(call[1]['Entries']) for call in calls],
+                         [10, 1, 10, 3])
+        self.assertEqual(
+            _ctx.instance.runtime_properties['send_summary']['sent'], 22)
+        self.assertEqual(
+            _ctx.instance.runtime_properties['send_summary']['failed'], 1)
+
+    def test_iter_message_batches(self):
+        entries = [{'MessageBody': 'a' * 100000} for _ in range(3)] + \
+            [{'MessageBody': 'b'} for _ in range(12)]
+        self.assertEqual(
+            [len(batch) for batch in queue.iter_message_batches(entries)],
+            [2, 10, 3])
+
+    def test_purge(self):
+        _ctx = self._queue_ctx()
+        queue.purge(ctx=_ctx, iface=None)
+        self.fake_client.purge_queue.assert_called_with(QueueUrl=QUEUE_URL)
+
+        self.fake_client.purge_queue = MagicMock(side_effect=ClientError(
+            {'Error': {
+                'Code': 'AWS.SimpleQueueService.PurgeQueueInProgress'}},
+            'purge_queue'))
+        with self.assertRaises(OperationRetry):
+            queue.purge(ctx=_ctx, iface=None)
+
+    def test_purge_drain(self):
+        _ctx = self._queue_ctx()
+        messages = [{'Messages': [{'ReceiptHandle': 'a'},
+                                  {'ReceiptHandle': 'b'}]},
+                    {'Messages': [{'ReceiptHandle': 'c'}]},
+                    {}, {}]
+        self.fake_client.receive_message = MagicMock(side_effect=messages)
+        self.fake_client.delete_message_batch = MagicMock(side_effect=[
+            {'Successful': [{'Id': '0'}, {'Id': '1'}]},
+            {'Successful': [{'Id': '0'}]}])
+
+        queue.purge(ctx=_ctx, iface=None, drain=True, max_workers=2)
+
+        self.assertFalse(self.fake_client.purge_queue.called)
+        self.fake_client.delete_message_batch.assert_any_call(
+            QueueUrl=QUEUE_URL,
+            Entries=[{'Id': '0', 'ReceiptHandle': 'a'},
+                     {'Id': '1', 'ReceiptHandle': 'b'}])
+        self.assertEqual(self.fake_client.receive_message.call_count, 4)
+        self.assertEqual(
+            _ctx.instance.runtime_properties['drain_summary']['deleted'], 3)
 
 
 if __name__ == '__main__':
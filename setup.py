@@ -46,8 +46,9 @@ setup(
     description='A Cloudify plugin for AWS',
     install_requires=[
         'cloudify-common>=4.5',
-        'boto3==1.12.13',
+        'boto3==1.17.112',
         'botocore',
+        'fasteners',
         'pycryptodome==3.9.7'
     ]
 )